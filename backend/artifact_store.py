@@ -0,0 +1,317 @@
+"""
+Artifact store for Speedy Statements
+Keeps generated downloads (drafts, reports, batch ZIPs) under an ID with a TTL and a disk
+quota, evicting the least recently used files first. A janitor thread deletes expired
+artifacts and files that crashed or older runs left behind. The registry is an SQLite
+database in the artifact folder, so every API worker process sees the same downloads
+"""
+import glob
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Default lifetime of an artifact (1 hour)
+DEFAULT_TTL = 60 * 60
+# Default disk quota for all artifacts (2 GB)
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Default time between janitor sweeps (5 minutes)
+DEFAULT_JANITOR_INTERVAL = 5 * 60
+
+
+class Artifact:
+    """One generated file"""
+
+    def __init__(self, file_id: str, path: str, filename: str, size: int, expires_at: float,
+                 created_at: Optional[float] = None, last_access: Optional[float] = None):
+        self.file_id = file_id
+        self.path = path
+        # Name the file is downloaded under
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at or time.time()
+        self.last_access = last_access or self.created_at
+        self.expires_at = expires_at
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_COLUMNS = 'file_id, path, filename, size, expires_at, created_at, last_access'
+
+
+class ArtifactStore:
+    """Generated files by ID, bounded by a TTL and a total size, shared by all worker processes"""
+
+    def __init__(self, directory: str, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES,
+                 janitor_interval: float = DEFAULT_JANITOR_INTERVAL, orphan_patterns: Optional[List[str]] = None):
+        """
+        Initialize the store
+
+        Args:
+            directory: Folder new artifacts are written to (see path_for())
+            ttl: Seconds an artifact stays downloadable
+            max_bytes: Total size of all artifacts; least recently used ones are evicted past it
+            janitor_interval: Seconds between janitor sweeps
+            orphan_patterns: Glob patterns of leftover files and folders the janitor deletes
+                once they are older than the TTL. Unregistered files in directory are always swept
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.janitor_interval = janitor_interval
+        # Hidden, so the sweep of unregistered files in directory never matches it
+        self.db_path = os.path.join(directory, '.artifacts.db')
+        self.orphan_patterns = list(orphan_patterns or []) + [os.path.join(directory, '*')]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._janitor: Optional[threading.Thread] = None
+        self._janitor_tasks: List[Callable[[], Any]] = []
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+        # Shared by several worker processes, so use WAL and wait on locks
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    file_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    @classmethod
+    def from_environment(cls, orphan_patterns: Optional[List[str]] = None) -> 'ArtifactStore':
+        """
+        Build the store from ARTIFACT_DIR, ARTIFACT_TTL (seconds), ARTIFACT_MAX_BYTES
+        and ARTIFACT_JANITOR_INTERVAL (seconds)
+        """
+        directory = os.environ.get('ARTIFACT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'speedystatements_artifacts'
+        )
+        settings = {}
+        for name, key, default, kind in (
+            ('ARTIFACT_TTL', 'ttl', DEFAULT_TTL, float),
+            ('ARTIFACT_MAX_BYTES', 'max_bytes', DEFAULT_MAX_BYTES, int),
+            ('ARTIFACT_JANITOR_INTERVAL', 'janitor_interval', DEFAULT_JANITOR_INTERVAL, float),
+        ):
+            try:
+                settings[key] = kind(os.environ.get(name, default))
+            except ValueError:
+                logging.warning(f"Ignoring invalid {name} value: {os.environ[name]}")
+                settings[key] = default
+        return cls(directory, orphan_patterns=orphan_patterns, **settings)
+
+    def path_for(self, filename: str) -> str:
+        """Where to write a new artifact called filename"""
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def add(self, file_id: str, path: str, filename: Optional[str] = None, ttl: Optional[float] = None) -> Artifact:
+        """
+        Register a finished file for download, evicting older artifacts if over quota
+
+        Args:
+            file_id: Download ID
+            path: The file; it is deleted when the artifact expires or is evicted
+            filename: Download name (default: the file's own name)
+            ttl: Lifetime in seconds, if it should differ from the store's default
+
+        Returns:
+            The new artifact
+        """
+        artifact = Artifact(
+            file_id=file_id,
+            path=path,
+            filename=filename or os.path.basename(path),
+            size=os.path.getsize(path),
+            expires_at=time.time() + (self.ttl if ttl is None else ttl)
+        )
+        with self._lock, self._conn:
+            # Take the write lock up front: other workers may be adding or evicting too
+            self._conn.execute('BEGIN IMMEDIATE')
+            replaced = self._fetch(file_id)
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO artifacts ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (artifact.file_id, artifact.path, artifact.filename, artifact.size,
+                 artifact.expires_at, artifact.created_at, artifact.last_access)
+            )
+            evicted = self._evict_over_quota(keep=file_id)
+        if replaced is not None and replaced.path != path:
+            _remove_path(replaced.path)
+        for victim in evicted:
+            _remove_path(victim.path)
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} artifact(s) to stay under {self.max_bytes} bytes")
+        return artifact
+
+    def _fetch(self, file_id: str) -> Optional[Artifact]:
+        row = self._conn.execute(f'SELECT {_COLUMNS} FROM artifacts WHERE file_id = ?', (file_id,)).fetchone()
+        return Artifact(*row) if row else None
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        self._conn.execute(
+            'INSERT INTO stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, amount)
+        )
+
+    def _evict_over_quota(self, keep: str) -> List[Artifact]:
+        """Drop least recently used artifacts until under quota (call inside a write transaction)"""
+        evicted = []
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        rows = self._conn.execute(
+            f'SELECT {_COLUMNS} FROM artifacts WHERE file_id != ? ORDER BY last_access ASC', (keep,)
+        )
+        for row in rows.fetchall():
+            if total <= self.max_bytes:
+                break
+            artifact = Artifact(*row)
+            self._conn.execute('DELETE FROM artifacts WHERE file_id = ?', (artifact.file_id,))
+            total -= artifact.size
+            evicted.append(artifact)
+        if evicted:
+            self._count('evictions', len(evicted))
+        return evicted
+
+    def get(self, file_id: str) -> Optional[Artifact]:
+        """
+        Look up an artifact and mark it as recently used
+
+        Returns:
+            The artifact, or None if it is unknown, expired or its file is gone
+        """
+        with self._lock, self._conn:
+            artifact = self._fetch(file_id)
+            if artifact is None:
+                return None
+            if artifact.expires_at < time.time() or not os.path.exists(artifact.path):
+                self._conn.execute('DELETE FROM artifacts WHERE file_id = ?', (file_id,))
+                expired = artifact
+            else:
+                artifact.last_access = time.time()
+                self._conn.execute(
+                    'UPDATE artifacts SET last_access = ? WHERE file_id = ?', (artifact.last_access, file_id)
+                )
+                return artifact
+        _remove_path(expired.path)
+        return None
+
+    def purge_expired(self) -> int:
+        """
+        Delete artifacts past their TTL
+
+        Returns:
+            Number of artifacts deleted
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute(f'SELECT {_COLUMNS} FROM artifacts WHERE expires_at < ?', (now,)).fetchall()
+            expired = [Artifact(*row) for row in rows]
+            if expired:
+                self._conn.executemany(
+                    'DELETE FROM artifacts WHERE file_id = ?', [(a.file_id,) for a in expired]
+                )
+                self._count('expirations', len(expired))
+        for artifact in expired:
+            _remove_path(artifact.path)
+        return len(expired)
+
+    def sweep_orphans(self) -> int:
+        """
+        Delete files and folders matching the orphan patterns that no artifact refers to
+        and that have not been modified for longer than the TTL
+
+        Returns:
+            Number of paths deleted
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            live_paths = {os.path.abspath(row[0]) for row in self._conn.execute('SELECT path FROM artifacts')}
+        removed = 0
+        for pattern in self.orphan_patterns:
+            for path in glob.glob(pattern):
+                if os.path.abspath(path) in live_paths:
+                    continue
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                except OSError:
+                    continue
+                _remove_path(path)
+                removed += 1
+        if removed:
+            with self._lock, self._conn:
+                self._count('orphans_removed', removed)
+            logging.info(f"Removed {removed} orphaned file(s)")
+        return removed
+
+    def add_janitor_task(self, task: Callable[[], Any]) -> None:
+        """Also run task on every janitor sweep (e.g. purging another store's expired entries)"""
+        self._janitor_tasks.append(task)
+
+    def start_janitor(self) -> None:
+        """Sweep expired artifacts and orphans every janitor_interval seconds on a daemon thread"""
+        if self._janitor is not None:
+            return
+        self._stop.clear()
+        self._janitor = threading.Thread(target=self._run_janitor, name='artifact-janitor', daemon=True)
+        self._janitor.start()
+
+    def _run_janitor(self) -> None:
+        while True:
+            try:
+                self.purge_expired()
+                self.sweep_orphans()
+            except Exception as e:
+                logging.error(f"Artifact janitor failed: {e}")
+            for task in self._janitor_tasks:
+                try:
+                    task()
+                except Exception as e:
+                    logging.error(f"Janitor task {getattr(task, '__qualname__', task)} failed: {e}")
+            if self._stop.wait(self.janitor_interval):
+                return
+
+    def stop_janitor(self) -> None:
+        self._stop.set()
+        if self._janitor is not None:
+            self._janitor.join()
+            self._janitor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Bytes in use, quota and eviction/expiry counters"""
+        with self._lock:
+            counters = dict(self._conn.execute('SELECT name, value FROM stats').fetchall())
+            artifacts, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts'
+            ).fetchone()
+        return {
+            'artifacts': artifacts,
+            'bytes_in_use': size,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'evictions': counters.get('evictions', 0),
+            'expirations': counters.get('expirations', 0),
+            'orphans_removed': counters.get('orphans_removed', 0)
+        }
@@ -0,0 +1,570 @@
+"""
+Background batch jobs for Speedy Statements
+Runs the items of a batch on worker threads outside the HTTP request, with progress,
+throughput/ETA and cancellation. Each item's state is checkpointed to SQLite, so a
+restarted server resumes unfinished batches without redoing finished items. The database
+is shared by all API worker processes: any of them can report on or cancel a job, and
+each job is run (and resumed) by exactly one of them
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# How long finished jobs stay queryable (24 hours)
+DEFAULT_RETENTION = 24 * 60 * 60
+
+# Item states
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# (process_item, finalize, cleanup) for one job; see BatchJobManager.submit()
+JobCallbacks = Tuple[Callable, Callable, Optional[Callable]]
+
+
+def _try_lock(fd: int) -> bool:
+    """Take an exclusive lock on an open file without waiting; the OS drops it when the process dies"""
+    try:
+        if os.name == 'nt':  # Windows
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def default_job_dir() -> Path:
+    """Job state directory next to the JSON data directory"""
+    if os.name == 'nt':  # Windows
+        appdata = os.environ.get('APPDATA', os.path.expanduser('~'))
+        return Path(appdata) / 'SpeedyStatements' / 'jobs'
+    return Path.home() / '.speedystatements' / 'jobs'
+
+
+class BatchJob:
+    """Progress and results of one batch"""
+
+    def __init__(self, job_id: str, items: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        # Each item carries its 'status' (pending/done/failed/skipped) and 'result'
+        self.items = items
+        # Settings the callbacks are rebuilt from when the job is resumed
+        self.params = params or {}
+        self.total = len(items)
+        # queued -> running -> completed / cancelled / failed
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Set by the finalize callback, e.g. {'file_id': ..., 'filename': ..., 'download_url': ...}
+        self.artifact: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        for item in items:
+            item.setdefault('status', PENDING)
+            item.setdefault('result', None)
+        self._outstanding = sum(1 for item in items if item['status'] == PENDING)
+        # Items processed by this process; throughput of a resumed job starts again from zero
+        self._processed_here = 0
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('completed', 'cancelled', 'failed')
+
+    @property
+    def successful(self) -> List[Dict[str, Any]]:
+        """Same structure as /outlook/batch-create, in item order"""
+        return [item['result'] for item in self.items if item['status'] == DONE]
+
+    @property
+    def failed(self) -> List[Dict[str, Any]]:
+        """Same structure as /outlook/batch-create, in item order"""
+        return [item['result'] for item in self.items if item['status'] == FAILED]
+
+    def status(self) -> Dict[str, Any]:
+        """Counts, throughput and ETA for the status endpoint"""
+        with self._lock:
+            successful = self.successful
+            failed = self.failed
+            skipped = sum(1 for item in self.items if item['status'] == SKIPPED)
+            processed = len(successful) + len(failed)
+            remaining = self.total - processed - skipped
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            throughput = self._processed_here / elapsed if elapsed > 0 else 0.0
+            eta = remaining / throughput if throughput > 0 and self.state == 'running' else None
+            status = {
+                'job_id': self.job_id,
+                'state': self.state,
+                'cancel_requested': self.cancel_requested,
+                'progress': {
+                    'total': self.total,
+                    'done': len(successful),
+                    'failed': len(failed),
+                    'remaining': remaining,
+                    'skipped': skipped,
+                    'elapsed_seconds': round(elapsed, 2),
+                    'throughput_per_second': round(throughput, 2),
+                    'eta_seconds': round(eta, 1) if eta is not None else None
+                },
+                'summary': {
+                    'total': processed,
+                    'successful': len(successful),
+                    'failed': len(failed)
+                },
+                'successful': successful,
+                'failed': failed
+            }
+            if self.artifact:
+                status.update(self.artifact)
+            if self.error:
+                status['error'] = self.error
+        return status
+
+
+class BatchJobStore:
+    """SQLite checkpoint of each job and the state of every one of its items"""
+
+    def __init__(self, db_path: str):
+        """
+        Open the store, creating the database if needed
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    params TEXT NOT NULL,
+                    artifact TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            ''')
+            # Added for multiple workers: which process runs the job, and its progress there
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+            for column, definition in (
+                ('owner', 'TEXT'),
+                ('started_at', 'REAL'),
+                ('processed', 'INTEGER NOT NULL DEFAULT 0'),
+            ):
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS items (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    item TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    PRIMARY KEY (job_id, idx)
+                )
+            ''')
+
+    def add_job(self, job: BatchJob, owner: str) -> None:
+        """Store a new job with all its items pending, run by owner"""
+        rows = []
+        for index, item in enumerate(job.items):
+            fields = {k: v for k, v in item.items() if k not in ('status', 'result')}
+            rows.append((job.job_id, index, json.dumps(fields), item['status']))
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO jobs (job_id, state, params, created_at, owner) VALUES (?, ?, ?, ?, ?)',
+                (job.job_id, job.state, json.dumps(job.params), job.created_at, owner)
+            )
+            self._conn.executemany(
+                'INSERT INTO items (job_id, idx, item, status) VALUES (?, ?, ?, ?)', rows
+            )
+
+    def set_started(self, job: BatchJob) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, started_at = ? WHERE job_id = ?',
+                (job.state, job.started_at, job.job_id)
+            )
+
+    def set_item(self, job_id: str, index: int, status: str, result: Optional[Dict[str, Any]]) -> None:
+        """Checkpoint one item"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE items SET status = ?, result = ? WHERE job_id = ? AND idx = ?',
+                (status, json.dumps(result) if result is not None else None, job_id, index)
+            )
+            if status != SKIPPED:
+                self._conn.execute('UPDATE jobs SET processed = processed + 1 WHERE job_id = ?', (job_id,))
+
+    def set_cancel_requested(self, job_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?', (job_id,))
+
+    def cancel_requested(self, job_id: str) -> bool:
+        """Whether any worker asked to cancel the job"""
+        with self._lock:
+            row = self._conn.execute('SELECT cancel_requested FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def claim_unowned(self, owner: str, owner_alive: Callable[[str], bool]) -> List[str]:
+        """
+        Take over the unfinished jobs whose owner is gone
+
+        Runs in one write transaction, so when several workers start at once each job
+        is claimed by only one of them.
+
+        Args:
+            owner: The claiming manager
+            owner_alive: Tells whether another owner's process is still running
+
+        Returns:
+            IDs of the claimed jobs
+        """
+        claimed = []
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute(
+                "SELECT job_id, owner FROM jobs WHERE state NOT IN ('completed', 'cancelled', 'failed')"
+            ).fetchall()
+            for job_id, current in rows:
+                if current == owner or (current and owner_alive(current)):
+                    continue
+                # Throughput restarts from zero in the new process
+                self._conn.execute(
+                    'UPDATE jobs SET owner = ?, processed = 0, started_at = NULL WHERE job_id = ?',
+                    (owner, job_id)
+                )
+                claimed.append(job_id)
+        return claimed
+
+    def finish_job(self, job: BatchJob) -> None:
+        """Record the final state and artifact of a job, and item results finalize may have updated"""
+        results = [
+            (json.dumps(item['result']) if item['result'] is not None else None, job.job_id, index)
+            for index, item in enumerate(job.items)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, artifact = ?, error = ?, finished_at = ? WHERE job_id = ?',
+                (job.state, json.dumps(job.artifact) if job.artifact else None,
+                 job.error, job.finished_at, job.job_id)
+            )
+            self._conn.executemany('UPDATE items SET result = ? WHERE job_id = ? AND idx = ?', results)
+
+    def delete_finished_before(self, cutoff: float) -> None:
+        """Delete jobs (and their items) that finished before cutoff"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM items WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at < ?)', (cutoff,)
+            )
+            self._conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+
+    def load_job(self, job_id: str) -> Optional[BatchJob]:
+        """
+        Rebuild one stored job with its items, e.g. for a job another worker runs
+
+        Returns:
+            The job, or None if it is unknown
+        """
+        jobs = self.load_jobs(job_id)
+        return jobs[0] if jobs else None
+
+    def load_jobs(self, job_id: Optional[str] = None) -> List[BatchJob]:
+        """
+        Rebuild every stored job (or only job_id) with its items
+
+        Returns:
+            Jobs, oldest first
+        """
+        where, args = ('WHERE job_id = ? ', (job_id,)) if job_id else ('', ())
+        with self._lock:
+            job_rows = self._conn.execute(
+                'SELECT job_id, state, cancel_requested, params, artifact, error, created_at, finished_at, '
+                f'started_at, processed FROM jobs {where}ORDER BY created_at', args
+            ).fetchall()
+            item_rows = self._conn.execute(
+                f'SELECT job_id, item, status, result FROM items {where}ORDER BY job_id, idx', args
+            ).fetchall()
+
+        items_by_job: Dict[str, List[Dict[str, Any]]] = {}
+        for job_id, fields, status, result in item_rows:
+            item = json.loads(fields)
+            item['status'] = status
+            item['result'] = json.loads(result) if result else None
+            items_by_job.setdefault(job_id, []).append(item)
+
+        jobs = []
+        for (job_id, state, cancel_requested, params, artifact, error, created_at, finished_at,
+             started_at, processed) in job_rows:
+            job = BatchJob(job_id, items_by_job.get(job_id, []), json.loads(params))
+            job.state = state
+            job.created_at = created_at
+            job.started_at = started_at
+            job.finished_at = finished_at
+            job._processed_here = processed
+            job.artifact = json.loads(artifact) if artifact else None
+            job.error = error
+            if cancel_requested:
+                job._cancel.set()
+            jobs.append(job)
+        return jobs
+
+
+class BatchJobManager:
+    """
+    Thread pool that processes the items of submitted batch jobs
+
+    Each manager (one per worker process) holds a lock file under <directory>/owners for
+    as long as its process lives. Jobs record the manager that runs them, and a starting
+    manager only resumes jobs whose owner's lock file is no longer held.
+    """
+
+    def __init__(self, directory: str, max_workers: Optional[int] = None, retention: float = DEFAULT_RETENTION):
+        """
+        Initialize the manager
+
+        Args:
+            directory: Folder for the job database; callers keep job output here as well
+            max_workers: Items processed at the same time across all jobs. Defaults to the CPU count
+            retention: Seconds finished jobs are kept for status queries
+        """
+        self.directory = directory
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.retention = retention
+        self.store = BatchJobStore(os.path.join(directory, 'batch_jobs.db'))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch-job')
+        self._lock = threading.Lock()
+        # Jobs this manager runs; other workers' jobs are read from the store
+        self._jobs: Dict[str, BatchJob] = {}
+
+        self.owner = uuid.uuid4().hex
+        self._owners_dir = os.path.join(directory, 'owners')
+        Path(self._owners_dir).mkdir(parents=True, exist_ok=True)
+        self._owner_file = open(os.path.join(self._owners_dir, f"{self.owner}.lock"), 'wb')
+        if not _try_lock(self._owner_file.fileno()):
+            raise RuntimeError(f"Could not lock {self._owner_file.name}")
+
+    @classmethod
+    def from_environment(cls) -> 'BatchJobManager':
+        """Build the manager from BATCH_JOB_DIR and BATCH_JOB_WORKERS"""
+        configured = os.environ.get('BATCH_JOB_WORKERS')
+        max_workers = None
+        if configured:
+            try:
+                max_workers = max(1, int(configured))
+            except ValueError:
+                logging.warning(f"Ignoring invalid BATCH_JOB_WORKERS value: {configured}")
+        directory = os.environ.get('BATCH_JOB_DIR') or str(default_job_dir())
+        return cls(directory, max_workers)
+
+    def submit(
+        self,
+        items: List[Dict[str, Any]],
+        build_callbacks: Callable[[BatchJob], JobCallbacks],
+        params: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None
+    ) -> BatchJob:
+        """
+        Start a job and return right away
+
+        Args:
+            items: Work items; each must have a 'filename' and be JSON-serialisable
+            build_callbacks: Returns (process_item, finalize, cleanup) for the job. It is
+                called again by resume() after a restart, so it should only depend on job.params.
+                process_item(job, item) handles one item and returns its 'successful' entry;
+                raising records the item in 'failed' with the exception message as the reason.
+                finalize(job) is called once after the last item; its return value becomes
+                job.artifact, and changes it makes to the items' results are checkpointed with it.
+                cleanup(job), if given, is called instead when the job was cancelled
+            params: JSON-serialisable settings the callbacks are built from
+            job_id: ID for the job (generated if None)
+
+        Returns:
+            The new job
+        """
+        self._prune()
+        job = BatchJob(job_id or uuid.uuid4().hex, items, params)
+        callbacks = build_callbacks(job)
+        self.store.add_job(job, self.owner)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._start(job, callbacks)
+        return job
+
+    def resume(self, build_callbacks: Callable[[BatchJob], JobCallbacks]) -> List[BatchJob]:
+        """
+        Load the stored jobs after a restart and carry on with the unfinished ones
+
+        Only jobs whose owner process is gone are taken over, so with several workers each
+        job is resumed once. Only items still pending are processed; items that were done
+        or failed keep their checkpointed result.
+
+        Args:
+            build_callbacks: Same as for submit()
+
+        Returns:
+            The jobs that were resumed
+        """
+        claimed = set(self.store.claim_unowned(self.owner, self._owner_alive))
+        resumed = []
+        for job in self.store.load_jobs():
+            if job.job_id not in claimed:
+                continue
+            with self._lock:
+                if job.job_id in self._jobs:
+                    continue
+                self._jobs[job.job_id] = job
+            logging.info(f"Resuming batch job {job.job_id}: {job._outstanding} of {job.total} items left")
+            job.state = 'queued'
+            self._start(job, build_callbacks(job))
+            resumed.append(job)
+        self._prune()
+        return resumed
+
+    def _owner_alive(self, owner: str) -> bool:
+        """Whether the process of another manager still holds its lock file"""
+        path = os.path.join(self._owners_dir, f"{owner}.lock")
+        try:
+            with open(path, 'ab') as lock_file:
+                if not _try_lock(lock_file.fileno()):
+                    return True
+        except FileNotFoundError:
+            return False
+        # Its process is gone and the lock came free
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """The job if this manager runs it, otherwise a snapshot from the store"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self.store.load_job(job_id)
+
+    def jobs(self) -> List[BatchJob]:
+        """All stored jobs, oldest first"""
+        with self._lock:
+            local = dict(self._jobs)
+        return [local.get(job.job_id, job) for job in self.store.load_jobs()]
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        """
+        Stop a job: items not started yet are skipped, running items finish
+
+        The request is recorded in the store, so it reaches the job even if another
+        worker runs it.
+
+        Returns:
+            The job, or None if it is unknown
+        """
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job._cancel.set()
+            self.store.set_cancel_requested(job_id)
+        return job
+
+    def _start(self, job: BatchJob, callbacks: JobCallbacks) -> None:
+        pending = [(index, item) for index, item in enumerate(job.items) if item['status'] == PENDING]
+        if not pending:
+            # Nothing to do, or the server stopped between the last item and finalize
+            self._finish(job, callbacks)
+            return
+        for index, item in pending:
+            self._pool.submit(self._run_item, job, index, item, callbacks)
+
+    def _run_item(self, job: BatchJob, index: int, item: Dict[str, Any], callbacks: JobCallbacks) -> None:
+        process_item = callbacks[0]
+        with job._lock:
+            starting = job.started_at is None
+            if starting:
+                job.started_at = time.time()
+                job.state = 'running'
+        if starting:
+            self.store.set_started(job)
+
+        # Cancels sent to another worker only reach this one through the store
+        if not job.cancel_requested and self.store.cancel_requested(job.job_id):
+            job._cancel.set()
+        if job.cancel_requested:
+            status, result = SKIPPED, None
+        else:
+            try:
+                status, result = DONE, process_item(job, item)
+            except Exception as e:
+                status, result = FAILED, {'filename': item['filename'], 'reason': str(e)}
+
+        # Checkpoint before counting the item, so a restart never loses a finished item
+        self.store.set_item(job.job_id, index, status, result)
+        with job._lock:
+            item['status'] = status
+            item['result'] = result
+            if status != SKIPPED:
+                job._processed_here += 1
+            job._outstanding -= 1
+            last = job._outstanding == 0
+        if last:
+            self._finish(job, callbacks)
+
+    def _finish(self, job: BatchJob, callbacks: JobCallbacks) -> None:
+        _, finalize, cleanup = callbacks
+        try:
+            if job.cancel_requested:
+                if cleanup is not None:
+                    cleanup(job)
+                state = 'cancelled'
+            else:
+                job.artifact = finalize(job)
+                state = 'completed'
+        except Exception as e:
+            logging.error(f"Error finishing batch job {job.job_id}: {e}")
+            job.error = str(e)
+            state = 'failed'
+        with job._lock:
+            job.state = state
+            job.finished_at = time.time()
+        self.store.finish_job(job)
+
+    def _prune(self) -> None:
+        """Forget jobs that finished longer ago than the retention period"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [j.job_id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        # Also the jobs of workers that have exited since
+        self.store.delete_finished_before(cutoff)
+
+    def shutdown(self) -> None:
+        """Stop the threads; items not started yet stay pending and resume on the next start"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        # Give up ownership, so the next start can take over this manager's jobs
+        self._owner_file.close()
+        try:
+            os.remove(self._owner_file.name)
+        except OSError:
+            pass
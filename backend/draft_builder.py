@@ -0,0 +1,139 @@
+"""
+Outlook draft builder for Speedy Statements
+Renders the headers and HTML body shared by a batch of drafts once, then splices in
+each recipient's To header and PDF attachment
+"""
+import base64
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import compat32
+from typing import BinaryIO, Optional, TextIO
+
+# Placeholders used while rendering the skeleton
+_TO_MARKER = 'SpeedyStatementsRecipient'
+_ATTACHMENT_MARKER = 'SpeedyStatementsAttachment'
+
+# Same policy Message.as_string() uses: compat32 without header folding
+_HEADER_POLICY = compat32.clone(max_line_length=0)
+
+# base64 lines hold 57 input bytes, so chunks of whole lines encode independently (~456 KB)
+STREAM_CHUNK_SIZE = 57 * 8192
+
+
+class DraftTemplate:
+    """Pre-rendered draft shared by every recipient of a batch"""
+
+    def __init__(self, subject: str, body: str, sender_email: Optional[str] = None,
+                 sender_name: Optional[str] = None):
+        """
+        Render the shared parts of the draft
+
+        Args:
+            subject: Email subject
+            body: HTML email body
+            sender_email: Optional From address
+            sender_name: Optional display name for the From address
+        """
+        # Build the message the same way a single draft is built, with markers
+        # where the recipient and attachment go
+        msg = MIMEMultipart()
+        msg['To'] = _TO_MARKER
+        msg['Subject'] = subject
+
+        # Add From field if sender email provided
+        if sender_email:
+            if sender_name:
+                msg['From'] = f'"{sender_name}" <{sender_email}>'
+            else:
+                msg['From'] = sender_email
+
+        # Add draft-specific headers for Outlook
+        msg['X-Unsent'] = '1'
+        msg['X-UnsentDraft'] = '1'
+
+        msg.attach(MIMEText(body, 'html'))
+
+        part = MIMEBase('application', 'pdf')
+        part.set_payload(b'')
+        encoders.encode_base64(part)
+        part.set_payload(_ATTACHMENT_MARKER)
+        msg.attach(part)
+
+        rendered = msg.as_string()
+        to_line = _HEADER_POLICY.fold('To', _TO_MARKER)
+        head, rest = rendered.split(to_line, 1)
+        middle, tail = rest.split(f'\n{_ATTACHMENT_MARKER}', 1)
+
+        self._head = head
+        # Ends with the attachment's Content-Transfer-Encoding header
+        self._middle = middle
+        self._tail = tail
+
+    def _attachment_head(self, recipient_email: str, pdf_filename: str) -> str:
+        """Everything before the base64 payload"""
+        return ''.join((
+            self._head,
+            _HEADER_POLICY.fold('To', recipient_email),
+            self._middle,
+            _HEADER_POLICY.fold('Content-Disposition', f'attachment; filename={pdf_filename}'),
+            '\n'
+        ))
+
+    def render(self, recipient_email: str, pdf_content: bytes, pdf_filename: str) -> str:
+        """
+        Build one draft
+
+        Args:
+            recipient_email: To address
+            pdf_content: PDF to attach
+            pdf_filename: Attachment filename
+
+        Returns:
+            The .eml content, identical to building the message with the email package
+        """
+        return ''.join((
+            self._attachment_head(recipient_email, pdf_filename),
+            base64.encodebytes(pdf_content).decode('ascii'),
+            self._tail
+        ))
+
+    def write(self, eml_path: str, recipient_email: str, pdf_file: BinaryIO, pdf_filename: str) -> None:
+        """
+        Build one draft and save it as an .eml file, encoding the attachment in chunks
+
+        Only one chunk of the PDF is in memory at a time, so memory use does not
+        grow with the attachment size. The output matches render().
+
+        Args:
+            eml_path: .eml file to write
+            recipient_email: To address
+            pdf_file: Binary file object positioned at the start of the PDF
+            pdf_filename: Attachment filename
+        """
+        with open(eml_path, 'w', encoding='utf-8') as eml_file:
+            self.write_to(eml_file, recipient_email, pdf_file, pdf_filename)
+
+    def write_to(self, out: TextIO, recipient_email: str, pdf_file: BinaryIO, pdf_filename: str) -> None:
+        """Same as write(), into an open text stream (e.g. a ZIP entry)"""
+        out.write(self._attachment_head(recipient_email, pdf_filename))
+        pending = b''
+        while True:
+            chunk = pdf_file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending += chunk
+            # Encode whole 57-byte lines only; carry the remainder into the next chunk
+            whole = len(pending) - len(pending) % 57
+            if whole:
+                out.write(base64.encodebytes(pending[:whole]).decode('ascii'))
+                pending = pending[whole:]
+        if pending:
+            out.write(base64.encodebytes(pending).decode('ascii'))
+        out.write(self._tail)
+
+    def write_path(self, eml_path: str, recipient_email: str, pdf_path: str, pdf_filename: str) -> None:
+        """Same as write(), reading the PDF from pdf_path"""
+        with open(pdf_path, 'rb') as pdf_file:
+            self.write(eml_path, recipient_email, pdf_file, pdf_filename)
@@ -0,0 +1,74 @@
+"""
+Execution layer for Speedy Statements
+Runs blocking work (PDF parsing, MIME building, ZIP compression) outside the asyncio event loop
+"""
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+def default_blocking_workers() -> int:
+    """
+    Number of threads for blocking work.
+
+    Reads BLOCKING_WORKERS from the environment, falling back to the same
+    default as the standard library thread pool.
+    """
+    configured = os.environ.get('BLOCKING_WORKERS')
+    if configured:
+        try:
+            return max(1, int(configured))
+        except ValueError:
+            logging.warning(f"Ignoring invalid BLOCKING_WORKERS value: {configured}")
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class BlockingExecutor:
+    """Bounded thread pool that async routes hand their blocking calls to"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Initialize the executor
+
+        Args:
+            max_workers: Maximum number of threads. If None, uses default_blocking_workers()
+        """
+        self.max_workers = max_workers or default_blocking_workers()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='blocking'
+        )
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking function without blocking the event loop
+
+        Args:
+            func: Function to call
+            *args, **kwargs: Arguments passed to func
+
+        Returns:
+            Whatever func returns (exceptions are re-raised in the caller)
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Start a blocking function without waiting for it (e.g. the producer of a streamed response)
+
+        Args:
+            func: Function to call
+            *args, **kwargs: Arguments passed to func
+
+        Returns:
+            Future for the result
+        """
+        return self._pool.submit(func, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        """Wait for running calls and stop the threads"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,245 @@
+"""
+Persistent extraction cache for Speedy Statements
+Remembers the text and emails pulled out of each PDF so unchanged files are not parsed again
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+# Default size cap for cached text and emails (256 MB)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_dir() -> Path:
+    """Cache directory next to the JSON data directory"""
+    if os.name == 'nt':  # Windows
+        appdata = os.environ.get('APPDATA', os.path.expanduser('~'))
+        return Path(appdata) / 'SpeedyStatements' / 'cache'
+    return Path.home() / '.speedystatements' / 'cache'
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's content, read in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(content: bytes) -> str:
+    """SHA-256 of in-memory content"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed cache of extraction results keyed by content hash, with LRU eviction"""
+
+    def __init__(self, db_path: str, version: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Open (or create) the cache
+
+        Args:
+            db_path: SQLite file to store the cache in
+            version: Extraction version key. Entries written under another version are dropped
+            max_bytes: Size cap for stored text and emails; least recently used entries go first
+        """
+        self.db_path = db_path
+        self.version = version
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # Shared by several worker processes, so use WAL and wait on locks
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+        self._check_version()
+
+    @classmethod
+    def from_environment(cls, version: str) -> Optional['ExtractionCache']:
+        """
+        Build the cache from environment settings
+
+        EXTRACTION_CACHE_DIR overrides the location and EXTRACTION_CACHE_MAX_BYTES
+        the size cap. A size cap of 0 disables caching.
+
+        Returns:
+            The cache, or None if it is disabled or cannot be opened
+        """
+        try:
+            max_bytes = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        except ValueError:
+            max_bytes = DEFAULT_MAX_BYTES
+        if max_bytes <= 0:
+            return None
+
+        cache_dir = os.environ.get('EXTRACTION_CACHE_DIR') or default_cache_dir()
+        try:
+            return cls(str(Path(cache_dir) / 'extraction_cache.db'), version, max_bytes)
+        except sqlite3.Error as e:
+            logging.error(f"Extraction cache disabled, could not open {cache_dir}: {e}")
+            return None
+
+    def _create_tables(self) -> None:
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    hash TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    emails TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            # Lets unchanged files skip hashing: (path, size, mtime) -> content hash
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS paths (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _check_version(self) -> None:
+        """Drop every entry if the extraction logic changed since they were written"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                if row is not None:
+                    logging.info(f"Extraction cache version changed ({row[0]} -> {self.version}), clearing")
+                self._conn.execute('DELETE FROM entries')
+                self._conn.execute('DELETE FROM paths')
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                    (self.version,)
+                )
+
+    def _count(self, name: str) -> None:
+        self._conn.execute(
+            'INSERT INTO stats (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def hash_for_path(self, file_path: str) -> str:
+        """
+        Content hash of a file, reusing the stored hash when size and mtime are unchanged
+
+        Args:
+            file_path: Path of the file
+
+        Returns:
+            SHA-256 hex digest of the file content
+        """
+        stat = os.stat(file_path)
+        path_key = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime_ns, hash FROM paths WHERE path = ?', (path_key,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        content_hash = hash_file(file_path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO paths (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)',
+                (path_key, stat.st_size, stat.st_mtime_ns, content_hash)
+            )
+        return content_hash
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result
+
+        Args:
+            content_hash: Hash of the PDF content
+
+        Returns:
+            {'text': ..., 'emails': [...]} or None on a miss
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT text, emails FROM entries WHERE hash = ?', (content_hash,)
+            ).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            self._conn.execute(
+                'UPDATE entries SET last_used = ? WHERE hash = ?', (time.time(), content_hash)
+            )
+            self._count('hits')
+        return {'text': row[0], 'emails': json.loads(row[1])}
+
+    def put(self, content_hash: str, text: str, emails: List[str]) -> None:
+        """
+        Store a result and evict least recently used entries above the size cap
+
+        Args:
+            content_hash: Hash of the PDF content
+            text: Extracted text
+            emails: Extracted emails
+        """
+        emails_json = json.dumps(emails)
+        size = len(text.encode('utf-8')) + len(emails_json)
+        if size > self.max_bytes:
+            return
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (hash, text, emails, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                (content_hash, text, emails_json, size, time.time())
+            )
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            while total > self.max_bytes:
+                oldest = self._conn.execute(
+                    'SELECT hash, size FROM entries ORDER BY last_used ASC LIMIT 100'
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_hash, old_size in oldest:
+                    self._conn.execute('DELETE FROM entries WHERE hash = ?', (old_hash,))
+                    self._count('evictions')
+                    total -= old_size
+                    if total <= self.max_bytes:
+                        break
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            counters = dict(self._conn.execute('SELECT name, value FROM stats').fetchall())
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'version': self.version,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0
+        }
+
+    def clear(self) -> None:
+        """Remove every entry and reset the counters"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM paths')
+            self._conn.execute('DELETE FROM stats')
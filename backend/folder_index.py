@@ -0,0 +1,193 @@
+"""
+Incremental folder index for Speedy Statements
+Remembers each statement's size, mtime, content hash and extraction result per folder,
+so a re-scan only parses files that were added or changed
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from extraction_cache import default_cache_dir, hash_file
+
+
+def mode_key(page_budget: Optional[int]) -> str:
+    """Index key for an extraction mode: full read, or early exit with a page budget"""
+    return 'full' if page_budget is None else f'pages:{page_budget}'
+
+
+class FolderScan:
+    """Result of comparing a folder listing against the index"""
+
+    def __init__(self):
+        # filename -> stored extraction summary, for files that did not change
+        self.reused: Dict[str, Dict[str, Any]] = {}
+        # filenames that are new or changed and must be parsed
+        self.to_parse: List[str] = []
+        # filename -> (size, mtime_ns) captured while scanning, for record()
+        self.file_stats: Dict[str, Tuple[int, int]] = {}
+        # number of indexed files that are no longer in the folder
+        self.removed = 0
+
+    def summary(self) -> Dict[str, int]:
+        """Counts for the API response"""
+        return {
+            'reused': len(self.reused),
+            'parsed': len(self.to_parse),
+            'removed': self.removed
+        }
+
+
+class FolderIndex:
+    """SQLite-backed per-folder index of extraction results"""
+
+    def __init__(self, db_path: str, version: str):
+        """
+        Open (or create) the index
+
+        Args:
+            db_path: SQLite file to store the index in
+            version: Extraction version key. Rows written under another version are re-parsed
+        """
+        self.db_path = db_path
+        self.version = version
+        self._lock = threading.Lock()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    folder TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    PRIMARY KEY (folder, filename)
+                )
+            ''')
+
+    @classmethod
+    def from_environment(cls, version: str) -> Optional['FolderIndex']:
+        """
+        Build the index next to the extraction cache (EXTRACTION_CACHE_DIR)
+
+        Set FOLDER_INDEX=off to disable it.
+
+        Returns:
+            The index, or None if it is disabled or cannot be opened
+        """
+        if os.environ.get('FOLDER_INDEX', '').lower() in ('0', 'off', 'false', 'no'):
+            return None
+
+        cache_dir = os.environ.get('EXTRACTION_CACHE_DIR') or default_cache_dir()
+        try:
+            return cls(str(Path(cache_dir) / 'folder_index.db'), version)
+        except sqlite3.Error as e:
+            logging.error(f"Folder index disabled, could not open {cache_dir}: {e}")
+            return None
+
+    def scan(self, folder_path: str, filenames: List[str], mode: str) -> FolderScan:
+        """
+        Work out which files can be reused and which need parsing, and drop deleted ones
+
+        A file is reused when its size and mtime match the index. If only the mtime
+        moved (e.g. the file was copied again), the content hash decides.
+
+        Args:
+            folder_path: Folder being scanned
+            filenames: PDF filenames currently in the folder
+            mode: Extraction mode key (full read or a page budget); rows from another mode are not reused
+
+        Returns:
+            FolderScan describing the work to do
+        """
+        folder_key = os.path.abspath(folder_path)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT filename, size, mtime_ns, hash, mode, version, result FROM files WHERE folder = ?',
+                (folder_key,)
+            ).fetchall()
+        indexed = {row[0]: row[1:] for row in rows}
+
+        scan = FolderScan()
+        touched = []
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(folder_path, filename))
+            except OSError:
+                scan.to_parse.append(filename)
+                continue
+            scan.file_stats[filename] = (stat.st_size, stat.st_mtime_ns)
+
+            row = indexed.get(filename)
+            if row is None or row[3] != mode or row[4] != self.version or row[0] != stat.st_size:
+                scan.to_parse.append(filename)
+                continue
+
+            size, mtime_ns, content_hash, _, _, result = row
+            if mtime_ns != stat.st_mtime_ns:
+                try:
+                    if hash_file(os.path.join(folder_path, filename)) != content_hash:
+                        scan.to_parse.append(filename)
+                        continue
+                except OSError:
+                    scan.to_parse.append(filename)
+                    continue
+                touched.append((stat.st_mtime_ns, folder_key, filename))
+
+            scan.reused[filename] = json.loads(result)
+
+        current = set(filenames)
+        removed = [(folder_key, filename) for filename in indexed if filename not in current]
+        scan.removed = len(removed)
+
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM files WHERE folder = ? AND filename = ?', removed)
+            self._conn.executemany(
+                'UPDATE files SET mtime_ns = ? WHERE folder = ? AND filename = ?', touched
+            )
+        return scan
+
+    def record(self, folder_path: str, mode: str, scan: FolderScan,
+               results: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        Store freshly parsed results
+
+        Args:
+            folder_path: Folder that was scanned
+            mode: Extraction mode key used for these results
+            scan: The FolderScan the files came from (provides size and mtime)
+            results: (filename, extraction summary) pairs. A summary's content_hash (set by the
+                worker that read the file) is stored as is; the file is only hashed here without one
+        """
+        folder_key = os.path.abspath(folder_path)
+        rows = []
+        for filename, result in results:
+            if filename not in scan.file_stats:
+                continue
+            size, mtime_ns = scan.file_stats[filename]
+            content_hash = result.get('content_hash')
+            if content_hash is None:
+                try:
+                    content_hash = hash_file(os.path.join(folder_path, filename))
+                except OSError:
+                    continue
+            rows.append((
+                folder_key, filename, size, mtime_ns, content_hash, mode, self.version, json.dumps(result)
+            ))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO files '
+                '(folder, filename, size, mtime_ns, hash, mode, version, result) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
@@ -2,23 +2,343 @@
 JSON-based storage module for Speedy Statements
 Replaces MongoDB with local JSON file storage
 """
+import bisect
+import itertools
 import json
+import logging
 import os
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Set, Tuple
 import asyncio
 from datetime import datetime
 
+# Storage modes: rewrite the collection's JSON file on every change, or append each
+# change to a JSONL log that is folded into a snapshot in the background
+SNAPSHOT_MODE = 'snapshot'
+LOG_MODE = 'log'
+
+# Log entries after which the log is compacted into a new snapshot
+DEFAULT_COMPACT_ENTRIES = 1000
+
+# Sort directions, as in pymongo
+ASCENDING = 1
+DESCENDING = -1
+
+# Fields indexed besides 'id', which every collection indexes
+DEFAULT_INDEXES = {
+    'email_accounts': ('email',)
+}
+
+
+def default_storage_mode() -> str:
+    """
+    Storage mode.
+    
+    Reads JSON_STORAGE_MODE ("snapshot" or "log") from the environment, falling back to snapshot.
+    """
+    configured = os.environ.get('JSON_STORAGE_MODE')
+    if configured:
+        if configured in (SNAPSHOT_MODE, LOG_MODE):
+            return configured
+        logging.warning(f"Ignoring invalid JSON_STORAGE_MODE value: {configured}")
+    return SNAPSHOT_MODE
+
+
+def default_compact_entries() -> int:
+    """
+    Log length that triggers compaction in log mode.
+    
+    Reads JSON_LOG_COMPACT_ENTRIES from the environment, falling back to DEFAULT_COMPACT_ENTRIES.
+    """
+    configured = os.environ.get('JSON_LOG_COMPACT_ENTRIES')
+    if configured:
+        try:
+            return max(1, int(configured))
+        except ValueError:
+            logging.warning(f"Ignoring invalid JSON_LOG_COMPACT_ENTRIES value: {configured}")
+    return DEFAULT_COMPACT_ENTRIES
+
+
+def _lock_file(fd: int) -> None:
+    """Wait for an exclusive lock on an open file; the OS drops it when the process dies"""
+    if os.name == 'nt':  # Windows
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                # Gives up after 10 seconds; keep waiting
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    import fcntl
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _try_lock_file(fd: int) -> bool:
+    """Take an exclusive lock on an open file without waiting"""
+    try:
+        if os.name == 'nt':  # Windows
+            import msvcrt
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock_file(fd: int) -> None:
+    if os.name == 'nt':  # Windows
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class _FileLock:
+    """
+    Exclusive lock shared by every process using a data directory (API workers)
+    
+    Re-entrant within a thread. Other threads of the same process wait on a thread lock,
+    other processes on an OS lock of the lock file.
+    """
+    
+    def __init__(self, path: Path):
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = open(path, 'a+b')
+    
+    def __enter__(self) -> '_FileLock':
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                _lock_file(self._file.fileno())
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._file.fileno())
+        self._thread_lock.release()
+
+
+def _project(item: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Copy of a document with only the fields a projection asks for
+    
+    Like MongoDB: {'name': 1} keeps only the listed fields, {'body': 0} drops the listed
+    ones. '_id' may be excluded from either kind. Only top-level fields are supported.
+    """
+    if not projection:
+        return dict(item)
+    included = [key for key, value in projection.items() if value and key != '_id']
+    if included:
+        if projection.get('_id', 1):
+            included.append('_id')
+        return {key: item[key] for key in included if key in item}
+    return {key: value for key, value in item.items() if projection.get(key, 1)}
+
+
+def _sorted(items: Iterator[Dict[str, Any]], sort: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """Sort documents by (field, direction) pairs; missing fields sort first, like null in MongoDB"""
+    items = list(items)
+    # Stable sorts, least significant key first
+    for field, direction in reversed(sort):
+        items.sort(key=lambda item: (item.get(field) is not None, item.get(field)), reverse=direction < 0)
+    return items
+
+
+def _matches(item: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Simple query matching: every field in query must be equal"""
+    for key, value in query.items():
+        if item.get(key) != value:
+            return False
+    return True
+
+
+class _Collection:
+    """
+    Documents of one collection, with hash indexes on some of their fields
+    
+    Documents are kept in a dict keyed by a rank that only grows, so dict order is collection
+    order and a replaced document keeps its place. Each index maps a field value to the ranks
+    of the documents holding it, in order, so equality queries on indexed fields skip the scan.
+    """
+    
+    def __init__(self, documents: List[Dict[str, Any]], indexed_fields: Sequence[str]):
+        self.documents: Dict[int, Dict[str, Any]] = {}
+        self.indexes: Dict[str, Dict[Any, Tuple[int, ...]]] = {field: {} for field in indexed_fields}
+        self.next_rank = 0
+        for document in documents:
+            self.insert(document)
+    
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self.documents.values())
+    
+    def _index(self, rank: int, document: Dict[str, Any]) -> None:
+        for field, index in self.indexes.items():
+            value = document.get(field)
+            try:
+                ranks = index.get(value, ())
+            except TypeError:
+                # Unhashable values (lists, objects) never equal a hashable query value,
+                # and queries for unhashable values scan
+                continue
+            position = bisect.bisect(ranks, rank)
+            index[value] = ranks[:position] + (rank,) + ranks[position:]
+    
+    def _unindex(self, rank: int, document: Dict[str, Any]) -> None:
+        for field, index in self.indexes.items():
+            value = document.get(field)
+            try:
+                ranks = tuple(r for r in index.get(value, ()) if r != rank)
+            except TypeError:
+                continue
+            if ranks:
+                index[value] = ranks
+            else:
+                index.pop(value, None)
+    
+    def insert(self, document: Dict[str, Any]) -> None:
+        rank = self.next_rank
+        self.next_rank += 1
+        self.documents[rank] = document
+        self._index(rank, document)
+    
+    def delete(self, rank: int) -> None:
+        self._unindex(rank, self.documents.pop(rank))
+    
+    def replace(self, rank: int, document: Dict[str, Any]) -> None:
+        self._unindex(rank, self.documents[rank])
+        self.documents[rank] = document
+        self._index(rank, document)
+    
+    def find(self, query: Dict[str, Any]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(rank, document) of every match, in collection order"""
+        ranks = None
+        for field, value in query.items():
+            index = self.indexes.get(field)
+            if index is None:
+                continue
+            try:
+                candidates = index.get(value, ())
+            except TypeError:
+                continue
+            if ranks is None or len(candidates) < len(ranks):
+                ranks = candidates
+        
+        if ranks is None:
+            matches = self.documents.items()
+        else:
+            matches = ((rank, self.documents[rank]) for rank in ranks)
+        for rank, document in matches:
+            if _matches(document, query):
+                yield rank, document
+    
+    def after(self, key: Tuple[str, Any], order: Tuple[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Documents after a given one, in collection order
+        
+        Args:
+            key: (field, value) identifying the document, e.g. ('id', ...); an indexed field
+                finds it without a scan
+            order: (field, value) of a field that grows with collection order, e.g.
+                ('created_at', ...). Used only if the document was deleted: the documents
+                from the first one whose field is greater are returned
+        """
+        anchor = next(self.find({key[0]: key[1]}), None)
+        if anchor is not None:
+            start = anchor[0] + 1
+        else:
+            field, value = order
+            start = self.next_rank
+            for rank, document in self.documents.items():
+                try:
+                    later = document.get(field) is not None and document[field] > value
+                except TypeError:
+                    later = False
+                if later:
+                    start = rank
+                    break
+        # Ranks only grow, so the rest of the collection is the ranks from start on
+        for rank in range(start, self.next_rank):
+            document = self.documents.get(rank)
+            if document is not None:
+                yield document
+
+
+def _apply(collection: _Collection, change: Dict[str, Any]) -> int:
+    """
+    Apply one change to a collection
+    
+    Used for live writes and to replay the log, so both give the same result.
+    
+    Args:
+        collection: Changed in place; live writes pass the cached collection
+        change: {'op': 'insert', 'document': ...}, {'op': 'delete', 'query': ...}
+            or {'op': 'update', 'query': ..., 'update': ...} (first match only)
+    
+    Returns:
+        The number of documents changed (0 or 1)
+    """
+    if change['op'] == 'insert':
+        collection.insert(change['document'])
+        return 1
+    
+    match = next(collection.find(change['query']), None)
+    if match is None:
+        return 0
+    rank, item = match
+    if change['op'] == 'delete':
+        collection.delete(rank)
+        return 1
+    # Documents are shared with the cache, so update a copy
+    item = dict(item)
+    update = change['update']
+    # Handle $set operation
+    if '$set' in update:
+        item.update(update['$set'])
+    else:
+        item.update(update)
+    collection.replace(rank, item)
+    return 1
+
 
 class JSONStorage:
-    """Async JSON storage that mimics MongoDB operations"""
+    """
+    Async JSON storage that mimics MongoDB operations
     
-    def __init__(self, data_dir: Optional[str] = None):
+    Reads are served from an in-memory copy of each collection. Writes are queued to a
+    single writer thread, which applies everything queued at the same time in one
+    read-modify-write and flushes it to disk once (group commit). Several processes (API
+    workers) may share a data directory: writes hold a lock file in it while they read,
+    change and store a collection.
+    """
+    
+    def __init__(self, data_dir: Optional[str] = None, mode: Optional[str] = None,
+                 compact_entries: Optional[int] = None, indexes: Optional[Dict[str, Sequence[str]]] = None):
         """
         Initialize JSON storage
         
         Args:
             data_dir: Directory to store JSON files. If None, uses %APPDATA%/SpeedyStatements/data
+            mode: SNAPSHOT_MODE or LOG_MODE. Defaults to default_storage_mode()
+            compact_entries: Log mode only: compact once the log has this many entries.
+                Defaults to default_compact_entries()
+            indexes: Fields to index per collection besides 'id'. Defaults to DEFAULT_INDEXES
         """
         if data_dir is None:
             # Use Windows AppData for production, fallback to temp for development
@@ -29,6 +349,8 @@ class JSONStorage:
                 self.data_dir = Path.home() / '.speedystatements' / 'data'
         else:
             self.data_dir = Path(data_dir)
+        self.mode = mode or default_storage_mode()
+        self.compact_entries = compact_entries or default_compact_entries()
         
         # Create data directory if it doesn't exist
         self.data_dir.mkdir(parents=True, exist_ok=True)
@@ -38,11 +360,41 @@ class JSONStorage:
             'email_templates': self.data_dir / 'templates.json',
             'email_accounts': self.data_dir / 'accounts.json'
         }
+        declared = DEFAULT_INDEXES if indexes is None else indexes
+        self._indexed_fields = {
+            file_path: tuple(dict.fromkeys(('id',) + tuple(declared.get(collection, ()))))
+            for collection, file_path in self.collections.items()
+        }
         
-        # Create empty files if they don't exist
-        for collection_file in self.collections.values():
-            if not collection_file.exists():
-                self._write_file(collection_file, [])
+        # Parsed collections with the signature ((inode, mtime_ns, size) of each file) they were
+        # read from; reloaded only when the files change, e.g. when another process writes them.
+        # The writer changes cached collections in place, holding self._lock; readers hold
+        # it while they go through one. Documents are replaced on update, never changed
+        self._cache: Dict[Path, Tuple[Any, _Collection]] = {}
+        self._lock = threading.RLock()
+        # Log mode: sequence number of the last change, and log entries not yet in the snapshot
+        self._seq: Dict[Path, int] = {}
+        self._log_entries: Dict[Path, int] = {}
+        self._compacting: Set[Path] = set()
+        # (collection file, change, future) waiting for the writer thread
+        self._writes: queue.Queue = queue.Queue()
+        # Held across processes while a collection is read, changed and stored. Take it
+        # before self._lock, never while holding only self._lock
+        self._file_lock = _FileLock(self.data_dir / '.storage.lock')
+        
+        with self._file_lock:
+            # Create empty files if they don't exist
+            for collection_file in self.collections.values():
+                if not collection_file.exists():
+                    self._write_file(collection_file, [])
+            
+            if self.mode == LOG_MODE:
+                # Replay snapshot plus log now; this also drops an entry cut off by a crash
+                for collection_file in self.collections.values():
+                    self._load(collection_file)
+        
+        self._writer = threading.Thread(target=self._run_writer, name='json-storage-writer', daemon=True)
+        self._writer.start()
     
     def _read_file(self, file_path: Path) -> List[Dict[str, Any]]:
         """Read JSON file and return data"""
@@ -53,48 +405,327 @@ class JSONStorage:
             return []
     
     def _write_file(self, file_path: Path, data: List[Dict[str, Any]]) -> None:
-        """Write data to JSON file"""
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        """Write data to JSON file (atomically, so a crash never leaves it truncated)"""
+        self._write_atomic(file_path, data, indent=2)
+    
+    @staticmethod
+    def _snapshot_path(file_path: Path) -> Path:
+        return file_path.with_name(f"{file_path.stem}.snapshot.json")
+    
+    @staticmethod
+    def _log_path(file_path: Path) -> Path:
+        return file_path.with_name(f"{file_path.stem}.log.jsonl")
     
-    async def find(self, collection: str, query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _file_signature(file_path: Path) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        # The inode changes on every rename over the file, even within one clock tick
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _signature(self, file_path: Path) -> Any:
+        if self.mode == LOG_MODE:
+            return (self._file_signature(self._snapshot_path(file_path)),
+                    self._file_signature(self._log_path(file_path)))
+        return self._file_signature(file_path)
+    
+    def _load(self, file_path: Path) -> _Collection:
+        """
+        Cached contents of a collection
+        
+        Only the files' inode, mtime and size are checked; the collection is re-read if any changed.
+        The returned collection is shared with the cache and changed in place by the writer:
+        hold self._lock while going through it. Call without holding only self._lock (see
+        _file_lock).
+        """
+        with self._lock:
+            signature = self._signature(file_path)
+            cached = self._cache.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            if self.mode != LOG_MODE:
+                # Snapshot files are replaced by a rename, so reading one needs no lock
+                data = _Collection(self._read_file(file_path), self._indexed_fields[file_path])
+                self._cache[file_path] = (signature, data)
+                return data
+        
+        # Snapshot and log must be read without another process appending or compacting
+        with self._file_lock, self._lock:
+            signature = self._signature(file_path)
+            cached = self._cache.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            data = self._replay(file_path)
+            self._cache[file_path] = (signature, data)
+            return data
+    
+    def _replay(self, file_path: Path) -> _Collection:
+        """
+        Log mode: rebuild a collection from its snapshot and the changes logged after it
+        
+        Call with the file lock held, so a torn last entry is really left by a crash
+        """
+        snapshot_path = self._snapshot_path(file_path)
+        if snapshot_path.exists():
+            with open(snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            data, seq = snapshot['documents'], snapshot['seq']
+        else:
+            # First start in log mode: the snapshot-mode file is the starting point
+            data, seq = self._read_file(file_path), 0
+        snapshot_seq = seq
+        data = _Collection(data, self._indexed_fields[file_path])
+        
+        entries = 0
+        log_path = self._log_path(file_path)
+        if log_path.exists():
+            with open(log_path, 'rb') as f:
+                lines = f.readlines()
+            good_bytes = 0
+            for number, line in enumerate(lines, 1):
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("no line end")
+                    change = json.loads(line)
+                except ValueError:
+                    if number == len(lines):
+                        # Torn write at the end: the change never completed
+                        logging.warning(f"Dropping incomplete last entry of {log_path}")
+                        with open(log_path, 'r+b') as f:
+                            f.truncate(good_bytes)
+                        break
+                    logging.error(f"Skipping unreadable entry {number} of {log_path}")
+                    good_bytes += len(line)
+                    continue
+                good_bytes += len(line)
+                # Changes up to the snapshot's sequence number are already in it
+                if change['seq'] <= snapshot_seq:
+                    continue
+                _apply(data, change)
+                seq = change['seq']
+                entries += 1
+        
+        self._seq[file_path] = seq
+        self._log_entries[file_path] = entries
+        return data
+    
+    @staticmethod
+    def _write_atomic(file_path: Path, content: Any, indent: Optional[int] = None) -> None:
+        """Write JSON to a temporary file, flush it to disk, then rename it over file_path"""
+        # Unique, so processes sharing the data directory never write the same temp file
+        temp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, indent=indent, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, file_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _commit(self, file_path: Path, data: _Collection, changes: List[Dict[str, Any]]) -> None:
+        """Store a collection after a group of changes (call with the file lock and lock held)"""
+        if self.mode != LOG_MODE:
+            self._write_file(file_path, data.to_list())
+            self._cache[file_path] = (self._signature(file_path), data)
+            return
+        
+        seq = self._seq[file_path]
+        lines = []
+        for change in changes:
+            seq += 1
+            lines.append(json.dumps(dict(change, seq=seq), ensure_ascii=False) + '\n')
+        with open(self._log_path(file_path), 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self._seq[file_path] = seq
+        self._log_entries[file_path] += len(changes)
+        self._cache[file_path] = (self._signature(file_path), data)
+        
+        if self._log_entries[file_path] >= self.compact_entries and file_path not in self._compacting:
+            self._compacting.add(file_path)
+            threading.Thread(
+                target=self._compact, args=(file_path,), name='json-compaction', daemon=True
+            ).start()
+    
+    def _compact(self, file_path: Path) -> None:
+        """
+        Log mode: write the collection as a new snapshot and drop the log entries it covers
+        
+        Runs on a background thread. Writes made while the snapshot is written stay in
+        the log. The snapshot records the sequence number it covers, so a crash at any
+        point replays every change exactly once. Only one process compacts a collection at
+        a time: one that started earlier could otherwise replace a newer snapshot.
+        """
+        log_path = self._log_path(file_path)
+        compact_lock = None
+        try:
+            compact_lock = open(file_path.with_name(f".{file_path.stem}.compact.lock"), 'a+b')
+            if not _try_lock_file(compact_lock.fileno()):
+                # Another process is compacting this collection
+                return
+            
+            with self._file_lock, self._lock:
+                data = self._load(file_path).to_list()
+                seq = self._seq[file_path]
+            
+            self._write_atomic(self._snapshot_path(file_path), {'seq': seq, 'documents': data})
+            
+            with self._file_lock, self._lock:
+                with open(log_path, 'rb') as f:
+                    tail = [line for line in f if json.loads(line)['seq'] > seq]
+                temp_path = log_path.with_name(f".{log_path.name}.{uuid.uuid4().hex}.tmp")
+                with open(temp_path, 'wb') as f:
+                    f.writelines(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, log_path)
+                self._log_entries[file_path] = len(tail)
+                self._cache[file_path] = (self._signature(file_path), self._cache[file_path][1])
+            logging.info(f"Compacted {log_path.name} into a snapshot at change {seq}, {len(tail)} change(s) left")
+        except Exception as e:
+            logging.error(f"Error compacting {log_path.name}: {e}")
+        finally:
+            if compact_lock is not None:
+                # Closing the file releases the lock
+                compact_lock.close()
+            with self._lock:
+                self._compacting.discard(file_path)
+    
+    def _submit(self, file_path: Path, change: Dict[str, Any]) -> Future:
+        """
+        Queue a change for the writer thread
+        
+        Returns:
+            Future for the number of documents changed (0 or 1). It fails straight away if the
+            change can't be stored as JSON, so a bad write never reaches a group
+        """
+        future = Future()
+        try:
+            json.dumps(change, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            future.set_exception(e)
+            return future
+        self._writes.put((file_path, change, future))
+        return future
+    
+    def _run_writer(self) -> None:
+        """Writer thread: apply queued changes, grouping those that arrived together"""
+        while True:
+            group = [self._writes.get()]
+            # Everything queued in the meantime joins this read-modify-write
+            while True:
+                try:
+                    group.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            by_file: Dict[Path, list] = {}
+            for write in group:
+                by_file.setdefault(write[0], []).append(write)
+            for file_path, writes in by_file.items():
+                self._write_group(file_path, writes)
+    
+    def _write_group(self, file_path: Path, writes: list) -> None:
+        """Apply a group of changes to one collection and flush them to disk once"""
+        results = []
+        try:
+            # The file lock makes the read-modify-write atomic across processes too
+            with self._file_lock, self._lock:
+                # Changed in place: each change only touches its documents' index entries
+                data = self._load(file_path)
+                applied = []
+                for _, change, _ in writes:
+                    # A change that can't be applied fails alone; _apply raises before changing anything
+                    try:
+                        count = _apply(data, change)
+                    except Exception as e:
+                        results.append(e)
+                        continue
+                    results.append(count)
+                    if count:
+                        applied.append(change)
+                if applied:
+                    try:
+                        self._commit(file_path, data, applied)
+                    except Exception:
+                        # The cached collection has changes that weren't stored: read it again
+                        self._cache.pop(file_path, None)
+                        raise
+        except Exception as e:
+            logging.error(f"Error writing {file_path.name}: {e}")
+            for _, _, future in writes:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(writes, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+    
+    async def find(self, collection: str, query: Dict[str, Any] = None, projection: Dict[str, Any] = None,
+                   sort: Optional[List[Tuple[str, int]]] = None, skip: int = 0,
+                   limit: Optional[int] = None,
+                   after: Optional[Tuple[Tuple[str, Any], Tuple[str, Any]]] = None) -> List[Dict[str, Any]]:
         """
         Find documents in collection
         
         Args:
             collection: Collection name (e.g., 'email_templates')
             query: Query filter (e.g., {'id': '123'})
+            projection: Fields to return (e.g., {'name': 1}); see _project()
+            sort: (field, ASCENDING or DESCENDING) pairs; collection order if None
+            skip: Number of matching documents to leave out first
+            limit: Maximum number of documents to return; all if None
+            after: (key, order) of a document to start after, in collection order; see
+                _Collection.after(). Unlike skip, the position survives documents being
+                added or deleted. Can't be combined with sort
         
         Returns:
             List of matching documents
         """
         # Run in thread pool to keep async interface
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._find_sync, collection, query)
+        return await loop.run_in_executor(
+            None, self._find_sync, collection, query, projection, sort, skip, limit, after
+        )
     
-    def _find_sync(self, collection: str, query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    def _find_sync(self, collection: str, query: Dict[str, Any] = None, projection: Dict[str, Any] = None,
+                   sort: Optional[List[Tuple[str, int]]] = None, skip: int = 0,
+                   limit: Optional[int] = None,
+                   after: Optional[Tuple[Tuple[str, Any], Tuple[str, Any]]] = None) -> List[Dict[str, Any]]:
         """Synchronous find operation"""
+        if after is not None and sort:
+            raise ValueError("after works in collection order and can't be combined with sort")
         file_path = self.collections.get(collection)
         if not file_path:
             return []
         
-        data = self._read_file(file_path)
+        data = self._load(file_path)
         
-        if query is None or query == {}:
-            return data
+        with self._lock:
+            if after is not None:
+                matches = data.after(*after)
+                if query:
+                    matches = (item for item in matches if _matches(item, query))
+            elif query is None or query == {}:
+                matches = iter(data.documents.values())
+            else:
+                # Equality on an indexed field looks the documents up instead of scanning
+                matches = (item for _, item in data.find(query))
+            if sort:
+                matches = iter(_sorted(matches, sort))
+            page = list(itertools.islice(matches, skip, None if limit is None else skip + limit))
         
-        # Simple query matching
-        results = []
-        for item in data:
-            match = True
-            for key, value in query.items():
-                if item.get(key) != value:
-                    match = False
-                    break
-            if match:
-                results.append(item)
-        
-        return results
+        # Only the requested page is copied (callers get copies, so changing a result
+        # can't change the cache), and only the projected fields of it
+        return [_project(item, projection) for item in page]
     
     async def insert_one(self, collection: str, document: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -107,19 +738,18 @@ class JSONStorage:
         Returns:
             Inserted document
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._insert_one_sync, collection, document)
+        await asyncio.wrap_future(self._submit_insert(collection, document))
+        return document
     
-    def _insert_one_sync(self, collection: str, document: Dict[str, Any]) -> Dict[str, Any]:
-        """Synchronous insert operation"""
+    def _submit_insert(self, collection: str, document: Dict[str, Any]) -> Future:
         file_path = self.collections.get(collection)
         if not file_path:
             raise ValueError(f"Unknown collection: {collection}")
-        
-        data = self._read_file(file_path)
-        data.append(document)
-        self._write_file(file_path, data)
-        
+        return self._submit(file_path, {'op': 'insert', 'document': dict(document)})
+    
+    def _insert_one_sync(self, collection: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Synchronous insert operation"""
+        self._submit_insert(collection, document).result()
         return document
     
     async def delete_one(self, collection: str, query: Dict[str, Any]) -> int:
@@ -133,8 +763,10 @@ class JSONStorage:
         Returns:
             Number of deleted documents (0 or 1)
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._delete_one_sync, collection, query)
+        file_path = self.collections.get(collection)
+        if not file_path:
+            return 0
+        return await asyncio.wrap_future(self._submit(file_path, {'op': 'delete', 'query': query}))
     
     def _delete_one_sync(self, collection: str, query: Dict[str, Any]) -> int:
         """Synchronous delete operation"""
@@ -142,24 +774,8 @@ class JSONStorage:
         if not file_path:
             return 0
         
-        data = self._read_file(file_path)
-        original_length = len(data)
-        
         # Find and remove first matching item
-        for i, item in enumerate(data):
-            match = True
-            for key, value in query.items():
-                if item.get(key) != value:
-                    match = False
-                    break
-            if match:
-                data.pop(i)
-                break
-        
-        if len(data) < original_length:
-            self._write_file(file_path, data)
-            return 1
-        return 0
+        return self._submit(file_path, {'op': 'delete', 'query': query}).result()
     
     async def update_one(self, collection: str, query: Dict[str, Any], update: Dict[str, Any]) -> int:
         """
@@ -173,8 +789,11 @@ class JSONStorage:
         Returns:
             Number of updated documents (0 or 1)
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._update_one_sync, collection, query, update)
+        file_path = self.collections.get(collection)
+        if not file_path:
+            return 0
+        change = {'op': 'update', 'query': query, 'update': update}
+        return await asyncio.wrap_future(self._submit(file_path, change))
     
     def _update_one_sync(self, collection: str, query: Dict[str, Any], update: Dict[str, Any]) -> int:
         """Synchronous update operation"""
@@ -182,26 +801,9 @@ class JSONStorage:
         if not file_path:
             return 0
         
-        data = self._read_file(file_path)
-        
-        # Find and update first matching item
-        for item in data:
-            match = True
-            for key, value in query.items():
-                if item.get(key) != value:
-                    match = False
-                    break
-            if match:
-                # Handle $set operation
-                if '$set' in update:
-                    item.update(update['$set'])
-                else:
-                    item.update(update)
-                
-                self._write_file(file_path, data)
-                return 1
-        
-        return 0
+        # Find and update first matching item (on a copy, so the cache is unchanged if the write fails)
+        change = {'op': 'update', 'query': query, 'update': update}
+        return self._submit(file_path, change).result()
 
 
 class CollectionWrapper:
@@ -217,9 +819,9 @@ class CollectionWrapper:
         
         Args:
             query: Query filter
-            projection: Field projection (ignored for JSON storage)
+            projection: Field projection (e.g. {'name': 1} or {'body': 0})
         """
-        return FindWrapper(self.storage, self.collection_name, query)
+        return FindWrapper(self.storage, self.collection_name, query, projection)
     
     async def insert_one(self, document: Dict[str, Any]):
         """Insert one document"""
@@ -239,17 +841,48 @@ class CollectionWrapper:
 class FindWrapper:
     """Wrapper to mimic MongoDB find cursor"""
     
-    def __init__(self, storage: JSONStorage, collection_name: str, query: Dict[str, Any] = None):
+    def __init__(self, storage: JSONStorage, collection_name: str, query: Dict[str, Any] = None,
+                 projection: Dict[str, Any] = None):
         self.storage = storage
         self.collection_name = collection_name
         self.query = query or {}
+        self.projection = projection
+        self._sort: Optional[List[Tuple[str, int]]] = None
+        self._skip = 0
+        self._limit: Optional[int] = None
+        self._after: Optional[Tuple[Tuple[str, Any], Tuple[str, Any]]] = None
+    
+    def sort(self, key_or_list, direction: Optional[int] = None):
+        """Sort by one field (sort('name', DESCENDING)) or a list of (field, direction) pairs"""
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction or ASCENDING)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+    
+    def skip(self, count: int):
+        """Leave out the first count matches"""
+        self._skip = count
+        return self
+    
+    def limit(self, count: int):
+        """Return at most count documents (0 means no limit)"""
+        self._limit = count or None
+        return self
+    
+    def after(self, key: Tuple[str, Any], order: Tuple[str, Any]):
+        """Start after the document whose key field has key's value (see JSONStorage.find())"""
+        self._after = (key, order)
+        return self
     
     async def to_list(self, length: Optional[int] = None):
         """Convert find results to list"""
-        results = await self.storage.find(self.collection_name, self.query)
+        limit = self._limit
         if length is not None and length > 0:
-            return results[:length]
-        return results
+            limit = length if limit is None else min(limit, length)
+        return await self.storage.find(
+            self.collection_name, self.query, self.projection, self._sort, self._skip, limit, self._after
+        )
 
 
 class DatabaseWrapper:
@@ -0,0 +1,208 @@
+"""
+Mbox export for Speedy Statements
+Appends a batch of drafts to a few large mbox shards instead of one .eml file each,
+with an index that maps every source PDF to its shard and byte offset
+"""
+import json
+import logging
+import os
+import re
+import time
+from typing import BinaryIO, Callable, Dict, List, Optional, TextIO
+
+# Shards roll over to a new file once they reach this size (512 MB)
+DEFAULT_SHARD_MAX_BYTES = 512 * 1024 * 1024
+
+# mboxrd quoting: a line starting with "From " (after any number of '>') gets one more '>'
+_FROM_LINE = re.compile(r'^(>*From )', re.M)
+
+
+def default_shard_max_bytes() -> int:
+    """
+    Shard size limit.
+
+    Reads MBOX_SHARD_MAX_BYTES from the environment, falling back to DEFAULT_SHARD_MAX_BYTES.
+    """
+    configured = os.environ.get('MBOX_SHARD_MAX_BYTES')
+    if configured:
+        try:
+            return max(1, int(configured))
+        except ValueError:
+            logging.warning(f"Ignoring invalid MBOX_SHARD_MAX_BYTES value: {configured}")
+    return DEFAULT_SHARD_MAX_BYTES
+
+
+class _FromQuotingWriter:
+    """
+    Text stream for one message: quotes "From " lines and writes UTF-8 to the shard
+
+    Expects writes to end on line boundaries (DraftTemplate.write_to and add_eml_file do),
+    so a "From " is never split across two writes.
+    """
+
+    def __init__(self, out: BinaryIO):
+        self._out = out
+        self.at_line_start = True
+
+    def write(self, text: str) -> int:
+        if not text:
+            return 0
+        rest = text
+        if not self.at_line_start:
+            # The first line continues the previous write, so it can't start a "From " line
+            head, sep, rest = text.partition('\n')
+            self._out.write((head + sep).encode('utf-8'))
+        if rest:
+            self._out.write(_FROM_LINE.sub(r'>\1', rest).encode('utf-8'))
+        self.at_line_start = text.endswith('\n')
+        return len(text)
+
+
+class MboxShardWriter:
+    """
+    Writes messages into <basename>_0001.mbox, <basename>_0002.mbox, ... and
+    <basename>.index.jsonl in a directory
+
+    Each message is streamed straight into the current shard, so memory use does not grow
+    with the batch. Shards and the index are written under hidden temporary names and
+    renamed when finished, so a folder watcher never picks up a partial file. Use it as a
+    context manager: leaving the block normally finishes the files, an exception removes them.
+    """
+
+    def __init__(self, directory: str, basename: str, max_shard_bytes: Optional[int] = None):
+        """
+        Initialize the writer
+
+        Args:
+            directory: Folder the shards and index are written to
+            basename: Prefix of the shard and index filenames
+            max_shard_bytes: Start a new shard once the current one reaches this size.
+                Defaults to default_shard_max_bytes()
+        """
+        self.directory = directory
+        self.basename = basename
+        self.max_shard_bytes = max_shard_bytes or default_shard_max_bytes()
+        # Finished shards: {'filename', 'path', 'size', 'messages'}
+        self.shards: List[Dict] = []
+        self.index_path = os.path.join(directory, f"{basename}.index.jsonl")
+        self._separator = f"From MAILER-DAEMON {time.asctime(time.gmtime())}\n".encode('ascii')
+        self._shard = None
+        self._shard_name: Optional[str] = None
+        self._shard_messages = 0
+        self._index = open(self._temp_path(self.index_path), 'w', encoding='utf-8')
+
+    def __enter__(self) -> 'MboxShardWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @staticmethod
+    def _temp_path(path: str) -> str:
+        directory, filename = os.path.split(path)
+        return os.path.join(directory, f".{filename}.tmp")
+
+    def _finish_shard(self) -> None:
+        if self._shard is None:
+            return
+        size = self._shard.tell()
+        self._shard.close()
+        path = os.path.join(self.directory, self._shard_name)
+        os.replace(self._temp_path(path), path)
+        self.shards.append({
+            'filename': self._shard_name,
+            'path': path,
+            'size': size,
+            'messages': self._shard_messages
+        })
+        self._shard = None
+
+    def _next_shard(self) -> None:
+        self._finish_shard()
+        self._shard_name = f"{self.basename}_{len(self.shards) + 1:04d}.mbox"
+        self._shard = open(self._temp_path(os.path.join(self.directory, self._shard_name)), 'w+b')
+        self._shard_messages = 0
+
+    def add(self, write_message: Callable[[TextIO], None], filename: str, recipient: str) -> Dict:
+        """
+        Append one message
+
+        Args:
+            write_message: Writes the message (headers and body) to the text stream it is given
+            filename: Source PDF, recorded in the index
+            recipient: To address, recorded in the index
+
+        Returns:
+            Index entry: filename, recipient, shard, offset and length (bytes, including
+            the "From " separator line)
+        """
+        if self._shard is None or (self._shard_messages and self._shard.tell() >= self.max_shard_bytes):
+            self._next_shard()
+
+        offset = self._shard.tell()
+        try:
+            self._shard.write(self._separator)
+            out = _FromQuotingWriter(self._shard)
+            write_message(out)
+            # Messages end with a newline, then a blank line before the next separator
+            self._shard.write(b'\n' if out.at_line_start else b'\n\n')
+        except BaseException:
+            # Drop the partial message so the shard stays readable
+            self._shard.seek(offset)
+            self._shard.truncate()
+            raise
+        self._shard_messages += 1
+
+        entry = {
+            'filename': filename,
+            'recipient': recipient,
+            'shard': self._shard_name,
+            'offset': offset,
+            'length': self._shard.tell() - offset
+        }
+        self._index.write(json.dumps(entry) + '\n')
+        return entry
+
+    def add_draft(self, draft_template, recipient_email: str, pdf_file: BinaryIO, pdf_filename: str) -> Dict:
+        """Append a draft built by a DraftTemplate; see add()"""
+        return self.add(
+            lambda out: draft_template.write_to(out, recipient_email, pdf_file, pdf_filename),
+            pdf_filename,
+            recipient_email
+        )
+
+    def add_eml_file(self, eml_path: str, pdf_filename: str, recipient_email: str) -> Dict:
+        """Append an existing .eml file; see add()"""
+        def copy_lines(out: TextIO) -> None:
+            # Line by line, so "From " quoting sees whole lines
+            with open(eml_path, 'r', encoding='utf-8', newline='') as eml_file:
+                for line in eml_file:
+                    out.write(line)
+        return self.add(copy_lines, pdf_filename, recipient_email)
+
+    def close(self) -> List[Dict]:
+        """
+        Finish the current shard and the index
+
+        Returns:
+            The shards that were written
+        """
+        self._finish_shard()
+        self._index.close()
+        os.replace(self._temp_path(self.index_path), self.index_path)
+        return self.shards
+
+    def abort(self) -> None:
+        """Remove everything written so far"""
+        if self._shard is not None:
+            self._shard.close()
+            os.remove(self._temp_path(os.path.join(self.directory, self._shard_name)))
+            self._shard = None
+        self._index.close()
+        os.remove(self._temp_path(self.index_path))
+        for shard in self.shards:
+            os.remove(shard['path'])
+        self.shards = []
@@ -0,0 +1,430 @@
+"""
+PDF extraction engine for Speedy Statements
+Parses statement PDFs and pulls out email addresses, in parallel supervised worker processes
+"""
+import asyncio
+import functools
+import io
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import PyPDF2
+
+from extraction_cache import ExtractionCache, hash_bytes, hash_file
+from worker_pool import SupervisedPool, TaskMemoryExceeded, TaskTimeout, WorkerCrashed
+
+
+# Characters allowed either side of the '@' (same classes as the original regex)
+EMAIL_LOCAL_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._%+-'
+EMAIL_DOMAIN_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.-'
+# RFC 5321 length limits; longer runs are not addresses and bound the work per '@'
+EMAIL_MAX_LOCAL = 64
+EMAIL_MAX_DOMAIN = 255
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _email_domain_end(text: str, start: int, end: int) -> int:
+    """
+    Where the domain starting at text[start] ends, or -1 if it has no valid top-level domain
+
+    The domain run is text[start:end]. The address ends after the last
+    '.' + two or more letters that is followed by a non-word character.
+    """
+    dot = text.rfind('.', start + 1, end)
+    while dot != -1:
+        tld_end = dot + 1
+        while tld_end < end and text[tld_end].isascii() and text[tld_end].isalpha():
+            tld_end += 1
+        if tld_end - dot - 1 >= 2 and (tld_end == len(text) or not _is_word_char(text[tld_end])):
+            return tld_end
+        dot = text.rfind('.', start + 1, dot)
+    return -1
+
+
+# Utility function to extract emails from text
+def extract_emails_from_text(text: str) -> List[str]:
+    """
+    Find email addresses by scanning outward from each '@'
+
+    Runs in linear time: every '@' looks at no more than EMAIL_MAX_LOCAL
+    characters to its left and EMAIL_MAX_DOMAIN to its right, so long
+    dot- or hyphen-heavy runs in statement tables cannot cause backtracking.
+
+    Returns:
+        Lowercased addresses without duplicates, in order of first appearance
+    """
+    emails = {}
+    scanned_to = 0  # matches never overlap
+    at = text.find('@')
+    while at != -1:
+        # Expand right over the domain (one character past the limit, to spot overlong runs)
+        window = text[at + 1:at + EMAIL_MAX_DOMAIN + 2]
+        end = at + 1 + (len(window) - len(window.lstrip(EMAIL_DOMAIN_CHARS)))
+        domain_end = -1
+        if end - at - 1 <= EMAIL_MAX_DOMAIN:
+            domain_end = _email_domain_end(text, at + 1, end)
+
+        if domain_end != -1:
+            # Expand left over the local part
+            window = text[max(scanned_to, at - EMAIL_MAX_LOCAL - 1):at]
+            start = at - (len(window) - len(window.rstrip(EMAIL_LOCAL_CHARS)))
+            # An address starts on a word character that is not glued to a previous word
+            while start < at and not _is_word_char(text[start]):
+                start += 1
+            if (start < at and at - start <= EMAIL_MAX_LOCAL and
+                    (start == 0 or not _is_word_char(text[start - 1]))):
+                emails.setdefault(text[start:domain_end].lower(), None)
+                scanned_to = domain_end
+
+        at = text.find('@', max(at + 1, scanned_to))
+    return list(emails)
+
+
+# Bump when the text or email extraction logic changes; this invalidates the extraction cache
+EXTRACTION_VERSION = '2'
+CACHE_VERSION = f"{EXTRACTION_VERSION}-PyPDF2-{PyPDF2.__version__}"
+
+# Pages read per statement in early-exit mode when no budget is given
+DEFAULT_PAGE_BUDGET = 5
+
+_extraction_cache: Optional[ExtractionCache] = None
+_extraction_cache_loaded = False
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Extraction cache for this process, opened on first use (None if disabled)"""
+    global _extraction_cache, _extraction_cache_loaded
+    with _extraction_cache_lock:
+        if not _extraction_cache_loaded:
+            _extraction_cache = ExtractionCache.from_environment(CACHE_VERSION)
+            _extraction_cache_loaded = True
+    return _extraction_cache
+
+
+def _read_pdf_text(stream) -> str:
+    pdf_reader = PyPDF2.PdfReader(stream)
+    text = ""
+    for page in pdf_reader.pages:
+        text += page.extract_text()
+    return text
+
+
+def _cache_lookup(cache: Optional[ExtractionCache], content_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+    if cache is None or content_hash is None:
+        return None
+    try:
+        return cache.get(content_hash)
+    except sqlite3.Error as e:
+        logging.warning(f"Extraction cache lookup failed: {e}")
+        return None
+
+
+def _cache_store(cache: Optional[ExtractionCache], content_hash: Optional[str], result: Dict[str, Any]) -> None:
+    if cache is None or content_hash is None:
+        return
+    try:
+        cache.put(content_hash, result['text'], result['emails'])
+    except sqlite3.Error as e:
+        logging.warning(f"Extraction cache store failed: {e}")
+
+
+def extract_pdf(pdf_path: str) -> Dict[str, Any]:
+    """
+    Extract text and emails from a PDF on disk, using the extraction cache
+
+    Args:
+        pdf_path: Path of the PDF file
+
+    Returns:
+        {'text': ..., 'emails': [...]}; both empty if the PDF cannot be read
+    """
+    cache = get_extraction_cache()
+    content_hash = None
+    if cache is not None:
+        try:
+            content_hash = cache.hash_for_path(pdf_path)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Could not hash {pdf_path} for the extraction cache: {e}")
+
+    cached = _cache_lookup(cache, content_hash)
+    if cached is not None:
+        return cached
+
+    try:
+        with open(pdf_path, 'rb') as file:
+            text = _read_pdf_text(file)
+    except MemoryError:
+        # Let the worker supervisor report the file as too large
+        raise
+    except Exception as e:
+        logging.error(f"Error extracting text from {pdf_path}: {e}")
+        return {'text': '', 'emails': []}
+
+    result = {'text': text, 'emails': extract_emails_from_text(text)}
+    _cache_store(cache, content_hash, result)
+    return result
+
+
+def extract_pdf_bytes(pdf_file: bytes) -> Dict[str, Any]:
+    """
+    Extract text and emails from in-memory PDF content, using the extraction cache
+
+    Args:
+        pdf_file: PDF content
+
+    Returns:
+        {'text': ..., 'emails': [...]}; both empty if the PDF cannot be read
+    """
+    cache = get_extraction_cache()
+    content_hash = hash_bytes(pdf_file) if cache is not None else None
+
+    cached = _cache_lookup(cache, content_hash)
+    if cached is not None:
+        return cached
+
+    try:
+        text = _read_pdf_text(io.BytesIO(pdf_file))
+    except MemoryError:
+        raise
+    except Exception as e:
+        logging.error(f"Error extracting text from PDF file: {e}")
+        return {'text': '', 'emails': []}
+
+    result = {'text': text, 'emails': extract_emails_from_text(text)}
+    _cache_store(cache, content_hash, result)
+    return result
+
+
+# Utility function to extract text from PDF
+def extract_text_from_pdf(pdf_path: str) -> str:
+    return extract_pdf(pdf_path)['text']
+
+# Utility function to extract text from PDF file object
+def extract_text_from_pdf_file(pdf_file: bytes) -> str:
+    return extract_pdf_bytes(pdf_file)['text']
+
+
+def extract_pdf_pages(pdf_path: str, page_budget: Optional[int] = DEFAULT_PAGE_BUDGET) -> Dict[str, Any]:
+    """
+    Early-exit extraction: read pages one at a time and stop at the first page
+    that contains an email, or when the page budget runs out
+
+    Results only cover the pages read, so they are not written to the extraction cache.
+
+    Args:
+        pdf_path: Path of the PDF file
+        page_budget: Maximum number of pages to read. None or 0 means no limit
+
+    Returns:
+        {'text': ..., 'emails': [...], 'pages_scanned': [1-based page numbers], 'page_count': ...}
+    """
+    text = ""
+    pages_scanned = []
+    page_count = 0
+    try:
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            page_count = len(pdf_reader.pages)
+            pages_to_read = min(page_count, page_budget) if page_budget else page_count
+            for index in range(pages_to_read):
+                page_text = pdf_reader.pages[index].extract_text()
+                text += page_text
+                pages_scanned.append(index + 1)
+                if extract_emails_from_text(page_text):
+                    break
+    except MemoryError:
+        raise
+    except Exception as e:
+        logging.error(f"Error extracting text from {pdf_path}: {e}")
+
+    return {
+        'text': text,
+        'emails': extract_emails_from_text(text),
+        'pages_scanned': pages_scanned,
+        'page_count': page_count
+    }
+
+
+def _content_hash(pdf_path: str) -> Optional[str]:
+    """Content hash of a PDF, reusing the one the extraction cache stored for an unchanged file"""
+    cache = get_extraction_cache()
+    try:
+        return cache.hash_for_path(pdf_path) if cache is not None else hash_file(pdf_path)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"Could not hash {pdf_path}: {e}")
+        return None
+
+
+def extract_pdf_summary(pdf_path: str, page_budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Worker entry point: emails for one PDF, without shipping the full text back
+
+    Args:
+        pdf_path: Path of the PDF file
+        page_budget: None for a full read; otherwise use early-exit mode with this budget
+
+    Returns:
+        {'emails': [...], 'status': 'ok', 'content_hash': ...}, plus 'pages_scanned' and
+        'page_count' in early-exit mode. The hash lets the folder index store the file
+        without reading it again in the server process
+    """
+    if page_budget is None:
+        result = {'emails': extract_pdf(pdf_path)['emails']}
+    else:
+        result = extract_pdf_pages(pdf_path, page_budget)
+        del result['text']
+    result['status'] = 'ok'
+    result['content_hash'] = _content_hash(pdf_path)
+    return result
+
+
+def _summary_from_future(future) -> Dict[str, Any]:
+    """Turn a finished worker future into a summary, marking files the supervisor had to kill"""
+    try:
+        return future.result()
+    except TaskTimeout:
+        return {'emails': [], 'status': 'timed_out'}
+    except TaskMemoryExceeded:
+        return {'emails': [], 'status': 'too_large'}
+    except (WorkerCrashed, RuntimeError) as e:
+        logging.error(f"PDF extraction worker failed: {e}")
+        return {'emails': [], 'status': 'failed'}
+
+
+def _env_number(name: str, default: float) -> float:
+    configured = os.environ.get(name)
+    if configured:
+        try:
+            return float(configured)
+        except ValueError:
+            logging.warning(f"Ignoring invalid {name} value: {configured}")
+    return default
+
+
+def default_worker_count() -> int:
+    """
+    Number of extraction workers to use.
+
+    Reads PDF_EXTRACT_WORKERS from the environment, falling back to the
+    number of CPUs on the machine.
+    """
+    return max(1, int(_env_number('PDF_EXTRACT_WORKERS', os.cpu_count() or 1)))
+
+
+def default_task_timeout() -> Optional[float]:
+    """Seconds one PDF may take (PDF_EXTRACT_TIMEOUT, default 60; 0 disables)"""
+    timeout = _env_number('PDF_EXTRACT_TIMEOUT', 60)
+    return timeout if timeout > 0 else None
+
+
+def default_memory_limit() -> Optional[int]:
+    """Address-space cap per worker in bytes (PDF_WORKER_MEMORY_MB, default 1024; 0 disables)"""
+    megabytes = _env_number('PDF_WORKER_MEMORY_MB', 1024)
+    return int(megabytes * 1024 * 1024) if megabytes > 0 else None
+
+
+class ExtractionEngine:
+    """Parallel PDF extraction in supervised worker processes"""
+
+    def __init__(self, max_workers: Optional[int] = None, task_timeout: Optional[float] = None,
+                 memory_limit: Optional[int] = None):
+        """
+        Initialize the extraction engine
+
+        Args:
+            max_workers: Number of worker processes. If None, uses default_worker_count()
+            task_timeout: Seconds per PDF before its worker is killed. If None, uses default_task_timeout()
+            memory_limit: Address-space cap per worker in bytes. If None, uses default_memory_limit()
+        """
+        self.max_workers = max_workers or default_worker_count()
+        self.task_timeout = task_timeout or default_task_timeout()
+        self.memory_limit = memory_limit or default_memory_limit()
+        self._pool: Optional[SupervisedPool] = None
+
+    def _get_pool(self) -> SupervisedPool:
+        """Create the worker pool on first use"""
+        if self._pool is None:
+            self._pool = SupervisedPool(
+                max_workers=self.max_workers,
+                task_timeout=self.task_timeout,
+                memory_limit=self.memory_limit
+            )
+        return self._pool
+
+    def extract_paths(self, pdf_paths: List[str], page_budget: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Extract emails from many PDFs
+
+        Every file is parsed in a worker process, so a PDF that hangs or blows up
+        only costs its own result: it comes back with status 'timed_out',
+        'too_large' or 'failed' and the rest of the batch carries on.
+
+        Args:
+            pdf_paths: Paths of the PDF files to parse
+            page_budget: None for full reads; otherwise early-exit mode (see extract_pdf_pages)
+
+        Returns:
+            One extract_pdf_summary() result per path, in the same order as pdf_paths
+        """
+        if not pdf_paths:
+            return []
+
+        pool = self._get_pool()
+        worker = functools.partial(extract_pdf_summary, page_budget=page_budget)
+        futures = [pool.submit(worker, pdf_path) for pdf_path in pdf_paths]
+        return [_summary_from_future(future) for future in futures]
+
+    async def stream_paths(
+        self,
+        pdf_paths: List[str],
+        page_budget: Optional[int] = None,
+        max_in_flight: Optional[int] = None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Yield results as soon as each PDF is parsed, in completion order
+
+        Only max_in_flight files are queued at a time, so memory stays flat no
+        matter how many paths there are. Pending work is cancelled if the
+        consumer stops early (e.g. the client disconnects).
+
+        Args:
+            pdf_paths: Paths of the PDF files to parse
+            page_budget: None for full reads; otherwise early-exit mode (see extract_pdf_pages)
+            max_in_flight: Files queued at once. If None, uses four per worker
+
+        Yields:
+            (index into pdf_paths, extract_pdf_summary() result)
+        """
+        pool = self._get_pool()
+        worker = functools.partial(extract_pdf_summary, page_budget=page_budget)
+        max_in_flight = max_in_flight or self.max_workers * 4
+        remaining = enumerate(pdf_paths)
+        pending: Dict[asyncio.Future, int] = {}
+
+        try:
+            while True:
+                for index, pdf_path in itertools.islice(remaining, max_in_flight - len(pending)):
+                    pending[asyncio.wrap_future(pool.submit(worker, pdf_path))] = index
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), _summary_from_future(future)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
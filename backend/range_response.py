@@ -0,0 +1,163 @@
+"""
+Resumable file downloads for Speedy Statements
+A FileResponse that honours Range and If-Range, so an interrupted download of a large
+batch ZIP can continue where it stopped instead of starting over
+"""
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Tuple, Union
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+# Bytes read per chunk when the server can't send the file itself
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A requested range that lies outside the file
+UNSATISFIABLE = 'unsatisfiable'
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """Strong validator from the file's size and modification time"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def requested_range(headers: Headers, size: int, etag: str, mtime: float) -> Union[None, str, Tuple[int, int]]:
+    """
+    Work out which part of a file the client asked for
+
+    Args:
+        headers: Request headers
+        size: File size in bytes
+        etag: Current ETag of the file
+        mtime: Current modification time of the file
+
+    Returns:
+        (first, last) byte positions, inclusive; UNSATISFIABLE if the range lies outside
+        the file; None to send the whole file (no Range, a Range we don't serve, or an
+        If-Range that no longer matches)
+    """
+    range_header = headers.get('range')
+    if not range_header:
+        return None
+
+    # A stale If-Range means the file changed since the first part was fetched: start over
+    if_range = headers.get('if-range')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            # Strong comparison; weak validators never match
+            if if_range != etag:
+                return None
+        else:
+            try:
+                if int(parsedate_to_datetime(if_range).timestamp()) != int(mtime):
+                    return None
+            except (TypeError, ValueError):
+                return None
+
+    # Only single ranges are served; anything else gets the whole file, which RFC 9110 allows
+    match = _RANGE.match(range_header.replace(' ', ''))
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return UNSATISFIABLE
+        return max(0, size - length), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        return UNSATISFIABLE
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class RangeFileResponse(FileResponse):
+    """
+    FileResponse with byte-range support
+
+    Answers Range requests with 206 Partial Content (or 416 when the range lies outside
+    the file), checks If-Range against the ETag or Last-Modified date, and always sends
+    Accept-Ranges, ETag and Content-Length. The body is handed to the server with the
+    ASGI zero-copy send extension when it offers one, so the kernel copies the file
+    straight to the socket; otherwise it is read in large chunks.
+    """
+
+    chunk_size = DEFAULT_CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+
+        size = stat_result.st_size
+        etag = make_etag(stat_result)
+        self.headers['accept-ranges'] = 'bytes'
+        self.headers['etag'] = etag
+        self.headers['last-modified'] = formatdate(stat_result.st_mtime, usegmt=True)
+
+        byte_range = requested_range(Headers(scope=scope), size, etag, stat_result.st_mtime)
+        status_code = self.status_code
+        offset, count = 0, size
+        if byte_range == UNSATISFIABLE:
+            status_code, count = 416, 0
+            self.headers['content-range'] = f"bytes */{size}"
+        elif byte_range is not None:
+            first, last = byte_range
+            status_code, offset, count = 206, first, last - first + 1
+            self.headers['content-range'] = f"bytes {first}-{last}/{size}"
+        self.headers['content-length'] = str(count)
+
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": self.raw_headers,
+        })
+        extensions = scope.get("extensions") or {}
+        if scope["method"].upper() == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, 'rb') as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": offset,
+                    "count": count,
+                    "more_body": False,
+                })
+        elif "http.response.pathsend" in extensions and count == size:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            await self._send_chunks(send, offset, count)
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_chunks(self, send: Send, offset: int, count: int) -> None:
+        async with await anyio.open_file(self.path, mode='rb') as file:
+            await file.seek(offset)
+            remaining = count
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    # The file shrank underneath us; end the body rather than hang
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": bool(remaining),
+                })
+            if remaining:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
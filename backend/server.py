@@ -1,24 +1,39 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
+import json
+import time
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict
 import uuid
 from datetime import datetime, timezone
-import PyPDF2
-import re
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 import base64
+import shutil
 import io
 import zipfile
+import asyncio
+import functools
+from artifact_store import ArtifactStore
 from json_storage import JSONStorage, DatabaseWrapper
+from batch_jobs import BatchJob, BatchJobManager
+from draft_builder import DraftTemplate
+from executors import BlockingExecutor
+from folder_index import FolderIndex, FolderScan, mode_key
+from mbox_export import MboxShardWriter
+from range_response import RangeFileResponse
+from upload_sessions import UploadSessionStore
+from zip_stream import ZipStreamWriter, duplicate_file, open_entry
+from pdf_extraction import (
+    CACHE_VERSION,
+    DEFAULT_PAGE_BUDGET,
+    ExtractionEngine,
+    get_extraction_cache,
+)
 
 
 ROOT_DIR = Path(__file__).parent
@@ -27,9 +42,38 @@ load_dotenv(ROOT_DIR / '.env')
 # JSON Storage connection (replaces MongoDB for standalone app)
 storage = JSONStorage()
 db = DatabaseWrapper(storage)
+# Largest page GET /email-accounts and GET /templates return when given a limit
+MAX_PAGE_SIZE = 1000
+
+# Uploaded PDFs kept by ID, so drafts and batches don't upload the same file again
+upload_sessions = UploadSessionStore.from_environment()
+
+# Pickup directory for output="directory": drafts are written there instead of being downloaded
+DRAFT_OUTPUT_DIR = os.environ.get('DRAFT_OUTPUT_DIR')
+
+# Generated files for /api/download, bounded by ARTIFACT_TTL and ARTIFACT_MAX_BYTES. The janitor
+# also clears partial files that interrupted requests left in folders this app owns: uploads in
+# the upload session folder and drafts in DRAFT_OUTPUT_DIR. Shared folders such as the system
+# temp directory are never swept
+orphan_patterns = [os.path.join(upload_sessions.directory, '*.tmp')]
+if DRAFT_OUTPUT_DIR:
+    # Hidden temp names written by write_draft_to_directory()
+    orphan_patterns.append(os.path.join(DRAFT_OUTPUT_DIR, '.*.eml.*.tmp'))
+artifact_store = ArtifactStore.from_environment(orphan_patterns=orphan_patterns)
+# It also deletes expired upload sessions, so an idle server doesn't keep them until the next upload
+artifact_store.add_janitor_task(upload_sessions.purge_expired)
+
+# Process pool for PDF parsing (size set by PDF_EXTRACT_WORKERS, defaults to CPU count)
+extraction_engine = ExtractionEngine()
+
+# Per-folder index of previous scans, so re-scans only parse new or changed PDFs
+folder_index = FolderIndex.from_environment(CACHE_VERSION)
+
+# Background batch jobs (BATCH_JOB_WORKERS items at a time across all jobs)
+batch_jobs = BatchJobManager.from_environment()
 
-# Temporary storage for generated files (for direct download)
-generated_files: Dict[str, str] = {}
+# Bounded thread pool for blocking work, so long batches don't stall light requests
+blocking_executor = BlockingExecutor()
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -48,6 +92,16 @@ class EmailTemplate(BaseModel):
     body: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# A template in GET /templates: only the fields asked for with ?fields= are set
+class EmailTemplateListItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    id: Optional[str] = None
+    name: Optional[str] = None
+    subject: Optional[str] = None
+    body: Optional[str] = None
+    created_at: Optional[datetime] = None
+
 class EmailTemplateCreate(BaseModel):
     name: str
     subject: str
@@ -69,9 +123,23 @@ class PDFExtraction(BaseModel):
     filename: str
     emails: List[str]
     file_path: str
+    # Only set in early-exit mode: 1-based pages that were read, and the document's page count
+    pages_scanned: Optional[List[int]] = None
+    page_count: Optional[int] = None
+    # "ok", or "timed_out" / "too_large" / "failed" if the worker parsing this file had to be killed
+    status: str = "ok"
+    # Only set for uploaded files: pass upload_id to the draft and batch routes instead of the file
+    upload_id: Optional[str] = None
+    # SHA-256 of the file, when it could be read
+    content_hash: Optional[str] = None
 
 class ExtractRequest(BaseModel):
     folder_path: str
+    # Stop reading each PDF at the first page with an email, or after page_budget pages
+    early_exit: bool = False
+    page_budget: Optional[int] = Field(None, ge=1)
+    # Reuse results for files that haven't changed since the last scan of this folder
+    use_index: bool = True
 
 class DraftEmailRequest(BaseModel):
     pdf_filename: str
@@ -81,46 +149,476 @@ class DraftEmailRequest(BaseModel):
     sender_name: Optional[str] = None
     subject: str
     body: str
+    # "download", or "directory" to write into DRAFT_OUTPUT_DIR
+    output: str = "download"
+
+# Request model for batch processing
+class BatchDraftItem(BaseModel):
+    pdf_filename: str
+    # file_path from /pdf/extract
+    pdf_path: str
+    recipient_email: str
+
+class BatchDraftRequest(BaseModel):
+    items: List[BatchDraftItem]
+    subject: str
+    body: str
+    sender_email: Optional[str] = None
+    sender_name: Optional[str] = None
+    # "download", or "directory" to write into DRAFT_OUTPUT_DIR
+    output: str = "download"
+    # "eml" (one file per draft) or "mbox" (drafts appended to a few mbox shards plus an index)
+    format: str = "eml"
+
+
+# Utility function to resolve an upload session, or fail with 404
+def get_upload_session(upload_id: str):
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Upload not found or expired: {upload_id}")
+    return session
 
+# Utility function to write a draft, streaming the PDF from a path or an uploaded file
+def write_draft(draft_template: DraftTemplate, eml_path: str, recipient_email: str, pdf_source, pdf_filename: str) -> None:
+    if isinstance(pdf_source, str):
+        draft_template.write_path(eml_path, recipient_email, pdf_source, pdf_filename)
+    else:
+        pdf_source.seek(0)
+        draft_template.write(eml_path, recipient_email, pdf_source, pdf_filename)
 
-# Utility function to extract emails from text
-def extract_emails_from_text(text: str) -> List[str]:
-    # Comprehensive email regex pattern
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    emails = re.findall(email_pattern, text)
-    # Remove duplicates and return
-    return list(set(emails))
+# Utility function to check the output target; returns the pickup directory for "directory", None for "download"
+def get_draft_output_dir(output: str) -> Optional[str]:
+    if output == "download":
+        return None
+    if output != "directory":
+        raise HTTPException(status_code=400, detail=f"Unknown output target: {output}")
+    if not DRAFT_OUTPUT_DIR:
+        raise HTTPException(status_code=400, detail="Directory output is not configured (set DRAFT_OUTPUT_DIR)")
+    os.makedirs(DRAFT_OUTPUT_DIR, exist_ok=True)
+    return DRAFT_OUTPUT_DIR
 
-# Utility function to extract text from PDF
-def extract_text_from_pdf(pdf_path: str) -> str:
+# Utility function to write a draft into the pickup directory atomically (temp file, then rename)
+def write_draft_to_directory(draft_template: DraftTemplate, output_dir: str, recipient_email: str, pdf_source,
+                             pdf_filename: str) -> dict:
+    eml_filename = f"draft_{pdf_filename.replace('.pdf', '')}.eml"
+    eml_path = os.path.join(output_dir, eml_filename)
+    # Hidden temp name in the same directory, so watchers only ever see finished drafts
+    temp_path = os.path.join(output_dir, f".{eml_filename}.{uuid.uuid4().hex}.tmp")
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            return text
-    except Exception as e:
-        logging.error(f"Error extracting text from {pdf_path}: {e}")
-        return ""
+        write_draft(draft_template, temp_path, recipient_email, pdf_source, pdf_filename)
+        os.replace(temp_path, eml_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {
+        "filename": pdf_filename,
+        "recipient": recipient_email,
+        "output": eml_filename,
+        "path": eml_path,
+        "size": os.path.getsize(eml_path)
+    }
 
-# Utility function to extract text from PDF file object
-def extract_text_from_pdf_file(pdf_file: bytes) -> str:
+# Utility function to write a batch into the pickup directory, several drafts at a time
+async def write_batch_to_directory(draft_template: DraftTemplate, output_dir: str, items: List[dict]):
+    # Leave one blocking thread free so light requests are not queued behind the batch
+    writers = asyncio.Semaphore(max(1, blocking_executor.max_workers - 1))
+    
+    async def write_item(item):
+        if item["reason"]:
+            return None, {"filename": item["filename"], "reason": item["reason"]}
+        async with writers:
+            try:
+                written = await blocking_executor.run(
+                    write_draft_to_directory, draft_template, output_dir, item["recipient"], item["source"], item["filename"]
+                )
+                return written, None
+            except Exception as e:
+                return None, {"filename": item["filename"], "reason": str(e)}
+    
+    results = await asyncio.gather(*(write_item(item) for item in items))
+    successful = [written for written, _ in results if written]
+    failed = [failure for _, failure in results if failure]
+    return successful, failed
+
+# Utility function to check the batch export format: one .eml per draft, or mbox shards
+def check_export_format(export_format: str) -> str:
+    if export_format not in ("eml", "mbox"):
+        raise HTTPException(status_code=400, detail=f"Unknown format: {export_format}")
+    return export_format
+
+# Utility function to append a batch to mbox shards in one pass, streaming each PDF
+def write_batch_mbox(draft_template: DraftTemplate, directory: str, basename: str, items: List[dict]):
+    successful = []
+    failed = []
+    with MboxShardWriter(directory, basename) as mbox:
+        for item in items:
+            if item["reason"]:
+                failed.append({"filename": item["filename"], "reason": item["reason"]})
+                continue
+            
+            pdf_source = item["source"]
+            try:
+                pdf_file = open(pdf_source, 'rb') if isinstance(pdf_source, str) else pdf_source
+                try:
+                    pdf_file.seek(0)
+                    entry = mbox.add_draft(draft_template, item["recipient"], pdf_file, item["filename"])
+                finally:
+                    if isinstance(pdf_source, str):
+                        pdf_file.close()
+            except Exception as e:
+                failed.append({"filename": item["filename"], "reason": str(e)})
+                continue
+            
+            successful.append({
+                "filename": item["filename"],
+                "recipient": item["recipient"],
+                "output": entry["shard"],
+                "offset": entry["offset"],
+                "length": entry["length"]
+            })
+    return successful, failed, mbox.shards, mbox.index_path
+
+# Utility function to zip a batch directory and then remove it
+def zip_batch_directory(batch_dir: str, zip_path: str) -> None:
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(batch_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arcname = file  # Just the filename, no directory structure
+                zipf.write(file_path, arcname)
+    
+    # Clean up batch directory
+    shutil.rmtree(batch_dir, ignore_errors=True)
+
+# Utility function to pair each batch PDF with its recipient and where to read it from
+def resolve_batch_items(recipient_map: List[dict], pdf_files: Optional[List[UploadFile]], detach_uploads: bool = False) -> List[dict]:
+    # Uploaded files first, then recipients that refer to an earlier upload session
+    pdf_sources = [(pdf_file.filename, pdf_file) for pdf_file in pdf_files or []]
+    uploaded_names = {filename for filename, _ in pdf_sources}
+    pdf_sources += [
+        (r['filename'], r['upload_id']) for r in recipient_map
+        if r.get('upload_id') and r['filename'] not in uploaded_names
+    ]
+    
+    items = []
+    for pdf_filename, pdf_source in pdf_sources:
+        item = {"filename": pdf_filename, "recipient": None, "source": None, "reason": None}
+        items.append(item)
+        
+        # Find the recipient for this file
+        recipient_info = next(
+            (r for r in recipient_map if r['filename'] == pdf_filename),
+            None
+        )
+        if not recipient_info:
+            item["reason"] = "No recipient email found for this file"
+            continue
+        item["recipient"] = recipient_info['email']
+        
+        # Read from the upload session's file, or from the spooled upload
+        if isinstance(pdf_source, str):
+            session = upload_sessions.get(pdf_source)
+            if session is None:
+                item["reason"] = f"Upload not found or expired: {pdf_source}"
+                continue
+            item["source"] = session.path
+        else:
+            # A streamed response outlives the request's uploads, so keep a handle of our own
+            item["source"] = duplicate_file(pdf_source.file) if detach_uploads else pdf_source.file
+    return items
+
+# Utility function to build the batch report text
+def build_batch_report(successful: List[dict], failed: List[dict]) -> str:
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    report_content = "SPEEDY STATEMENTS - GENERATION REPORT\n"
+    report_content += f"Generated: {timestamp}\n"
+    report_content += f"{'=' * 50}\n\n"
+    
+    report_content += "SUMMARY\n"
+    report_content += f"{'-' * 30}\n"
+    report_content += f"Total Processed: {len(successful) + len(failed)}\n"
+    report_content += f"Successful: {len(successful)}\n"
+    report_content += f"Failed: {len(failed)}\n\n"
+    
+    if successful:
+        report_content += "SUCCESSFULLY GENERATED\n"
+        report_content += f"{'-' * 30}\n"
+        for i, item in enumerate(successful, 1):
+            report_content += f"{i}. {item['filename']}\n"
+            report_content += f"   Recipient: {item['recipient']}\n"
+            report_content += f"   Output: {item['output']}\n\n"
+    
+    if failed:
+        report_content += "FAILED TO GENERATE\n"
+        report_content += f"{'-' * 30}\n"
+        for i, item in enumerate(failed, 1):
+            report_content += f"{i}. {item['filename']}\n"
+            report_content += f"   Reason: {item['reason']}\n\n"
+    
+    report_content += f"{'=' * 50}\n"
+    report_content += "End of Report\n"
+    return report_content
+
+# Utility function to write a batch straight into a streamed ZIP, with the report last
+def write_batch_zip_stream(writer: ZipStreamWriter, draft_template: DraftTemplate, items: List[dict]) -> None:
+    successful = []
+    failed = []
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_file))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for item in items:
+                if item["reason"]:
+                    failed.append({"filename": item["filename"], "reason": item["reason"]})
+                    continue
+                
+                eml_filename = f"draft_{item['filename'].replace('.pdf', '')}.eml"
+                try:
+                    pdf_source = item["source"]
+                    pdf_file = open(pdf_source, 'rb') if isinstance(pdf_source, str) else pdf_source
+                    with pdf_file:
+                        pdf_file.seek(0)
+                        size_hint = os.fstat(pdf_file.fileno()).st_size * 4 // 3
+                        with open_entry(zipf, eml_filename, size_hint) as entry:
+                            with io.TextIOWrapper(entry, encoding='utf-8') as eml_file:
+                                draft_template.write_to(eml_file, item["recipient"], pdf_file, item["filename"])
+                except BrokenPipeError:
+                    raise
+                except Exception as e:
+                    failed.append({"filename": item["filename"], "reason": str(e)})
+                    continue
+                
+                successful.append({
+                    "filename": item["filename"],
+                    "recipient": item["recipient"],
+                    "output": eml_filename
+                })
+            
+            report_filename = f"statement_report_{datetime.now().strftime('%Y-%m-%d')}.txt"
+            zipf.writestr(report_filename, build_batch_report(successful, failed))
+        writer.finish()
+    except BrokenPipeError:
+        logging.info("Batch download closed by the client before it finished")
     except Exception as e:
-        logging.error(f"Error extracting text from PDF file: {e}")
-        return ""
+        # The client gets a truncated ZIP rather than a hanging download
+        logging.error(f"Error streaming batch ZIP: {e}")
+        try:
+            writer.finish()
+        except BrokenPipeError:
+            pass
+    finally:
+        for item in items:
+            if item["source"] is not None and not isinstance(item["source"], str):
+                item["source"].close()
+
+# Utility function to get a batch job's working directory and its drafts and inputs folders
+def batch_job_dirs(job_id: str):
+    job_dir = os.path.join(batch_jobs.directory, job_id)
+    return job_dir, os.path.join(job_dir, 'drafts'), os.path.join(job_dir, 'inputs')
+
+# Utility function to write one batch job draft into the job's drafts folder
+def process_batch_job_item(drafts_dir: str, draft_template: DraftTemplate, job: BatchJob, item: dict) -> dict:
+    if item["reason"]:
+        raise ValueError(item["reason"])
+    eml_filename = f"draft_{item['filename'].replace('.pdf', '')}.eml"
+    write_draft(draft_template, os.path.join(drafts_dir, eml_filename), item["recipient"], item["source"], item["filename"])
+    return {
+        "filename": item["filename"],
+        "recipient": item["recipient"],
+        "output": eml_filename
+    }
+
+# Utility function to write one batch job draft into the pickup directory
+def process_batch_job_item_to_directory(output_dir: str, draft_template: DraftTemplate, job: BatchJob, item: dict) -> dict:
+    if item["reason"]:
+        raise ValueError(item["reason"])
+    return write_draft_to_directory(draft_template, output_dir, item["recipient"], item["source"], item["filename"])
+
+# Utility function to get the name shared by a batch job's ZIP and mbox shards (the submit time, so it is stable across restarts)
+def batch_job_basename(job: BatchJob) -> str:
+    created = datetime.fromtimestamp(job.created_at)
+    return f"speedy_statements_{created.strftime('%Y%m%d_%H%M%S')}_{job.job_id[:8]}"
+
+# Utility function to append a finished batch job's drafts to mbox shards, in item order
+def export_batch_job_mbox(job: BatchJob, directory: str):
+    _, drafts_dir, _ = batch_job_dirs(job.job_id)
+    with MboxShardWriter(directory, batch_job_basename(job)) as mbox:
+        for result in job.successful:
+            entry = mbox.add_eml_file(os.path.join(drafts_dir, result["output"]), result["filename"], result["recipient"])
+            # Checkpointed with the finished job, so the status points into the shards
+            result.update(output=entry["shard"], offset=entry["offset"], length=entry["length"])
+    return mbox.shards, mbox.index_path
+
+# Utility function to add the report to a finished batch job, zip it and register the download
+def finalize_batch_job(job: BatchJob) -> dict:
+    job_dir, drafts_dir, _ = batch_job_dirs(job.job_id)
+    # Named after the submit time, so finishing again after a restart rewrites the same ZIP
+    zip_filename = f"{batch_job_basename(job)}.zip"
+    zip_path = os.path.join(batch_jobs.directory, zip_filename)
+    artifact = {
+        "file_id": job.job_id,
+        "filename": zip_filename,
+        "download_url": f"/api/download/{job.job_id}"
+    }
+    
+    # The drafts folder is only gone if the server stopped after zipping but before recording it
+    if os.path.isdir(drafts_dir) or not os.path.exists(zip_path):
+        zip_dir = drafts_dir
+        if job.params.get("format") == "mbox":
+            # The ZIP holds the shards, their index and the report instead of the drafts
+            zip_dir = os.path.join(job_dir, 'export')
+            os.makedirs(zip_dir, exist_ok=True)
+            shards, index_path = export_batch_job_mbox(job, zip_dir)
+            artifact["shards"] = [{k: shard[k] for k in ("filename", "size", "messages")} for shard in shards]
+            artifact["index"] = os.path.basename(index_path)
+        report_filename = f"statement_report_{datetime.fromtimestamp(job.created_at).strftime('%Y-%m-%d')}.txt"
+        with open(os.path.join(zip_dir, report_filename), 'w', encoding='utf-8') as f:
+            f.write(build_batch_report(job.successful, job.failed))
+        zip_batch_directory(zip_dir, zip_path)
+    shutil.rmtree(job_dir, ignore_errors=True)
+    
+    register_batch_job_zip(job, zip_path)
+    return artifact
+
+# Utility function to offer a finished batch job's ZIP for download while the job is retained
+def register_batch_job_zip(job: BatchJob, zip_path: str):
+    finished_at = job.finished_at or time.time()
+    artifact_store.add(job.job_id, zip_path, ttl=finished_at + batch_jobs.retention - time.time())
+
+# Utility function to finish a batch job whose drafts went to the pickup directory (no ZIP)
+def finalize_batch_job_in_directory(output_dir: str, job: BatchJob) -> dict:
+    artifact = {"output_dir": output_dir}
+    if job.params.get("format") == "mbox":
+        shards, index_path = export_batch_job_mbox(job, output_dir)
+        artifact["shards"] = shards
+        artifact["index"] = {"path": index_path, "size": os.path.getsize(index_path)}
+    shutil.rmtree(batch_job_dirs(job.job_id)[0], ignore_errors=True)
+    return artifact
+
+# Utility function to remove the drafts and inputs of a cancelled batch job
+# (drafts already in the pickup directory stay there)
+def discard_batch_job(job: BatchJob) -> None:
+    shutil.rmtree(batch_job_dirs(job.job_id)[0], ignore_errors=True)
+
+# Utility function to build the callbacks of a batch job, for new jobs and ones resumed after a restart
+def batch_job_callbacks(job: BatchJob):
+    params = job.params
+    draft_template = DraftTemplate(params["subject"], params["body"], params.get("sender_email"), params.get("sender_name"))
+    output_dir = params.get("output_dir")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if output_dir and params.get("format") != "mbox":
+        return (
+            functools.partial(process_batch_job_item_to_directory, output_dir, draft_template),
+            functools.partial(finalize_batch_job_in_directory, output_dir),
+            discard_batch_job
+        )
+    # Drafts are checkpointed as files in the job's folder; mbox shards are built from them at the end
+    _, drafts_dir, _ = batch_job_dirs(job.job_id)
+    os.makedirs(drafts_dir, exist_ok=True)
+    return (
+        functools.partial(process_batch_job_item, drafts_dir, draft_template),
+        functools.partial(finalize_batch_job_in_directory, output_dir) if output_dir else finalize_batch_job,
+        discard_batch_job
+    )
+
+# Utility function to copy batch job inputs into the job's inputs folder, so they outlive the request and upload sessions
+def stage_batch_job_inputs(inputs_dir: str, items: List[dict]) -> None:
+    os.makedirs(inputs_dir, exist_ok=True)
+    for index, item in enumerate(items):
+        if item["source"] is None:
+            continue
+        input_path = os.path.join(inputs_dir, f"{index}.pdf")
+        if isinstance(item["source"], str):
+            try:
+                os.link(item["source"], input_path)
+            except OSError:
+                shutil.copyfile(item["source"], input_path)
+        else:
+            item["source"].seek(0)
+            with open(input_path, 'wb') as f:
+                shutil.copyfileobj(item["source"], f, 1024 * 1024)
+        item["source"] = input_path
+
+
+# Utility function to pair folder-mode PDFs (file_path from /pdf/extract) with their recipients
+def resolve_batch_path_items(request_items: List[BatchDraftItem]) -> List[dict]:
+    items = []
+    for request_item in request_items:
+        item = {
+            "filename": request_item.pdf_filename,
+            "recipient": request_item.recipient_email,
+            "source": request_item.pdf_path,
+            "reason": None
+        }
+        if not os.path.isfile(request_item.pdf_path):
+            item["source"] = None
+            item["reason"] = f"PDF file not found: {request_item.pdf_path}"
+        items.append(item)
+    return items
+
+# Utility function to start a batch job and build the submit response. Submitting stores every
+# item, and finishes the job straight away when no item is left to do, so it runs off the event loop
+async def start_batch_job(items: List[dict], subject: str, body: str, sender_email: Optional[str],
+                          sender_name: Optional[str], output_dir: Optional[str] = None, export_format: str = "eml",
+                          job_id: Optional[str] = None) -> JSONResponse:
+    job = await blocking_executor.run(
+        batch_jobs.submit,
+        items,
+        batch_job_callbacks,
+        params={
+            "subject": subject,
+            "body": body,
+            "sender_email": sender_email,
+            "sender_name": sender_name,
+            "output_dir": output_dir,
+            "format": export_format
+        },
+        job_id=job_id
+    )
+    return JSONResponse({
+        "success": True,
+        "job_id": job.job_id,
+        "total": job.total,
+        "status_url": f"/api/outlook/batch-jobs/{job.job_id}"
+    })
+
+
+# Utility function to read one page of a collection, in the order documents were added.
+# Without a limit the rest of the collection is returned; with one, X-Next-Cursor is set when
+# more documents follow and is passed back as cursor for the next page
+async def find_page(collection, response: Response, limit: Optional[int], cursor: Optional[str],
+                    projection: Optional[Dict[str, int]] = None) -> List[dict]:
+    find = collection.find({}, projection or {"_id": 0})
+    if cursor:
+        # Cursors are opaque to clients. They hold the id and created_at of the last document
+        # sent, so adding or deleting documents between pages never skips or repeats one
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            last_id, last_created_at = position['id'], position['created_at']
+        except (ValueError, UnicodeError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # If that document was deleted, the page starts at the first one created after it
+        find = find.after(('id', last_id), ('created_at', last_created_at))
+    if limit is None:
+        return await find.to_list(None)
+    
+    # One extra document tells whether there is a next page
+    documents = await find.limit(limit + 1).to_list(None)
+    if len(documents) > limit:
+        documents = documents[:limit]
+        # created_at may be projected out of the page, so look it up by id (an indexed field)
+        last = await collection.find({"id": documents[-1]["id"]}, {"_id": 0, "created_at": 1}).to_list(1)
+        position = {"id": documents[-1]["id"], "created_at": last[0].get("created_at") if last else None}
+        next_cursor = base64.urlsafe_b64encode(json.dumps(position).encode('ascii'))
+        response.headers["X-Next-Cursor"] = next_cursor.decode('ascii')
+    return documents
 
 
 # Email Account Routes
 @api_router.get("/email-accounts", response_model=List[EmailAccount])
-async def get_email_accounts():
-    accounts = await db.email_accounts.find({}, {"_id": 0}).to_list(1000)
+async def get_email_accounts(response: Response, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                             cursor: Optional[str] = None):
+    accounts = await find_page(db.email_accounts, response, limit, cursor)
     
     for account in accounts:
         if isinstance(account['created_at'], str):
@@ -148,12 +646,23 @@ async def delete_email_account(account_id: str):
 
 
 # Template Routes
-@api_router.get("/templates", response_model=List[EmailTemplate])
-async def get_templates():
-    templates = await db.email_templates.find({}, {"_id": 0}).to_list(1000)
+# fields (e.g. "name") limits each template to those fields plus id, so a list of names
+# doesn't carry every template body
+@api_router.get("/templates", response_model=List[EmailTemplateListItem], response_model_exclude_unset=True)
+async def get_templates(response: Response, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None, fields: Optional[str] = None):
+    projection = None
+    if fields:
+        requested = {field.strip() for field in fields.split(',') if field.strip()}
+        unknown = requested - set(EmailTemplate.model_fields)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown template fields: {', '.join(sorted(unknown))}")
+        projection = {field: 1 for field in requested | {'id'}}
+        projection["_id"] = 0
+    templates = await find_page(db.email_templates, response, limit, cursor, projection)
     
     for template in templates:
-        if isinstance(template['created_at'], str):
+        if isinstance(template.get('created_at'), str):
             template['created_at'] = datetime.fromisoformat(template['created_at'])
     
     return templates
@@ -177,11 +686,8 @@ async def delete_template(template_id: str):
     return {"message": "Template deleted successfully"}
 
 
-# PDF Extraction Route
-@api_router.post("/pdf/extract", response_model=List[PDFExtraction])
-async def extract_emails_from_pdfs(request: ExtractRequest):
-    folder_path = request.folder_path
-    
+# Utility function to validate a statement folder and list its PDFs
+async def list_pdf_folder(folder_path: str):
     # Normalize path for Windows
     folder_path = folder_path.replace('\\\\', '\\').strip('"').strip("'")
     
@@ -191,42 +697,166 @@ async def extract_emails_from_pdfs(request: ExtractRequest):
     if not os.path.isdir(folder_path):
         raise HTTPException(status_code=400, detail="Path is not a directory")
     
-    results = []
-    
     # Get all PDF files in the folder
     try:
-        pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
+        folder_entries = await blocking_executor.run(os.listdir, folder_path)
+        pdf_files = [f for f in folder_entries if f.lower().endswith('.pdf')]
     except PermissionError:
         raise HTTPException(status_code=403, detail="Permission denied to access folder")
     
     if not pdf_files:
         raise HTTPException(status_code=404, detail="No PDF files found in the specified folder")
     
+    return folder_path, pdf_files
+
+
+# Utility function to check a folder listing against the incremental index
+async def scan_pdf_folder(folder_path: str, pdf_files: List[str], page_budget: Optional[int], use_index: bool):
+    if folder_index is None or not use_index:
+        scan = FolderScan()
+        scan.to_parse = list(pdf_files)
+        return scan
+    return await blocking_executor.run(folder_index.scan, folder_path, pdf_files, mode_key(page_budget))
+
+# Utility function to store freshly parsed results in the incremental index
+async def record_pdf_folder(folder_path: str, page_budget: Optional[int], scan: FolderScan, parsed, use_index: bool):
+    if folder_index is None or not use_index:
+        return
+    # Timeouts and memory failures are retried on the next scan rather than remembered
+    parsed = [(pdf_file, extraction) for pdf_file, extraction in parsed if extraction.get('status', 'ok') == 'ok']
+    if parsed:
+        await blocking_executor.run(folder_index.record, folder_path, mode_key(page_budget), scan, parsed)
+
+
+# PDF Extraction Route
+@api_router.post("/pdf/extract", response_model=List[PDFExtraction])
+async def extract_emails_from_pdfs(request: ExtractRequest, response: Response):
+    folder_path, pdf_files = await list_pdf_folder(request.folder_path)
+    page_budget = (request.page_budget or DEFAULT_PAGE_BUDGET) if request.early_exit else None
+    
+    # Only files that are new or changed since the last scan need parsing
+    scan = await scan_pdf_folder(folder_path, pdf_files, page_budget, request.use_index)
+    
+    # Extract emails from those PDFs in parallel (results come back in input order)
+    extractions = await blocking_executor.run(
+        extraction_engine.extract_paths,
+        [os.path.join(folder_path, pdf_file) for pdf_file in scan.to_parse],
+        page_budget
+    )
+    parsed = dict(zip(scan.to_parse, extractions))
+    await record_pdf_folder(folder_path, page_budget, scan, list(parsed.items()), request.use_index)
+    
+    results = []
     for pdf_file in pdf_files:
-        file_path = os.path.join(folder_path, pdf_file)
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(file_path)
-        
-        # Extract emails from text
-        emails = extract_emails_from_text(text)
-        
+        extraction = parsed[pdf_file] if pdf_file in parsed else scan.reused[pdf_file]
         results.append(PDFExtraction(
             filename=pdf_file,
-            emails=emails,
-            file_path=file_path
+            file_path=os.path.join(folder_path, pdf_file),
+            **extraction
         ))
     
+    # Report how much work the index saved
+    counts = scan.summary()
+    response.headers["X-Files-Reused"] = str(counts['reused'])
+    response.headers["X-Files-Parsed"] = str(counts['parsed'])
+    response.headers["X-Files-Removed"] = str(counts['removed'])
+    
     return results
 
 
+# Streaming PDF Extraction Route (NDJSON, one line per file as soon as it is parsed)
+@api_router.post("/pdf/extract-stream")
+async def stream_emails_from_pdfs(request: ExtractRequest):
+    """
+    Same as /pdf/extract, but streams newline-delimited JSON instead of one big list:
+    a "start" line with the total, a "result" line per PDF (files reused from the
+    index first, then the rest in completion order, with progress counters), then a
+    "done" line. Nothing is accumulated server-side.
+    """
+    folder_path, pdf_files = await list_pdf_folder(request.folder_path)
+    page_budget = (request.page_budget or DEFAULT_PAGE_BUDGET) if request.early_exit else None
+    scan = await scan_pdf_folder(folder_path, pdf_files, page_budget, request.use_index)
+    counts = scan.summary()
+    total = len(pdf_files)
+    
+    async def generate():
+        started = time.monotonic()
+        yield json.dumps({"type": "start", "total": total, **counts}) + "\n"
+        
+        completed = 0
+        
+        def result_line(index, extraction):
+            result = PDFExtraction(
+                filename=pdf_files[index],
+                file_path=os.path.join(folder_path, pdf_files[index]),
+                **extraction
+            )
+            return json.dumps({
+                "type": "result",
+                "index": index,
+                "completed": completed,
+                "total": total,
+                "result": result.model_dump()
+            }) + "\n"
+        
+        for index, pdf_file in enumerate(pdf_files):
+            if pdf_file in scan.reused:
+                completed += 1
+                yield result_line(index, scan.reused[pdf_file])
+        
+        positions = {pdf_file: index for index, pdf_file in enumerate(pdf_files)}
+        parse_paths = [os.path.join(folder_path, pdf_file) for pdf_file in scan.to_parse]
+        unrecorded = []
+        try:
+            async for parse_index, extraction in extraction_engine.stream_paths(parse_paths, page_budget):
+                pdf_file = scan.to_parse[parse_index]
+                completed += 1
+                yield result_line(positions[pdf_file], extraction)
+                
+                # Write to the index in batches so memory stays bounded
+                unrecorded.append((pdf_file, extraction))
+                if len(unrecorded) >= 200:
+                    await record_pdf_folder(folder_path, page_budget, scan, unrecorded, request.use_index)
+                    unrecorded = []
+            await record_pdf_folder(folder_path, page_budget, scan, unrecorded, request.use_index)
+        except Exception as e:
+            logging.error(f"Error streaming extraction for {folder_path}: {e}")
+            yield json.dumps({"type": "error", "completed": completed, "total": total, "detail": str(e)}) + "\n"
+            return
+        
+        yield json.dumps({
+            "type": "done",
+            "completed": completed,
+            "total": total,
+            **counts,
+            "elapsed_seconds": round(time.monotonic() - started, 3)
+        }) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+# Extraction cache statistics
+@api_router.get("/pdf/cache-stats")
+async def get_extraction_cache_stats():
+    cache = get_extraction_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = await blocking_executor.run(cache.stats)
+    return {"enabled": True, **stats}
+
+
 # PDF Upload and Extract Route
 @api_router.post("/pdf/upload-extract", response_model=List[PDFExtraction])
-async def upload_and_extract_emails(files: List[UploadFile] = File(...)):
+async def upload_and_extract_emails(
+    files: List[UploadFile] = File(...),
+    early_exit: bool = Form(False),
+    page_budget: Optional[int] = Form(None, ge=1)
+):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
     
     results = []
+    sessions = []
     
     for file in files:
         if not file.filename.lower().endswith('.pdf'):
@@ -235,21 +865,25 @@ async def upload_and_extract_emails(files: List[UploadFile] = File(...)):
         # Read file content
         content = await file.read()
         
-        # Extract text from PDF
-        text = extract_text_from_pdf_file(content)
-        
-        # Extract emails from text
-        emails = extract_emails_from_text(text)
-        
-        # Save temporarily for later use
-        temp_path = f"/tmp/{uuid.uuid4().hex}_{file.filename}"
-        with open(temp_path, 'wb') as f:
-            f.write(content)
-        
+        # Keep it in an upload session so drafts can refer to it by ID
+        session = await blocking_executor.run(upload_sessions.create, file.filename, content)
+        sessions.append((file.filename, session))
+    
+    # Extract emails from the saved copies in parallel (results come back in input order)
+    extractions = await blocking_executor.run(
+        extraction_engine.extract_paths,
+        [session.path for _, session in sessions],
+        (page_budget or DEFAULT_PAGE_BUDGET) if early_exit else None
+    )
+    
+    for (filename, session), extraction in zip(sessions, extractions):
+        # The session hashed the upload already, even if its worker then failed
+        extraction['content_hash'] = session.content_hash
         results.append(PDFExtraction(
-            filename=file.filename,
-            emails=emails,
-            file_path=temp_path
+            filename=filename,
+            file_path=session.path,
+            upload_id=session.upload_id,
+            **extraction
         ))
     
     if not results:
@@ -261,48 +895,38 @@ async def upload_and_extract_emails(files: List[UploadFile] = File(...)):
 # Outlook Draft Generation Route
 @api_router.post("/outlook/draft")
 async def create_outlook_draft(request: DraftEmailRequest):
+    output_dir = get_draft_output_dir(request.output)
     try:
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['To'] = request.recipient_email
-        msg['Subject'] = request.subject
-        
-        # Add From field if sender email provided
-        if request.sender_email:
-            if request.sender_name:
-                msg['From'] = f'"{request.sender_name}" <{request.sender_email}>'
-            else:
-                msg['From'] = request.sender_email
-        
-        # Add draft-specific headers for Outlook
-        msg['X-Unsent'] = '1'
-        msg['X-UnsentDraft'] = '1'
-        
-        # Add body as HTML
-        msg.attach(MIMEText(request.body, 'html'))
-        
-        # Attach PDF file
-        if os.path.exists(request.pdf_path):
-            with open(request.pdf_path, 'rb') as attachment:
-                part = MIMEBase('application', 'pdf')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename={request.pdf_filename}'
-                )
-                msg.attach(part)
-        else:
+        # Check the PDF exists (it is streamed into the draft, not read into memory)
+        if not os.path.exists(request.pdf_path):
             raise HTTPException(status_code=404, detail=f"PDF file not found: {request.pdf_path}")
         
+        if output_dir:
+            draft_template = DraftTemplate(request.subject, request.body, request.sender_email, request.sender_name)
+            written = await blocking_executor.run(
+                write_draft_to_directory,
+                draft_template,
+                output_dir,
+                request.recipient_email,
+                request.pdf_path,
+                request.pdf_filename
+            )
+            return JSONResponse({"success": True, "output": "directory", "files": [written]})
+        
         # Save as .eml file
         eml_filename = f"draft_{uuid.uuid4().hex[:8]}_{request.pdf_filename.replace('.pdf', '')}.eml"
-        eml_path = os.path.join('/tmp', eml_filename)
+        eml_path = artifact_store.path_for(eml_filename)
         
-        with open(eml_path, 'w', encoding='utf-8') as eml_file:
-            eml_file.write(msg.as_string())
+        draft_template = DraftTemplate(request.subject, request.body, request.sender_email, request.sender_name)
+        await blocking_executor.run(
+            draft_template.write_path,
+            eml_path,
+            request.recipient_email,
+            request.pdf_path,
+            request.pdf_filename
+        )
         
-        # Return file for download
+        # Return file for download; it is only needed until it has been sent
         return FileResponse(
             eml_path,
             media_type='message/rfc822',
@@ -310,7 +934,8 @@ async def create_outlook_draft(request: DraftEmailRequest):
             headers={
                 "Content-Disposition": f"attachment; filename={eml_filename}",
                 "Content-Type": "message/rfc822"
-            }
+            },
+            background=BackgroundTask(os.remove, eml_path)
         )
         
     except Exception as e:
@@ -321,52 +946,53 @@ async def create_outlook_draft(request: DraftEmailRequest):
 # Outlook Draft Generation from Upload Route
 @api_router.post("/outlook/draft-upload")
 async def create_outlook_draft_from_upload(
-    pdf_file: UploadFile = File(...),
+    pdf_file: Optional[UploadFile] = File(None),
+    upload_id: str = Form(None),
     recipient_email: str = Form(...),
     subject: str = Form(...),
     body: str = Form(...),
     sender_email: str = Form(None),
-    sender_name: str = Form(None)
+    sender_name: str = Form(None),
+    output: str = Form("download")  # or "directory" to write into DRAFT_OUTPUT_DIR
 ):
+    # Take the PDF from an earlier upload session, or from this request
+    if upload_id:
+        session = get_upload_session(upload_id)
+        pdf_filename, pdf_source = session.filename, session.path
+    elif pdf_file is not None:
+        pdf_filename, pdf_source = pdf_file.filename, pdf_file.file
+    else:
+        raise HTTPException(status_code=400, detail="Provide pdf_file or upload_id")
+    output_dir = get_draft_output_dir(output)
+    
     try:
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        
-        # Add From field if sender email provided
-        if sender_email:
-            if sender_name:
-                msg['From'] = f'"{sender_name}" <{sender_email}>'
-            else:
-                msg['From'] = sender_email
-        
-        # Add draft-specific headers for Outlook
-        msg['X-Unsent'] = '1'
-        msg['X-UnsentDraft'] = '1'
-        
-        # Add body as HTML
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Read and attach PDF file
-        pdf_content = await pdf_file.read()
-        part = MIMEBase('application', 'pdf')
-        part.set_payload(pdf_content)
-        encoders.encode_base64(part)
-        part.add_header(
-            'Content-Disposition',
-            f'attachment; filename={pdf_file.filename}'
-        )
-        msg.attach(part)
+        if output_dir:
+            draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+            written = await blocking_executor.run(
+                write_draft_to_directory,
+                draft_template,
+                output_dir,
+                recipient_email,
+                pdf_source,
+                pdf_filename
+            )
+            return JSONResponse({"success": True, "output": "directory", "files": [written]})
         
         # Save as .eml file
-        eml_filename = f"draft_{uuid.uuid4().hex[:8]}_{pdf_file.filename.replace('.pdf', '')}.eml"
-        eml_path = os.path.join('/tmp', eml_filename)
+        eml_filename = f"draft_{uuid.uuid4().hex[:8]}_{pdf_filename.replace('.pdf', '')}.eml"
+        eml_path = artifact_store.path_for(eml_filename)
         
-        with open(eml_path, 'w', encoding='utf-8') as eml_file:
-            eml_file.write(msg.as_string())
+        draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+        await blocking_executor.run(
+            write_draft,
+            draft_template,
+            eml_path,
+            recipient_email,
+            pdf_source,
+            pdf_filename
+        )
         
-        # Return file for download
+        # Return file for download; it is only needed until it has been sent
         return FileResponse(
             eml_path,
             media_type='message/rfc822',
@@ -374,7 +1000,8 @@ async def create_outlook_draft_from_upload(
             headers={
                 "Content-Disposition": f"attachment; filename={eml_filename}",
                 "Content-Type": "message/rfc822"
-            }
+            },
+            background=BackgroundTask(os.remove, eml_path)
         )
         
     except Exception as e:
@@ -385,48 +1012,56 @@ async def create_outlook_draft_from_upload(
 # NEW: Create draft and return download URL (for Chrome compatibility)
 @api_router.post("/outlook/draft-create")
 async def create_outlook_draft_with_url(
-    pdf_file: UploadFile = File(...),
+    pdf_file: Optional[UploadFile] = File(None),
+    upload_id: str = Form(None),
     recipient_email: str = Form(...),
     subject: str = Form(...),
     body: str = Form(...),
     sender_email: str = Form(None),
-    sender_name: str = Form(None)
+    sender_name: str = Form(None),
+    output: str = Form("download")  # or "directory" to write into DRAFT_OUTPUT_DIR
 ):
     """Create draft and return a download URL instead of direct file response"""
+    # Take the PDF from an earlier upload session, or from this request
+    if upload_id:
+        session = get_upload_session(upload_id)
+        pdf_filename, pdf_source = session.filename, session.path
+    elif pdf_file is not None:
+        pdf_filename, pdf_source = pdf_file.filename, pdf_file.file
+    else:
+        raise HTTPException(status_code=400, detail="Provide pdf_file or upload_id")
+    output_dir = get_draft_output_dir(output)
+    
     try:
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        
-        if sender_email:
-            if sender_name:
-                msg['From'] = f'"{sender_name}" <{sender_email}>'
-            else:
-                msg['From'] = sender_email
-        
-        msg['X-Unsent'] = '1'
-        msg['X-UnsentDraft'] = '1'
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Read and attach PDF file
-        pdf_content = await pdf_file.read()
-        part = MIMEBase('application', 'pdf')
-        part.set_payload(pdf_content)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f'attachment; filename={pdf_file.filename}')
-        msg.attach(part)
+        if output_dir:
+            draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+            written = await blocking_executor.run(
+                write_draft_to_directory,
+                draft_template,
+                output_dir,
+                recipient_email,
+                pdf_source,
+                pdf_filename
+            )
+            return JSONResponse({"success": True, "output": "directory", "files": [written]})
         
         # Generate unique file ID and save
         file_id = uuid.uuid4().hex
-        eml_filename = f"draft_{file_id[:8]}_{pdf_file.filename.replace('.pdf', '')}.eml"
-        eml_path = os.path.join('/tmp', eml_filename)
+        eml_filename = f"draft_{file_id[:8]}_{pdf_filename.replace('.pdf', '')}.eml"
+        eml_path = artifact_store.path_for(eml_filename)
         
-        with open(eml_path, 'w', encoding='utf-8') as eml_file:
-            eml_file.write(msg.as_string())
+        draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+        await blocking_executor.run(
+            write_draft,
+            draft_template,
+            eml_path,
+            recipient_email,
+            pdf_source,
+            pdf_filename
+        )
         
-        # Store file path for later download
-        generated_files[file_id] = eml_path
+        # Store file for later download
+        artifact_store.add(file_id, eml_path)
         
         return JSONResponse({
             "success": True,
@@ -441,22 +1076,18 @@ async def create_outlook_draft_with_url(
 
 
 # NEW: Direct file download endpoint (GET request - works in all browsers)
-@api_router.get("/download/{file_id}")
+@api_router.api_route("/download/{file_id}", methods=["GET", "HEAD"])
 async def download_file(file_id: str):
-    """Download a generated file by ID - uses GET which works reliably in all browsers"""
-    if file_id not in generated_files:
+    """Download a generated file by ID - uses GET which works reliably in all browsers.
+    Supports Range/If-Range, so browsers and download managers can resume large ZIPs"""
+    artifact = artifact_store.get(file_id)
+    if artifact is None:
         raise HTTPException(status_code=404, detail="File not found or expired")
     
-    file_path = generated_files[file_id]
-    
-    if not os.path.exists(file_path):
-        del generated_files[file_id]
-        raise HTTPException(status_code=404, detail="File not found")
+    filename = artifact.filename
     
-    filename = os.path.basename(file_path)
-    
-    return FileResponse(
-        file_path,
+    return RangeFileResponse(
+        artifact.path,
         media_type='application/octet-stream',
         filename=filename,
         headers={
@@ -466,18 +1097,24 @@ async def download_file(file_id: str):
     )
 
 
+# Disk use and eviction counters of the generated-file store
+@api_router.get("/artifacts/stats")
+async def get_artifact_stats():
+    return artifact_store.stats()
+
+
 # NEW: Create report file and return download URL
 @api_router.post("/report/create")
 async def create_report(report_content: str = Form(...), filename: str = Form(...)):
     """Create a report file and return download URL"""
     try:
         file_id = uuid.uuid4().hex
-        report_path = os.path.join('/tmp', f"{file_id}_{filename}")
+        report_path = artifact_store.path_for(f"{file_id}_{filename}")
         
         with open(report_path, 'w', encoding='utf-8') as f:
             f.write(report_content)
         
-        generated_files[file_id] = report_path
+        artifact_store.add(file_id, report_path, filename=os.path.basename(filename))
         
         return JSONResponse({
             "success": True,
@@ -491,137 +1128,142 @@ async def create_report(report_content: str = Form(...), filename: str = Form(..
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Request model for batch processing
-class BatchDraftItem(BaseModel):
-    pdf_filename: str
-    recipient_email: str
-
-class BatchDraftRequest(BaseModel):
-    items: List[BatchDraftItem]
-    subject: str
-    body: str
-    sender_email: Optional[str] = None
-    sender_name: Optional[str] = None
-
-
 # NEW: Batch process multiple PDFs and return a single ZIP file
 @api_router.post("/outlook/batch-create")
 async def create_batch_drafts(
-    pdf_files: List[UploadFile] = File(...),
-    recipients: str = Form(...),  # JSON string of [{filename, email}]
+    pdf_files: List[UploadFile] = File(None),
+    recipients: str = Form(...),  # JSON string of [{filename, email, upload_id?}]
     subject: str = Form(...),
     body: str = Form(...),
     sender_email: str = Form(None),
-    sender_name: str = Form(None)
+    sender_name: str = Form(None),
+    stream: bool = Form(False),
+    output: str = Form("download"),  # or "directory" to write into DRAFT_OUTPUT_DIR
+    export_format: str = Form("eml", alias="format")  # or "mbox" for mbox shards plus an index
 ):
     """
     Process multiple PDFs and return a single ZIP file containing all drafts and a report.
     This avoids opening multiple browser tabs.
+    PDFs can be uploaded with the request, or referenced by the upload_id from /pdf/upload-extract.
+    With stream=true the ZIP is sent in the response as the drafts are generated (report last)
+    instead of being staged under /tmp for /api/download; the summary is then only in the report.
+    With output=directory each draft is written straight into DRAFT_OUTPUT_DIR and the response
+    lists their paths and sizes; no ZIP or report is built.
+    With format=mbox the drafts are appended to mbox shards (rolling over at MBOX_SHARD_MAX_BYTES)
+    with an index of each PDF's shard and byte offset, instead of one .eml file each.
     """
-    import json
-    
+    output_dir = get_draft_output_dir(output)
+    if check_export_format(export_format) == "mbox" and stream:
+        raise HTTPException(status_code=400, detail="stream=true only supports format=eml")
     try:
         recipient_map = json.loads(recipients)  # [{filename: "x.pdf", email: "a@b.com"}, ...]
         
+        # Headers and body are the same for every draft, so render them once
+        draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+        
+        if output_dir and export_format == "mbox":
+            items = resolve_batch_items(recipient_map, pdf_files)
+            basename = f"speedy_statements_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+            successful, failed, shards, index_path = await blocking_executor.run(
+                write_batch_mbox, draft_template, output_dir, basename, items
+            )
+            return JSONResponse({
+                "success": True,
+                "output": "directory",
+                "format": "mbox",
+                "shards": shards,
+                "index": {"path": index_path, "size": os.path.getsize(index_path)},
+                "summary": {
+                    "total": len(successful) + len(failed),
+                    "successful": len(successful),
+                    "failed": len(failed)
+                },
+                "successful": successful,
+                "failed": failed
+            })
+        
+        if output_dir:
+            items = resolve_batch_items(recipient_map, pdf_files)
+            successful, failed = await write_batch_to_directory(draft_template, output_dir, items)
+            return JSONResponse({
+                "success": True,
+                "output": "directory",
+                "summary": {
+                    "total": len(successful) + len(failed),
+                    "successful": len(successful),
+                    "failed": len(failed)
+                },
+                "successful": successful,
+                "failed": failed
+            })
+        
+        if stream:
+            items = resolve_batch_items(recipient_map, pdf_files, detach_uploads=True)
+            writer = ZipStreamWriter(asyncio.get_running_loop())
+            blocking_executor.submit(write_batch_zip_stream, writer, draft_template, items)
+            zip_filename = f"speedy_statements_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+            return StreamingResponse(
+                writer.iter_chunks(),
+                media_type='application/zip',
+                headers={"Content-Disposition": f"attachment; filename=\"{zip_filename}\""}
+            )
+        
         # Create a temporary directory for this batch
         batch_id = uuid.uuid4().hex
-        batch_dir = os.path.join('/tmp', f"batch_{batch_id}")
+        batch_dir = artifact_store.path_for(f"batch_{batch_id}")
         os.makedirs(batch_dir, exist_ok=True)
         
         successful = []
         failed = []
         
-        # Process each PDF
-        for pdf_file in pdf_files:
-            # Find the recipient for this file
-            recipient_info = next(
-                (r for r in recipient_map if r['filename'] == pdf_file.filename),
-                None
+        if export_format == "mbox":
+            # One pass appends every draft to the shards in the batch directory; report and ZIP as usual
+            basename = f"speedy_statements_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{batch_id[:8]}"
+            successful, failed, _, _ = await blocking_executor.run(
+                write_batch_mbox, draft_template, batch_dir, basename, resolve_batch_items(recipient_map, pdf_files)
             )
+        else:
+            # Process each PDF
+            for item in resolve_batch_items(recipient_map, pdf_files):
+                pdf_filename = item["filename"]
+                if item["reason"]:
+                    failed.append({
+                        "filename": pdf_filename,
+                        "reason": item["reason"]
+                    })
+                    continue
             
-            if not recipient_info:
-                failed.append({
-                    "filename": pdf_file.filename,
-                    "reason": "No recipient email found for this file"
-                })
-                continue
-            
-            recipient_email = recipient_info['email']
+                recipient_email = item["recipient"]
             
-            try:
-                # Create the email message
-                msg = MIMEMultipart()
-                msg['To'] = recipient_email
-                msg['Subject'] = subject
-                
-                if sender_email:
-                    if sender_name:
-                        msg['From'] = f'"{sender_name}" <{sender_email}>'
-                    else:
-                        msg['From'] = sender_email
-                
-                msg['X-Unsent'] = '1'
-                msg['X-UnsentDraft'] = '1'
-                msg.attach(MIMEText(body, 'html'))
-                
-                # Read and attach PDF file
-                pdf_content = await pdf_file.read()
-                await pdf_file.seek(0)  # Reset for potential re-read
+                try:
+                    # Save .eml file
+                    eml_filename = f"draft_{pdf_filename.replace('.pdf', '')}.eml"
+                    eml_path = os.path.join(batch_dir, eml_filename)
                 
-                part = MIMEBase('application', 'pdf')
-                part.set_payload(pdf_content)
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename={pdf_file.filename}')
-                msg.attach(part)
+                    await blocking_executor.run(
+                        write_draft,
+                        draft_template,
+                        eml_path,
+                        recipient_email,
+                        item["source"],
+                        pdf_filename
+                    )
                 
-                # Save .eml file
-                eml_filename = f"draft_{pdf_file.filename.replace('.pdf', '')}.eml"
-                eml_path = os.path.join(batch_dir, eml_filename)
+                    successful.append({
+                        "filename": pdf_filename,
+                        "recipient": recipient_email,
+                        "output": eml_filename
+                    })
                 
-                with open(eml_path, 'w', encoding='utf-8') as eml_file:
-                    eml_file.write(msg.as_string())
-                
-                successful.append({
-                    "filename": pdf_file.filename,
-                    "recipient": recipient_email,
-                    "output": eml_filename
-                })
-                
-            except Exception as e:
-                failed.append({
-                    "filename": pdf_file.filename,
-                    "reason": str(e)
-                })
+                except Exception as e:
+                    failed.append({
+                        "filename": pdf_filename,
+                        "reason": str(e)
+                    })
         
-        # Generate the report
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        report_content = "SPEEDY STATEMENTS - GENERATION REPORT\n"
-        report_content += f"Generated: {timestamp}\n"
-        report_content += f"{'=' * 50}\n\n"
         
-        report_content += "SUMMARY\n"
-        report_content += f"{'-' * 30}\n"
-        report_content += f"Total Processed: {len(successful) + len(failed)}\n"
-        report_content += f"Successful: {len(successful)}\n"
-        report_content += f"Failed: {len(failed)}\n\n"
-        
-        if successful:
-            report_content += "SUCCESSFULLY GENERATED\n"
-            report_content += f"{'-' * 30}\n"
-            for i, item in enumerate(successful, 1):
-                report_content += f"{i}. {item['filename']}\n"
-                report_content += f"   Recipient: {item['recipient']}\n"
-                report_content += f"   Output: {item['output']}\n\n"
-        
-        if failed:
-            report_content += "FAILED TO GENERATE\n"
-            report_content += f"{'-' * 30}\n"
-            for i, item in enumerate(failed, 1):
-                report_content += f"{i}. {item['filename']}\n"
-                report_content += f"   Reason: {item['reason']}\n\n"
-        
-        report_content += f"{'=' * 50}\n"
-        report_content += "End of Report\n"
+        # Generate the report
+        report_content = build_batch_report(successful, failed)
         
         # Save report to batch directory
         report_filename = f"statement_report_{datetime.now().strftime('%Y-%m-%d')}.txt"
@@ -631,21 +1273,13 @@ async def create_batch_drafts(
         
         # Create ZIP file
         zip_filename = f"speedy_statements_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        zip_path = os.path.join('/tmp', zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(batch_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = file  # Just the filename, no directory structure
-                    zipf.write(file_path, arcname)
+        zip_path = artifact_store.path_for(f"{batch_id}_{zip_filename}")
         
-        # Clean up batch directory
-        import shutil
-        shutil.rmtree(batch_dir, ignore_errors=True)
+        # Compress and clean up the batch directory off the event loop
+        await blocking_executor.run(zip_batch_directory, batch_dir, zip_path)
         
         # Store ZIP for download via GET endpoint
-        generated_files[batch_id] = zip_path
+        artifact_store.add(batch_id, zip_path, filename=zip_filename)
         
         return JSONResponse({
             "success": True,
@@ -666,6 +1300,79 @@ async def create_batch_drafts(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Submit a batch as a background job; poll its status and download the ZIP when done
+@api_router.post("/outlook/batch-jobs")
+async def submit_batch_job(
+    pdf_files: List[UploadFile] = File(None),
+    recipients: str = Form(...),  # JSON string of [{filename, email, upload_id?}]
+    subject: str = Form(...),
+    body: str = Form(...),
+    sender_email: str = Form(None),
+    sender_name: str = Form(None),
+    output: str = Form("download"),  # or "directory" to write into DRAFT_OUTPUT_DIR
+    export_format: str = Form("eml", alias="format")  # or "mbox" for mbox shards plus an index
+):
+    """
+    Same input as /outlook/batch-create, but returns a job ID straight away.
+    The drafts are generated in the background; the finished ZIP downloads from /api/download/{job_id}.
+    Progress is checkpointed under BATCH_JOB_DIR, so a restarted server resumes the job.
+    With output=directory the drafts go into DRAFT_OUTPUT_DIR instead of a ZIP.
+    With format=mbox the finished drafts are appended to mbox shards with an index.
+    """
+    output_dir = get_draft_output_dir(output)
+    check_export_format(export_format)
+    try:
+        recipient_map = json.loads(recipients)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid recipients JSON: {e}")
+    
+    items = resolve_batch_items(recipient_map, pdf_files)
+    
+    # Keep the PDFs with the job's checkpoint, so the job can resume after a restart
+    job_id = uuid.uuid4().hex
+    job_dir, _, inputs_dir = batch_job_dirs(job_id)
+    try:
+        await blocking_executor.run(stage_batch_job_inputs, inputs_dir, items)
+    except OSError as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        logging.error(f"Error staging batch job inputs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return await start_batch_job(items, subject, body, sender_email, sender_name, output_dir, export_format, job_id)
+
+
+# Folder-path mode: one job for every selected PDF instead of one /outlook/draft request each
+@api_router.post("/outlook/batch-jobs/paths")
+async def submit_batch_job_from_paths(request: BatchDraftRequest):
+    """
+    Same as /outlook/batch-jobs, for PDFs already on the server's disk (file_path values from /pdf/extract).
+    The PDFs are read server-side, BATCH_JOB_WORKERS at a time; files that don't exist are reported as failed.
+    """
+    output_dir = get_draft_output_dir(request.output)
+    check_export_format(request.format)
+    items = await blocking_executor.run(resolve_batch_path_items, request.items)
+    return await start_batch_job(items, request.subject, request.body, request.sender_email, request.sender_name,
+                                 output_dir, request.format)
+
+
+@api_router.get("/outlook/batch-jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Progress (done/failed/remaining, throughput, ETA) and, once completed, the download URL"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.status()
+
+
+@api_router.post("/outlook/batch-jobs/{job_id}/cancel")
+async def cancel_batch_job(job_id: str):
+    """Skip the items that have not started; the job ends as 'cancelled' without a ZIP"""
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.status()
+
+
 @api_router.get("/")
 async def root():
     return {"message": "Speedy Statements API"}
@@ -680,6 +1387,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Files-Reused", "X-Files-Parsed", "X-Files-Removed", "X-Next-Cursor"],
 )
 
 # Configure logging
@@ -689,7 +1397,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def resume_batch_jobs():
+    # Carry on with batch jobs a previous run left unfinished, from their last checkpoint
+    resumed = batch_jobs.resume(batch_job_callbacks)
+    if resumed:
+        logger.info(f"Resumed {len(resumed)} unfinished batch job(s)")
+
+    # ZIPs of jobs that finished before the restart stay downloadable
+    for job in batch_jobs.jobs():
+        if job.state == 'completed' and job.artifact:
+            zip_path = os.path.join(batch_jobs.directory, job.artifact["filename"])
+            if os.path.exists(zip_path):
+                register_batch_job_zip(job, zip_path)
+
+    artifact_store.start_janitor()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    # No cleanup needed for JSON storage
-    pass
\ No newline at end of file
+    # No cleanup needed for JSON storage; stop the worker pools
+    extraction_engine.shutdown()
+    batch_jobs.shutdown()
+    artifact_store.stop_janitor()
+    blocking_executor.shutdown()
\ No newline at end of file
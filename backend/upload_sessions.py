@@ -0,0 +1,185 @@
+"""
+Upload sessions for Speedy Statements
+Keeps each uploaded PDF on disk under an ID for a limited time, so draft and batch
+requests can refer to it instead of uploading the same bytes again. Sessions are kept in
+an SQLite database next to the files, so any API worker process can resolve an upload ID
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from extraction_cache import hash_bytes
+
+
+# Default lifetime of an upload session (1 hour)
+DEFAULT_TTL = 60 * 60
+
+
+class UploadSession:
+    """One uploaded PDF"""
+
+    def __init__(self, upload_id: str, filename: str, path: str, content_hash: str,
+                 size: int, expires_at: float):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+        self.expires_at = expires_at
+
+
+_COLUMNS = 'upload_id, filename, path, content_hash, size, expires_at'
+
+
+class UploadSessionStore:
+    """Uploaded PDFs by ID, with a TTL, shared by all worker processes. Identical content is stored once"""
+
+    def __init__(self, directory: str, ttl: float = DEFAULT_TTL):
+        """
+        Initialize the store
+
+        Args:
+            directory: Folder the uploaded PDFs are written to
+            ttl: Seconds a session stays valid after its last use
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.db_path = os.path.join(directory, 'sessions.db')
+        self._lock = threading.Lock()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+        # Shared by several worker processes, so use WAL and wait on locks
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    upload_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_path ON sessions (path)')
+
+    @classmethod
+    def from_environment(cls) -> 'UploadSessionStore':
+        """
+        Build the store from UPLOAD_SESSION_DIR and UPLOAD_SESSION_TTL (seconds)
+        """
+        directory = os.environ.get('UPLOAD_SESSION_DIR') or os.path.join(
+            tempfile.gettempdir(), 'speedystatements_uploads'
+        )
+        try:
+            ttl = float(os.environ.get('UPLOAD_SESSION_TTL', DEFAULT_TTL))
+        except ValueError:
+            logging.warning(f"Ignoring invalid UPLOAD_SESSION_TTL value: {os.environ['UPLOAD_SESSION_TTL']}")
+            ttl = DEFAULT_TTL
+        return cls(directory, ttl)
+
+    def create(self, filename: str, content: bytes, ttl: Optional[float] = None) -> UploadSession:
+        """
+        Save an uploaded PDF and open a session for it
+
+        Args:
+            filename: Original filename from the upload
+            content: PDF bytes
+            ttl: Lifetime in seconds, if it should differ from the store's default
+
+        Returns:
+            The new session
+        """
+        self.purge_expired()
+        content_hash = hash_bytes(content)
+        path = os.path.join(self.directory, f"{content_hash}.pdf")
+
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            filename=os.path.basename(filename),
+            path=path,
+            content_hash=content_hash,
+            size=len(content),
+            expires_at=time.time() + (ttl or self.ttl)
+        )
+        with self._lock, self._conn:
+            # Holding the write lock keeps purge_expired() in another worker from deleting the file now
+            self._conn.execute('BEGIN IMMEDIATE')
+            if not os.path.exists(path):
+                # Write to a temporary name first so a reader never sees a partial file
+                temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(temp_path, path)
+            self._insert(session)
+        return session
+
+    def _insert(self, session: UploadSession) -> None:
+        self._conn.execute(
+            f'INSERT INTO sessions ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+            (session.upload_id, session.filename, session.path, session.content_hash,
+             session.size, session.expires_at)
+        )
+
+    def get(self, upload_id: str, ttl: Optional[float] = None) -> Optional[UploadSession]:
+        """
+        Look up a session and extend its lifetime
+
+        Args:
+            upload_id: ID returned by create()
+            ttl: Keep the session for at least this many seconds (default: the store's TTL)
+
+        Returns:
+            The session, or None if it is unknown, expired or its file is gone
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f'SELECT {_COLUMNS} FROM sessions WHERE upload_id = ?', (upload_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            session = UploadSession(*row)
+            if session.expires_at < time.time():
+                # Left for purge_expired(), which also deletes the file once no live session uses it
+                return None
+            if not os.path.exists(session.path):
+                self._conn.execute('DELETE FROM sessions WHERE upload_id = ?', (upload_id,))
+                return None
+            session.expires_at = max(session.expires_at, time.time() + (ttl or self.ttl))
+            self._conn.execute(
+                'UPDATE sessions SET expires_at = ? WHERE upload_id = ?', (session.expires_at, upload_id)
+            )
+            return session
+
+    def purge_expired(self) -> int:
+        """
+        Drop expired sessions and delete files no live session refers to
+
+        Returns:
+            Number of sessions dropped
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            expired = self._conn.execute(
+                'SELECT upload_id, path FROM sessions WHERE expires_at < ?', (now,)
+            ).fetchall()
+            if not expired:
+                return 0
+            self._conn.execute('DELETE FROM sessions WHERE expires_at < ?', (now,))
+            # Files are shared by content, so only delete those no live session refers to
+            for path in {path for _, path in expired}:
+                if self._conn.execute('SELECT 1 FROM sessions WHERE path = ? LIMIT 1', (path,)).fetchone():
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return len(expired)
@@ -0,0 +1,257 @@
+"""
+Supervised worker processes for Speedy Statements
+Runs each task in a worker process with a wall-clock timeout and a memory cap;
+workers that hang, run out of memory or crash are killed and replaced
+"""
+import collections
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection
+from typing import Any, Callable, Deque, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class TaskTimeout(Exception):
+    """The task ran longer than the pool's timeout and its worker was killed"""
+
+
+class TaskMemoryExceeded(Exception):
+    """The task went over the worker memory limit"""
+
+
+class WorkerCrashed(Exception):
+    """The worker process died while running the task"""
+
+
+def _limit_memory(memory_limit: Optional[int]) -> None:
+    """Cap this process's address space (Unix only; a no-op on Windows)"""
+    if not memory_limit or resource is None:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    except (ValueError, OSError) as e:
+        logging.warning(f"Could not set worker memory limit: {e}")
+
+
+def _worker_main(conn, memory_limit: Optional[int]) -> None:
+    """Worker process loop: receive (task_id, func, args), send back (task_id, status, payload)"""
+    _limit_memory(memory_limit)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+
+        task_id, func, args = task
+        try:
+            conn.send((task_id, 'ok', func(*args)))
+        except MemoryError:
+            conn.send((task_id, 'memory', None))
+        except Exception as e:
+            conn.send((task_id, 'error', repr(e)))
+
+
+class _Worker:
+    """Parent-side handle on one worker process"""
+
+    def __init__(self, context, memory_limit: Optional[int]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[Tuple[int, Future]] = None
+        self.deadline: Optional[float] = None
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+
+class SupervisedPool:
+    """Process pool where every task gets a timeout and a memory cap"""
+
+    def __init__(self, max_workers: int, task_timeout: Optional[float] = None,
+                 memory_limit: Optional[int] = None):
+        """
+        Initialize the pool (workers start on first use)
+
+        Args:
+            max_workers: Number of worker processes
+            task_timeout: Seconds a single task may run before its worker is killed. None means no limit
+            memory_limit: Address-space cap per worker in bytes (Unix only). None means no limit
+        """
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self.memory_limit = memory_limit
+        self.restarts = 0
+
+        # Spawn behaves the same on Windows, macOS and Linux and avoids
+        # forking a process that is already running server threads
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._queue: Deque[Tuple[int, Future, Callable, tuple]] = collections.deque()
+        self._task_ids = itertools.count()
+        self._workers: list = []
+        self._shutdown = False
+        self._wakeup_pending = False
+        self._wakeup_r, self._wakeup_w = self._context.Pipe(duplex=False)
+        self._supervisor: Optional[threading.Thread] = None
+
+    def submit(self, func: Callable[..., Any], *args) -> Future:
+        """
+        Queue a task
+
+        Args:
+            func: Picklable function to run in a worker
+            *args: Picklable arguments
+
+        Returns:
+            Future for the result. It fails with TaskTimeout, TaskMemoryExceeded or
+            WorkerCrashed if the worker had to be killed or died
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Pool has been shut down')
+            self._queue.append((next(self._task_ids), future, func, args))
+            if self._supervisor is None:
+                self._supervisor = threading.Thread(target=self._supervise, name='pool-supervisor', daemon=True)
+                self._supervisor.start()
+            notify = not self._wakeup_pending
+            self._wakeup_pending = True
+        if notify:
+            self._wakeup_w.send_bytes(b'x')
+        return future
+
+    def _assign_tasks(self) -> None:
+        """Hand queued tasks to idle workers, starting workers as needed"""
+        with self._lock:
+            while self._queue:
+                idle = next((w for w in self._workers if w.task is None), None)
+                if idle is None:
+                    if len(self._workers) >= self.max_workers:
+                        return
+                    idle = _Worker(self._context, self.memory_limit)
+                    self._workers.append(idle)
+
+                task_id, future, func, args = self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    idle.conn.send((task_id, func, args))
+                except (OSError, ValueError):
+                    # Worker died while idle: replace it and retry the task
+                    self._replace(idle)
+                    self._queue.appendleft((task_id, future, func, args))
+                    continue
+                idle.task = (task_id, future)
+                idle.deadline = time.monotonic() + self.task_timeout if self.task_timeout else None
+
+    def _replace(self, worker: _Worker) -> None:
+        """Kill a worker and drop it; a fresh one is started when there is work"""
+        worker.kill()
+        self._workers.remove(worker)
+        self.restarts += 1
+
+    def _crashed(self, worker: _Worker) -> WorkerCrashed:
+        worker.process.join(timeout=1)
+        return WorkerCrashed(f'Worker exited with code {worker.process.exitcode}')
+
+    def _fail(self, worker: _Worker, error: Exception) -> None:
+        _, future = worker.task
+        worker.task = None
+        future.set_exception(error)
+        with self._lock:
+            self._replace(worker)
+
+    def _supervise(self) -> None:
+        """Supervisor thread: dispatch tasks, collect results, enforce timeouts"""
+        while True:
+            self._assign_tasks()
+            with self._lock:
+                if self._shutdown:
+                    break
+                busy = [w for w in self._workers if w.task is not None]
+
+            deadlines = [w.deadline for w in busy if w.deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            waitables = [self._wakeup_r] + [w.conn for w in busy] + [w.process.sentinel for w in busy]
+            ready = connection.wait(waitables, timeout)
+
+            if self._wakeup_r in ready:
+                with self._lock:
+                    while self._wakeup_r.poll():
+                        self._wakeup_r.recv_bytes()
+                    self._wakeup_pending = False
+
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        task_id, status, payload = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self._fail(worker, self._crashed(worker))
+                        continue
+                    _, future = worker.task
+                    if status == 'ok':
+                        worker.task = None
+                        worker.deadline = None
+                        future.set_result(payload)
+                    elif status == 'memory':
+                        # The worker may be left in a bad state, so replace it
+                        self._fail(worker, TaskMemoryExceeded('Worker memory limit exceeded'))
+                    else:
+                        worker.task = None
+                        worker.deadline = None
+                        future.set_exception(RuntimeError(payload))
+                elif worker.process.sentinel in ready:
+                    self._fail(worker, self._crashed(worker))
+                elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                    logging.warning(f"Killing worker {worker.process.pid}: task exceeded {self.task_timeout}s")
+                    self._fail(worker, TaskTimeout(f'Task exceeded {self.task_timeout}s'))
+
+    def shutdown(self) -> None:
+        """Cancel queued tasks and stop every worker"""
+        with self._lock:
+            self._shutdown = True
+            while self._queue:
+                _, future, _, _ = self._queue.popleft()
+                future.cancel()
+            supervisor = self._supervisor
+            notify = not self._wakeup_pending
+            self._wakeup_pending = True
+        if notify:
+            self._wakeup_w.send_bytes(b'x')
+        if supervisor is not None:
+            supervisor.join()
+
+        for worker in list(self._workers):
+            if worker.task is not None:
+                worker.task[1].set_exception(RuntimeError('Pool has been shut down'))
+                worker.kill()
+            else:
+                worker.stop()
+        self._workers = []
@@ -0,0 +1,115 @@
+"""
+Streaming ZIP output for Speedy Statements
+Lets a worker thread write a ZIP archive while the event loop sends it to the client,
+without staging the archive on disk
+"""
+import asyncio
+import io
+import os
+import threading
+import zipfile
+from typing import AsyncIterator, Optional
+
+# Bytes collected before a chunk is handed to the event loop
+DEFAULT_CHUNK_SIZE = 256 * 1024
+# Chunks waiting to be sent before the writer blocks (bounds memory per download)
+DEFAULT_MAX_PENDING = 16
+
+
+class ZipStreamWriter(io.RawIOBase):
+    """
+    Write end of a streamed response
+
+    A worker thread writes to it (typically through zipfile.ZipFile, which switches to
+    data descriptors because the stream is not seekable) and the route returns
+    iter_chunks() in a StreamingResponse. Writes block while the client is behind, and
+    raise BrokenPipeError once the client has gone away.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        """
+        Initialize the writer
+
+        Args:
+            loop: Event loop the response is served from
+            chunk_size: Bytes to collect before handing a chunk to the loop
+            max_pending: Chunks that may wait to be sent before writes block
+        """
+        super().__init__()
+        self.chunk_size = chunk_size
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._cancelled.is_set():
+            raise BrokenPipeError('Client closed the download')
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def _put(self, chunk: Optional[bytes]) -> None:
+        if self._cancelled.is_set():
+            raise BrokenPipeError('Client closed the download')
+        asyncio.run_coroutine_threadsafe(self._queue.put(chunk), self._loop).result()
+
+    def finish(self) -> None:
+        """Send what is buffered and end the response (call from the writing thread)"""
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(None)
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Chunks for StreamingResponse, until finish() is called"""
+        try:
+            while True:
+                chunk = await self._queue.get()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # Client disconnected or the response ended: unblock the writer and make it stop
+            self._cancelled.set()
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+
+def open_entry(zip_file: zipfile.ZipFile, name: str, size_hint: int = 0):
+    """
+    Open a ZIP entry for writing when its final size is not known yet
+
+    Entries that might pass the 4 GB limit are written with ZIP64 sizes; ZipFile adds the
+    ZIP64 end-of-archive records itself when the archive or the entry count gets too big.
+
+    Args:
+        zip_file: Archive being written
+        name: Entry name
+        size_hint: Expected uncompressed size in bytes, if known
+
+    Returns:
+        Writable binary file object for the entry
+    """
+    return zip_file.open(name, 'w', force_zip64=size_hint * 2 >= zipfile.ZIP64_LIMIT)
+
+
+def duplicate_file(file_obj) -> io.BufferedReader:
+    """
+    Second read handle on an open file that stays usable after file_obj is closed
+    (the two share a file position, so seek before reading)
+
+    Used for uploads, which FastAPI closes when the route returns but which a streamed
+    response still has to read.
+    """
+    rollover = getattr(file_obj, 'rollover', None)
+    if rollover is not None:
+        # Spooled uploads may still be in memory; move them to their temp file
+        rollover()
+    return os.fdopen(os.dup(file_obj.fileno()), 'rb')
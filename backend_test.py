@@ -10,11 +10,14 @@ import os
 import tempfile
 from pathlib import Path
 import email
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import io
+import base64
 
 # Get backend URL from frontend .env file
 def get_backend_url():
@@ -97,6 +100,33 @@ def save_test_pdf_to_temp():
     temp_file.close()
     return temp_file.name
 
+def create_text_pdf(pages):
+    """Create a PDF with one line of extractable text per page (pages is a list of strings)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    font_id = 3 + 2 * len(pages)
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    
+    pdf_content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf_content))
+        pdf_content += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf_content)
+    pdf_content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf_content += f"{offset:010d} 00000 n \n".encode()
+    pdf_content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return pdf_content
+
 def parse_eml_content(eml_content):
     """Parse .eml file content and extract headers and parts"""
     msg = email.message_from_string(eml_content)
@@ -116,6 +146,33 @@ def parse_eml_content(eml_content):
     
     return headers, parts
 
+def free_port():
+    """A local TCP port nothing is listening on"""
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_private_server(port, env, log_path, workers=1):
+    """Start a backend on port with extra environment variables, for tests that need their own server"""
+    import subprocess
+    import sys
+    log = open(log_path, 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--port', str(port), '--workers', str(workers)],
+        cwd=Path(__file__).parent / 'backend', env=dict(os.environ, **env),
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Test server did not start")
+
 def test_outlook_draft_endpoint():
     """Test /api/outlook/draft endpoint"""
     print("\n=== Testing /api/outlook/draft endpoint ===")
@@ -342,6 +399,1875 @@ def test_outlook_draft_upload_endpoint():
         print(f"❌ ERROR: {str(e)}")
         return {'success': False, 'error': str(e)}
 
+def test_draft_from_upload_session():
+    """Drafts and batches can refer to an uploaded PDF by upload_id instead of re-uploading it"""
+    print("\n=== Testing drafts from upload sessions ===")
+    
+    try:
+        pdf_content = create_test_pdf()
+        
+        # Upload once through the extract route
+        response = requests.post(
+            f"{API_BASE}/pdf/upload-extract",
+            files=[('files', ('session_statement.pdf', pdf_content, 'application/pdf'))]
+        )
+        if response.status_code != 200:
+            print(f"❌ FAIL: upload-extract returned {response.status_code}")
+            return {'success': False, 'error': f'upload-extract returned {response.status_code}'}
+        upload_id = response.json()[0].get('upload_id')
+        print(f"Upload ID: {upload_id}")
+        
+        draft_data = {
+            'upload_id': upload_id,
+            'recipient_email': 'recipient@example.com',
+            'subject': 'Upload Session Draft',
+            'body': '<p>Statement attached.</p>'
+        }
+        
+        # Draft without sending the file again
+        response = requests.post(f"{API_BASE}/outlook/draft-upload", data=draft_data)
+        headers, parts = parse_eml_content(response.text) if response.status_code == 200 else ({}, [])
+        has_attachment = any(
+            part['content_type'] == 'application/pdf' and base64.b64decode(part['payload']) == pdf_content
+            for part in parts
+        )
+        print(f"{'✅' if has_attachment else '❌'} Draft from upload_id attaches the uploaded PDF")
+        
+        # Batch without sending the file again
+        response = requests.post(f"{API_BASE}/outlook/batch-create", data={
+            'recipients': json.dumps([{
+                'filename': 'session_statement.pdf',
+                'email': 'recipient@example.com',
+                'upload_id': upload_id
+            }]),
+            'subject': 'Upload Session Batch',
+            'body': '<p>Statement attached.</p>'
+        })
+        batch_ok = response.status_code == 200 and response.json()['summary']['successful'] == 1
+        print(f"{'✅' if batch_ok else '❌'} Batch from upload_id created the draft")
+        
+        # Unknown IDs are rejected
+        response = requests.post(f"{API_BASE}/outlook/draft-upload", data={**draft_data, 'upload_id': 'missing'})
+        unknown_rejected = response.status_code == 404
+        print(f"{'✅' if unknown_rejected else '❌'} Unknown upload_id returns 404")
+        
+        return {
+            'success': has_attachment and batch_ok and unknown_rejected,
+            'draft_from_session': has_attachment,
+            'batch_from_session': batch_ok,
+            'unknown_rejected': unknown_rejected
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+def test_early_exit_extraction():
+    """early_exit stops at the first page with an email or after page_budget pages; bad budgets get a 422"""
+    print("\n=== Testing early-exit extraction ===")
+    
+    import shutil
+    folder = tempfile.mkdtemp(prefix='early_exit_')
+    try:
+        # The email is on page 2 of 5
+        pdf_content = create_text_pdf(['Statement', 'Contact billing@example.com', 'Page 3', 'Page 4', 'Page 5'])
+        with open(os.path.join(folder, 'statement.pdf'), 'wb') as f:
+            f.write(pdf_content)
+        
+        def extract(**options):
+            response = requests.post(f"{API_BASE}/pdf/extract", json={
+                'folder_path': folder, 'early_exit': True, 'use_index': False, **options
+            })
+            return response.status_code, response.json()
+        
+        status_code, results = extract()
+        stopped = (
+            status_code == 200 and results[0]['emails'] == ['billing@example.com'] and
+            results[0]['pages_scanned'] == [1, 2] and results[0]['page_count'] == 5
+        )
+        print(f"{'✅' if stopped else '❌'} Stopped after the page with the email: {results}")
+        
+        status_code, results = extract(page_budget=1)
+        budgeted = status_code == 200 and results[0]['emails'] == [] and results[0]['pages_scanned'] == [1]
+        print(f"{'✅' if budgeted else '❌'} page_budget=1 reads only the first page: {results}")
+        
+        rejected = all(extract(page_budget=budget)[0] == 422 for budget in (0, -1))
+        for budget in (0, -1):
+            response = requests.post(
+                f"{API_BASE}/pdf/upload-extract",
+                files=[('files', ('statement.pdf', pdf_content, 'application/pdf'))],
+                data={'early_exit': 'true', 'page_budget': str(budget)}
+            )
+            rejected = rejected and response.status_code == 422
+        print(f"{'✅' if rejected else '❌'} page_budget 0 and -1 are rejected with 422")
+        
+        return {
+            'success': stopped and budgeted and rejected,
+            'early_exit': stopped,
+            'page_budget': budgeted,
+            'invalid_budget_rejected': rejected
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def test_supervised_pool():
+    """Hanging, memory-hungry and crashing tasks fail alone; their workers are replaced (runs locally)"""
+    print("\n=== Testing supervised extraction workers ===")
+    
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from worker_pool import SupervisedPool, WorkerCrashed
+    from pdf_extraction import _summary_from_future
+    
+    # One worker, so every later task runs on the replacement
+    pool = SupervisedPool(max_workers=1, task_timeout=2, memory_limit=512 * 1024 * 1024)
+    try:
+        start = time.monotonic()
+        hung = _summary_from_future(pool.submit(time.sleep, 60))
+        timed_out = hung['status'] == 'timed_out' and time.monotonic() - start < 10
+        print(f"{'✅' if timed_out else '❌'} Hanging task: {hung['status']} after {time.monotonic() - start:.1f}s")
+        
+        hungry = _summary_from_future(pool.submit(bytearray, 2 * 1024 * 1024 * 1024))
+        too_large = hungry['status'] == 'too_large'
+        print(f"{'✅' if too_large else '❌'} Memory-hungry task: {hungry['status']}")
+        
+        crash = pool.submit(os._exit, 3)
+        try:
+            crash.result(timeout=30)
+            crashed = False
+        except WorkerCrashed:
+            crashed = True
+        print(f"{'✅' if crashed else '❌'} Crashing task raises WorkerCrashed")
+        
+        # The pool keeps working with fresh workers
+        recovered = pool.submit(abs, -5).result(timeout=30) == 5 and pool.restarts == 3
+        print(f"{'✅' if recovered else '❌'} Next task succeeds after {pool.restarts} worker restarts")
+        
+        return {
+            'success': timed_out and too_large and crashed and recovered,
+            'timed_out': timed_out,
+            'too_large': too_large,
+            'crashed': crashed,
+            'recovered': recovered
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        pool.shutdown()
+
+def test_extraction_cache():
+    """ExtractionCache evicts least recently used entries, counts hits and misses, and drops old versions (runs locally)"""
+    print("\n=== Testing extraction cache ===")
+    
+    import sys
+    import shutil
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from extraction_cache import ExtractionCache
+    
+    cache_dir = tempfile.mkdtemp(prefix='extraction_cache_')
+    try:
+        db_path = os.path.join(cache_dir, 'extraction_cache.db')
+        # Room for two 100-byte entries (98 characters of text plus "[]")
+        cache = ExtractionCache(db_path, 'v1', max_bytes=250)
+        cache.put('a', 'a' * 98, [])
+        time.sleep(0.01)
+        cache.put('b', 'b' * 98, [])
+        time.sleep(0.01)
+        cache.get('a')  # a is now used more recently than b
+        time.sleep(0.01)
+        cache.put('c', 'c' * 98, [])
+        
+        evicted = cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+        print(f"{'✅' if evicted else '❌'} Least recently used entry evicted first")
+        
+        stats = cache.stats()
+        counted = (
+            stats['hits'] == 3 and stats['misses'] == 1 and stats['evictions'] == 1 and
+            stats['entries'] == 2 and stats['bytes'] == 200 and stats['hit_rate'] == 0.75
+        )
+        print(f"{'✅' if counted else '❌'} Counters: {stats}")
+        
+        # Opening the cache under a new extraction version drops what the old one stored
+        cache = ExtractionCache(db_path, 'v2', max_bytes=250)
+        invalidated = cache.get('a') is None and cache.stats()['entries'] == 0
+        print(f"{'✅' if invalidated else '❌'} Entries from another version are dropped")
+        
+        return {
+            'success': evicted and counted and invalidated,
+            'lru_eviction': evicted,
+            'counters': counted,
+            'version_invalidation': invalidated
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def test_streamed_extraction():
+    """/pdf/extract-stream sends a start line, one result line per PDF and a done line, each as one JSON line"""
+    print("\n=== Testing streamed extraction (NDJSON) ===")
+    
+    import shutil
+    folder = tempfile.mkdtemp(prefix='extract_stream_')
+    try:
+        file_count = 4
+        for i in range(file_count):
+            with open(os.path.join(folder, f'statement_{i}.pdf'), 'wb') as f:
+                f.write(create_text_pdf([f'Contact customer{i}@example.com']))
+        
+        def stream():
+            response = requests.post(f"{API_BASE}/pdf/extract-stream", json={'folder_path': folder}, stream=True)
+            raw = b''.join(response.iter_content(chunk_size=None))
+            return response, raw
+        
+        response, raw = stream()
+        one_per_line = (
+            response.status_code == 200 and
+            response.headers.get('content-type', '').startswith('application/x-ndjson') and
+            raw.endswith(b"\n")
+        )
+        lines = [json.loads(line) for line in raw.decode('utf-8').splitlines()]
+        print(f"{'✅' if one_per_line else '❌'} {len(lines)} NDJSON lines, content type {response.headers.get('content-type')}")
+        
+        results = lines[1:-1]
+        ordered = (
+            [line['type'] for line in lines] == ['start'] + ['result'] * file_count + ['done'] and
+            lines[0]['total'] == file_count and
+            [line['completed'] for line in results] == list(range(1, file_count + 1)) and
+            lines[-1]['completed'] == file_count
+        )
+        print(f"{'✅' if ordered else '❌'} start, one result per PDF with rising progress, then done")
+        
+        # Parsed files come in completion order; index is each file's place in the folder listing
+        expected = {f'statement_{i}.pdf': [f'customer{i}@example.com'] for i in range(file_count)}
+        matched = (
+            sorted(line['index'] for line in results) == list(range(file_count)) and
+            {line['result']['filename']: line['result']['emails'] for line in results} == expected
+        )
+        print(f"{'✅' if matched else '❌'} Every result line matches its file")
+        
+        # Files reused from the folder index are sent first, in folder order
+        response, raw = stream()
+        lines = [json.loads(line) for line in raw.decode('utf-8').splitlines()]
+        reused_first = (
+            lines[0].get('reused') == file_count and
+            [line.get('index') for line in lines[1:-1]] == list(range(file_count)) and
+            lines[-1]['type'] == 'done'
+        )
+        print(f"{'✅' if reused_first else '❌'} Reused files streamed first, in folder order")
+        
+        return {
+            'success': one_per_line and ordered and matched and reused_first,
+            'ndjson_lines': one_per_line,
+            'line_order': ordered,
+            'results_match_files': matched,
+            'reused_first': reused_first
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def test_incremental_folder_scan():
+    """/pdf/extract reuses unchanged files from the folder index and reports it in the X-Files-* headers"""
+    print("\n=== Testing incremental folder scans ===")
+    
+    import hashlib
+    import shutil
+    folder = tempfile.mkdtemp(prefix='folder_index_')
+    try:
+        def write(name, email_address):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(create_text_pdf([f'Contact {email_address}']))
+        
+        def extract():
+            response = requests.post(f"{API_BASE}/pdf/extract", json={'folder_path': folder})
+            counts = tuple(
+                int(response.headers.get(f'X-Files-{name}', -1)) for name in ('Reused', 'Parsed', 'Removed')
+            )
+            return response.json(), counts
+        
+        for i in range(3):
+            write(f'statement_{i}.pdf', f'customer{i}@example.com')
+        
+        results, counts = extract()
+        first_scan = counts == (0, 3, 0)
+        print(f"{'✅' if first_scan else '❌'} First scan parses every file: reused, parsed, removed = {counts}")
+        
+        # The hash comes from the worker that parsed the file
+        with open(os.path.join(folder, 'statement_0.pdf'), 'rb') as f:
+            expected_hash = hashlib.sha256(f.read()).hexdigest()
+        hashed = next(r for r in results if r['filename'] == 'statement_0.pdf')['content_hash'] == expected_hash
+        print(f"{'✅' if hashed else '❌'} Results carry the file's content hash")
+        
+        results, counts = extract()
+        second_scan = counts == (3, 0, 0)
+        print(f"{'✅' if second_scan else '❌'} Unchanged folder is reused: {counts}")
+        
+        # Touched (same content), rewritten and deleted files
+        os.utime(os.path.join(folder, 'statement_0.pdf'), ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        write('statement_1.pdf', 'new.customer1@example.com')
+        os.remove(os.path.join(folder, 'statement_2.pdf'))
+        results, counts = extract()
+        emails = {r['filename']: r['emails'] for r in results}
+        changed_scan = counts == (1, 1, 1) and emails == {
+            'statement_0.pdf': ['customer0@example.com'],
+            'statement_1.pdf': ['new.customer1@example.com']
+        }
+        print(f"{'✅' if changed_scan else '❌'} Touched file reused, changed one parsed, deleted one removed: {counts}")
+        
+        return {
+            'success': first_scan and hashed and second_scan and changed_scan,
+            'first_scan': first_scan,
+            'content_hash': hashed,
+            'unchanged_reused': second_scan,
+            'changes_detected': changed_scan
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def test_upload_session_expiry():
+    """An expired upload session looked up again still has its file deleted by purge_expired() (runs locally)"""
+    print("\n=== Testing upload session expiry ===")
+    
+    import sys
+    import shutil
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from upload_sessions import UploadSessionStore
+    
+    upload_dir = tempfile.mkdtemp(prefix='upload_sessions_')
+    try:
+        store = UploadSessionStore(upload_dir, ttl=0.2)
+        session = store.create('statement.pdf', create_test_pdf())
+        shared = store.create('statement.pdf', create_test_pdf(), ttl=60)
+        expiring = store.create('other.pdf', create_test_pdf() + b'%other')
+        time.sleep(0.3)
+        
+        # A client sending an expired ID again must not stop its file from being cleaned up
+        rejected = store.get(expiring.upload_id) is None
+        purged = store.purge_expired()
+        deleted = rejected and purged == 2 and not os.path.exists(expiring.path)
+        print(f"{'✅' if deleted else '❌'} Expired session's file deleted after a lookup ({purged} purged)")
+        
+        # Content is stored once, so a file still used by a live session stays
+        kept = os.path.exists(session.path) and store.get(shared.upload_id) is not None
+        print(f"{'✅' if kept else '❌'} File shared with a live session is kept")
+        
+        return {'success': deleted and kept, 'expired_file_deleted': deleted, 'shared_file_kept': kept}
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+def test_streamed_batch_zip():
+    """batch-create with stream=true sends the ZIP in the response, drafts first and the report last"""
+    print("\n=== Testing streamed batch ZIP ===")
+    
+    try:
+        pdf_content = create_test_pdf()
+        file_count = 5
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf', pdf_content, 'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Streamed Batch Statement',
+            'body': '<p>Please find your statement attached.</p>',
+            'stream': 'true'
+        }
+        
+        response = requests.post(f"{API_BASE}/outlook/batch-create", files=files, data=data)
+        print(f"Status Code: {response.status_code}")
+        print(f"Content-Type: {response.headers.get('content-type')}")
+        if response.status_code != 200:
+            return {'success': False, 'error': f'API returned status {response.status_code}'}
+        
+        import zipfile
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        names = archive.namelist()
+        print(f"Entries: {names}")
+        
+        valid = archive.testzip() is None
+        drafts = [name for name in names if name.endswith('.eml')]
+        report_last = names[-1].startswith('statement_report_')
+        drafts_ok = len(drafts) == file_count and all(
+            'X-Unsent: 1' in archive.read(name).decode('utf-8') for name in drafts
+        )
+        
+        print(f"{'✅' if valid else '❌'} ZIP is valid")
+        print(f"{'✅' if drafts_ok else '❌'} {len(drafts)}/{file_count} drafts with draft headers")
+        print(f"{'✅' if report_last else '❌'} Report is the last entry")
+        
+        return {
+            'success': valid and drafts_ok and report_last,
+            'entries': len(names)
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+def test_batch_job_lifecycle():
+    """Batch jobs return an ID straight away, report progress, finish with a download and can be cancelled"""
+    print("\n=== Testing background batch jobs ===")
+    
+    try:
+        pdf_content = create_test_pdf() + b"\n%" + b"0" * (256 * 1024)
+        file_count = 40
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf', pdf_content, 'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Batch Job Statement',
+            'body': '<p>Please find your statement attached.</p>'
+        }
+        
+        response = requests.post(f"{API_BASE}/outlook/batch-jobs", files=files, data=data)
+        if response.status_code != 200:
+            print(f"❌ FAIL: submit returned {response.status_code}")
+            return {'success': False, 'error': f'submit returned {response.status_code}'}
+        job_id = response.json()['job_id']
+        print(f"Job ID: {job_id}")
+        
+        # Poll until the job finishes
+        deadline = time.time() + 60
+        status = {}
+        while time.time() < deadline:
+            status = requests.get(f"{API_BASE}/outlook/batch-jobs/{job_id}").json()
+            progress = status['progress']
+            eta = f"{progress['eta_seconds']}s" if progress['eta_seconds'] is not None else "-"
+            print(f"  {status['state']}: {progress['done']} done, {progress['failed']} failed, "
+                  f"{progress['remaining']} remaining, {progress['throughput_per_second']}/s, ETA {eta}")
+            if status['state'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+        
+        completed = status.get('state') == 'completed' and status['summary']['successful'] == file_count
+        print(f"{'✅' if completed else '❌'} Job completed with {status.get('summary')}")
+        
+        downloaded = False
+        if completed:
+            download = requests.get(f"{BASE_URL}{status['download_url']}")
+            downloaded = download.status_code == 200 and download.content[:2] == b'PK'
+        print(f"{'✅' if downloaded else '❌'} ZIP downloads from {status.get('download_url')}")
+        
+        # Cancel a second job straight after submitting it
+        job_id = requests.post(f"{API_BASE}/outlook/batch-jobs", files=files, data=data).json()['job_id']
+        requests.post(f"{API_BASE}/outlook/batch-jobs/{job_id}/cancel")
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            status = requests.get(f"{API_BASE}/outlook/batch-jobs/{job_id}").json()
+            if status['state'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+        cancelled = status.get('state') == 'cancelled' and 'download_url' not in status
+        print(f"{'✅' if cancelled else '❌'} Cancelled job ended as {status.get('state')} "
+              f"({status['progress']['skipped']} items skipped)")
+        
+        return {
+            'success': completed and downloaded and cancelled,
+            'completed': completed,
+            'downloaded': downloaded,
+            'cancelled': cancelled
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+def test_batch_job_from_paths():
+    """Folder-path mode: one request turns PDFs already on disk into a batch job"""
+    print("\n=== Testing batch jobs from folder paths ===")
+    import zipfile
+
+    file_count = 20
+    pdf_paths = [save_test_pdf_to_temp() for _ in range(file_count)]
+    try:
+        items = [
+            {
+                'pdf_filename': f'statement_{i}.pdf',
+                'pdf_path': path,
+                'recipient_email': f'customer{i}@example.com'
+            }
+            for i, path in enumerate(pdf_paths)
+        ]
+        items.append({
+            'pdf_filename': 'missing.pdf',
+            'pdf_path': os.path.join(tempfile.gettempdir(), 'does_not_exist.pdf'),
+            'recipient_email': 'missing@example.com'
+        })
+        response = requests.post(f"{API_BASE}/outlook/batch-jobs/paths", json={
+            'items': items,
+            'subject': 'Folder Statement',
+            'body': '<p>Please find your statement attached.</p>'
+        })
+        if response.status_code != 200:
+            print(f"❌ FAIL: submit returned {response.status_code}")
+            return {'success': False, 'error': f'submit returned {response.status_code}'}
+        job_id = response.json()['job_id']
+
+        deadline = time.time() + 60
+        status = {}
+        while time.time() < deadline:
+            status = requests.get(f"{API_BASE}/outlook/batch-jobs/{job_id}").json()
+            if status['state'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+
+        completed = (
+            status.get('state') == 'completed'
+            and status['summary'] == {'total': file_count + 1, 'successful': file_count, 'failed': 1}
+            and status['failed'][0]['filename'] == 'missing.pdf'
+        )
+        print(f"{'✅' if completed else '❌'} Job completed with {status.get('summary')}")
+
+        zipped = False
+        if completed:
+            download = requests.get(f"{BASE_URL}{status['download_url']}")
+            with zipfile.ZipFile(io.BytesIO(download.content)) as zf:
+                drafts = [name for name in zf.namelist() if name.endswith('.eml')]
+                headers, parts = parse_eml_content(zf.read('draft_statement_0.eml').decode('utf-8'))
+            pdf_part = next((p for p in parts if p['content_type'] == 'application/pdf'), None)
+            zipped = (
+                len(drafts) == file_count
+                and headers.get('To') == 'customer0@example.com'
+                and pdf_part is not None
+                and base64.b64decode(pdf_part['payload']) == create_test_pdf()
+            )
+        print(f"{'✅' if zipped else '❌'} ZIP has {file_count} drafts with the PDFs read from disk")
+
+        return {'success': completed and zipped, 'completed': completed, 'zipped': zipped}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        for path in pdf_paths:
+            os.remove(path)
+
+def test_directory_output():
+    """output=directory writes drafts atomically into DRAFT_OUTPUT_DIR and returns only paths and sizes"""
+    print("\n=== Testing direct-to-directory output ===")
+    import shutil
+
+    # DRAFT_OUTPUT_DIR is server configuration, so use a server of our own
+    work_dir = tempfile.mkdtemp(prefix='speedy_pickup_')
+    output_dir = os.path.join(work_dir, 'pickup')
+    port = free_port()
+    api = f"http://127.0.0.1:{port}/api"
+    server = None
+    try:
+        server = start_private_server(port, {
+            'DRAFT_OUTPUT_DIR': output_dir,
+            'BATCH_JOB_DIR': os.path.join(work_dir, 'jobs')
+        }, os.path.join(work_dir, 'server.log'))
+
+        def drafts_on_disk():
+            return sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []
+
+        def listed_files_exist(files):
+            return all(
+                os.path.getsize(f['path']) == f['size'] and 'payload' not in f and 'content' not in f
+                for f in files
+            )
+
+        # Single draft from a path
+        pdf_path = save_test_pdf_to_temp()
+        response = requests.post(f"{api}/outlook/draft", json={
+            'pdf_filename': 'single.pdf',
+            'pdf_path': pdf_path,
+            'recipient_email': 'single@example.com',
+            'subject': 'Pickup Statement',
+            'body': '<p>Attached.</p>',
+            'output': 'directory'
+        })
+        os.remove(pdf_path)
+        single = response.status_code == 200 and listed_files_exist(response.json()['files'])
+        with open(os.path.join(output_dir, 'draft_single.eml'), encoding='utf-8') as f:
+            headers, _ = parse_eml_content(f.read())
+        single = single and headers.get('X-Unsent') == '1' and headers.get('To') == 'single@example.com'
+        print(f"{'✅' if single else '❌'} Single draft written to {output_dir}")
+
+        # Batch of uploads, written in parallel
+        file_count = 30
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf', create_test_pdf(), 'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Pickup Statement',
+            'body': '<p>Attached.</p>',
+            'output': 'directory'
+        }
+        result = requests.post(f"{api}/outlook/batch-create", files=files, data=data).json()
+        batch = (
+            result.get('summary', {}).get('successful') == file_count
+            and 'download_url' not in result
+            and listed_files_exist(result['successful'])
+        )
+        print(f"{'✅' if batch else '❌'} Batch wrote {result.get('summary')} without a ZIP")
+
+        # Background job into the same directory
+        job_id = requests.post(f"{api}/outlook/batch-jobs", files=files, data=data).json()['job_id']
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            status = requests.get(f"{api}/outlook/batch-jobs/{job_id}").json()
+            if status['state'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+        job = (
+            status['state'] == 'completed'
+            and status['summary']['successful'] == file_count
+            and 'download_url' not in status
+            and listed_files_exist(status['successful'])
+        )
+        print(f"{'✅' if job else '❌'} Batch job ended as {status['state']} with {status['summary']}")
+
+        # Only finished drafts are left: no temp files
+        names = drafts_on_disk()
+        clean = len(names) == file_count + 1 and all(n.startswith('draft_') and n.endswith('.eml') for n in names)
+        print(f"{'✅' if clean else '❌'} Pickup directory has {len(names)} drafts and no temp files")
+
+        # Unknown targets are rejected
+        rejected = requests.post(f"{api}/outlook/batch-create", files=files[:1], data=dict(data, output='ftp')).status_code == 400
+        print(f"{'✅' if rejected else '❌'} Unknown output target returns 400")
+
+        return {
+            'success': single and batch and job and clean and rejected,
+            'single': single,
+            'batch': batch,
+            'job': job,
+            'clean': clean,
+            'rejected': rejected
+        }
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_mbox_export():
+    """format=mbox appends drafts to rotating mbox shards with an index of byte offsets"""
+    print("\n=== Testing mbox export ===")
+    import mailbox
+    import shutil
+    import zipfile
+
+    # Small shards so the batch rolls over to several files
+    work_dir = tempfile.mkdtemp(prefix='speedy_mbox_')
+    output_dir = os.path.join(work_dir, 'pickup')
+    port = free_port()
+    api = f"http://127.0.0.1:{port}/api"
+    server = None
+    try:
+        server = start_private_server(port, {
+            'DRAFT_OUTPUT_DIR': output_dir,
+            'BATCH_JOB_DIR': os.path.join(work_dir, 'jobs'),
+            'MBOX_SHARD_MAX_BYTES': '10000'
+        }, os.path.join(work_dir, 'server.log'))
+
+        file_count = 30
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf', create_test_pdf() + f"\n%{i}".encode(), 'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Mbox Statement',
+            # A body line starting with "From " must be quoted in the mbox
+            'body': '<p>Please find your statement attached.</p>\nFrom the accounts team',
+            'format': 'mbox'
+        }
+
+        def check_shards(read_shard, index_lines):
+            """Every index entry points at its own message, and each shard parses as mbox"""
+            index = [json.loads(line) for line in index_lines if line.strip()]
+            shard_names = sorted({entry['shard'] for entry in index})
+            for i, entry in enumerate(index):
+                raw = read_shard(entry['shard'])[entry['offset']:entry['offset'] + entry['length']]
+                message = email.message_from_bytes(raw.split(b'\n', 1)[1])
+                pdf_part = next(p for p in message.walk() if p.get_content_type() == 'application/pdf')
+                if not (raw.startswith(b'From ')
+                        and entry['filename'] == f'statement_{i}.pdf'
+                        and message['To'] == f'customer{i}@example.com'
+                        and message['X-Unsent'] == '1'
+                        and pdf_part.get_payload(decode=True) == create_test_pdf() + f"\n%{i}".encode()
+                        and b'\n>From the accounts team' in raw):
+                    return False, shard_names
+            parsed = 0
+            for name in shard_names:
+                with tempfile.NamedTemporaryFile(suffix='.mbox', delete=False) as f:
+                    f.write(read_shard(name))
+                parsed += len(mailbox.mbox(f.name))
+                os.remove(f.name)
+            return len(index) == file_count and parsed == file_count, shard_names
+
+        # Download: the ZIP holds the shards, the index and the report
+        result = requests.post(f"{api}/outlook/batch-create", files=files, data=data).json()
+        download = requests.get(f"http://127.0.0.1:{port}{result['download_url']}")
+        with zipfile.ZipFile(io.BytesIO(download.content)) as zf:
+            names = zf.namelist()
+            index_name = next(n for n in names if n.endswith('.index.jsonl'))
+            zipped, shard_names = check_shards(zf.read, zf.read(index_name).decode('utf-8').splitlines())
+        zipped = zipped and len(shard_names) > 1 and not any(n.endswith('.eml') for n in names)
+        print(f"{'✅' if zipped else '❌'} ZIP has {len(shard_names)} mbox shards, an index and no .eml files")
+
+        # Background job into the pickup directory
+        job_id = requests.post(f"{api}/outlook/batch-jobs", files=files,
+                               data=dict(data, output='directory')).json()['job_id']
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            status = requests.get(f"{api}/outlook/batch-jobs/{job_id}").json()
+            if status['state'] not in ('queued', 'running'):
+                break
+            time.sleep(0.2)
+
+        def read_pickup(name):
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                return f.read()
+
+        with open(status['index']['path'], encoding='utf-8') as f:
+            in_directory, shard_names = check_shards(read_pickup, f.read().splitlines())
+        in_directory = (
+            in_directory
+            and status['state'] == 'completed'
+            and status['successful'][0]['output'] == shard_names[0]
+            and sorted(os.listdir(output_dir)) == sorted(shard_names + [os.path.basename(status['index']['path'])])
+        )
+        print(f"{'✅' if in_directory else '❌'} Job wrote {len(shard_names)} shards and the index to {output_dir}")
+
+        return {'success': zipped and in_directory, 'zipped': zipped, 'in_directory': in_directory}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_artifact_store():
+    """Downloads are bounded by a quota (LRU eviction) and a TTL; the janitor clears old leftovers in the app's folders"""
+    print("\n=== Testing bounded artifact store ===")
+    import shutil
+    import uuid
+
+    # Quota, TTL and the folders the janitor sweeps are server configuration
+    work_dir = tempfile.mkdtemp(prefix='speedy_artifacts_')
+    tmp_dir = os.path.join(work_dir, 'tmp')
+    artifact_dir = os.path.join(work_dir, 'artifacts')
+    upload_dir = os.path.join(work_dir, 'uploads')
+    draft_dir = os.path.join(work_dir, 'drafts')
+    for directory in (tmp_dir, upload_dir, draft_dir):
+        os.makedirs(directory)
+    # Partial files interrupted requests left in the app's own folders
+    stale = [
+        os.path.join(upload_dir, f'{uuid.uuid4().hex}.pdf.{uuid.uuid4().hex}.tmp'),
+        os.path.join(draft_dir, f'.draft_stale.eml.{uuid.uuid4().hex}.tmp')
+    ]
+    fresh = os.path.join(draft_dir, f'.draft_fresh.eml.{uuid.uuid4().hex}.tmp')
+    # Other programs' files in the shared temp folder, and finished drafts, are never swept
+    kept = [
+        os.path.join(tmp_dir, 'batch_other_app'),
+        os.path.join(tmp_dir, uuid.uuid4().hex + '_other_app.pdf'),
+        os.path.join(draft_dir, 'draft_finished.eml')
+    ]
+    os.makedirs(kept[0])
+    for path in stale + [fresh] + kept[1:]:
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+    old = time.time() - 3600
+    for path in stale + kept:
+        os.utime(path, (old, old))
+
+    port = free_port()
+    api = f"http://127.0.0.1:{port}/api"
+    server = None
+    try:
+        server = start_private_server(port, {
+            'TMPDIR': tmp_dir,
+            'ARTIFACT_DIR': artifact_dir,
+            'ARTIFACT_TTL': '3',
+            'ARTIFACT_MAX_BYTES': '25000',
+            'ARTIFACT_JANITOR_INTERVAL': '0.5',
+            'BATCH_JOB_DIR': os.path.join(work_dir, 'jobs'),
+            'UPLOAD_SESSION_DIR': upload_dir,
+            'UPLOAD_SESSION_TTL': '2',
+            'DRAFT_OUTPUT_DIR': draft_dir
+        }, os.path.join(work_dir, 'server.log'))
+
+        def artifact_files():
+            # The hidden registry database lives in the same folder
+            return [name for name in os.listdir(artifact_dir) if not name.startswith('.')]
+
+        swept = (
+            not any(os.path.exists(p) for p in stale) and os.path.exists(fresh) and
+            all(os.path.exists(p) for p in kept)
+        )
+        print(f"{'✅' if swept else '❌'} Janitor removed stale leftovers and kept recent and foreign files")
+
+        # Expires while the server is idle: no later upload comes along to purge it
+        upload_path = requests.post(
+            f"{api}/pdf/upload-extract",
+            files=[('files', ('session.pdf', create_test_pdf(), 'application/pdf'))]
+        ).json()[0]['file_path']
+
+        # Direct downloads are deleted once sent
+        pdf_path = save_test_pdf_to_temp()
+        response = requests.post(f"{api}/outlook/draft", json={
+            'pdf_filename': 'direct.pdf',
+            'pdf_path': pdf_path,
+            'recipient_email': 'direct@example.com',
+            'subject': 'Statement',
+            'body': '<p>Attached.</p>'
+        })
+        os.remove(pdf_path)
+        time.sleep(0.2)
+        direct = response.status_code == 200 and not artifact_files()
+        print(f"{'✅' if direct else '❌'} Direct draft download left no file behind")
+
+        def create_report(name):
+            return requests.post(f"{api}/report/create", data={
+                'report_content': 'x' * 10000, 'filename': name
+            }).json()['download_url']
+
+        def status_of(url):
+            return requests.get(f"http://127.0.0.1:{port}{url}").status_code
+
+        # Three 10 KB reports against a 25 KB quota: the least recently used one goes
+        first, second = create_report('first.txt'), create_report('second.txt')
+        status_of(first)
+        third = create_report('third.txt')
+        stats = requests.get(f"{api}/artifacts/stats").json()
+        evicted = (
+            [status_of(first), status_of(second), status_of(third)] == [200, 404, 200]
+            and stats['evictions'] == 1 and stats['bytes_in_use'] == 20000
+        )
+        print(f"{'✅' if evicted else '❌'} Quota evicted the least recently used report: {stats}")
+
+        time.sleep(4)
+        stats = requests.get(f"{api}/artifacts/stats").json()
+        expired = (
+            stats['bytes_in_use'] == 0 and stats['expirations'] == 2
+            and status_of(first) == 404 and not artifact_files()
+        )
+        print(f"{'✅' if expired else '❌'} Expired reports were deleted: {stats}")
+
+        uploads_purged = not os.path.exists(upload_path)
+        print(f"{'✅' if uploads_purged else '❌'} Expired upload session was deleted by the janitor")
+
+        return {'success': swept and direct and evicted and expired and uploads_purged, 'swept': swept,
+                'direct': direct, 'evicted': evicted, 'expired': expired, 'uploads_purged': uploads_purged}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_resumable_download():
+    """/api/download honours Range and If-Range and sends ETag, Content-Length and Accept-Ranges"""
+    print("\n=== Testing resumable downloads ===")
+
+    try:
+        content = ''.join(f"line {i}\n" for i in range(50000))
+        result = requests.post(f"{API_BASE}/report/create", data={
+            'report_content': content, 'filename': 'resumable.txt'
+        }).json()
+        url = f"{BASE_URL}{result['download_url']}"
+        expected = content.encode('utf-8')
+
+        full = requests.get(url)
+        etag = full.headers.get('ETag')
+        headers_ok = (
+            full.status_code == 200 and full.content == expected and etag
+            and full.headers.get('Accept-Ranges') == 'bytes'
+            and full.headers.get('Content-Length') == str(len(expected))
+        )
+        print(f"{'✅' if headers_ok else '❌'} Full download has ETag {etag}, Content-Length and Accept-Ranges")
+
+        # Drop the connection at ~90% and pick up the rest
+        cut = len(expected) * 9 // 10
+        first = requests.get(url, headers={'Range': f'bytes=0-{cut - 1}'})
+        rest = requests.get(url, headers={'Range': f'bytes={cut}-', 'If-Range': etag})
+        resumed = (
+            first.status_code == 206 and rest.status_code == 206
+            and rest.headers.get('Content-Range') == f"bytes {cut}-{len(expected) - 1}/{len(expected)}"
+            and first.content + rest.content == expected
+        )
+        print(f"{'✅' if resumed else '❌'} Resumed download at byte {cut} matches the full file")
+
+        suffix = requests.get(url, headers={'Range': 'bytes=-100'})
+        stale = requests.get(url, headers={'Range': f'bytes={cut}-', 'If-Range': '"changed"'})
+        outside = requests.get(url, headers={'Range': f'bytes={len(expected)}-'})
+        head = requests.head(url)
+        edge_cases = (
+            suffix.status_code == 206 and suffix.content == expected[-100:]
+            and stale.status_code == 200 and stale.content == expected
+            and outside.status_code == 416 and outside.headers.get('Content-Range') == f"bytes */{len(expected)}"
+            and head.status_code == 200 and head.headers.get('ETag') == etag and not head.content
+        )
+        print(f"{'✅' if edge_cases else '❌'} Suffix range, stale If-Range, out-of-range request and HEAD")
+
+        return {'success': bool(headers_ok and resumed and edge_cases), 'headers': bool(headers_ok),
+                'resumed': resumed, 'edge_cases': edge_cases}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+def test_range_response_send_extensions():
+    """RangeFileResponse hands the file to servers offering zero-copy send or path send (runs locally)"""
+    print("\n=== Testing file send extensions ===")
+    import sys
+    import asyncio
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from range_response import RangeFileResponse
+
+    content = bytes(range(256)) * 40
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(content)
+    try:
+        async def call(extensions, headers):
+            messages = []
+
+            async def receive():
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.zerocopysend":
+                    # Read it as the server would, while the file is still open
+                    file = message["file"]
+                    message = dict(message, data=os.pread(file.fileno(), message["count"], message["offset"]))
+                messages.append(message)
+
+            scope = {"type": "http", "method": "GET", "headers": headers, "extensions": extensions}
+            await RangeFileResponse(f.name)(scope, receive, send)
+            return messages
+
+        messages = asyncio.run(call({"http.response.zerocopysend": {}}, [(b"range", b"bytes=100-1099")]))
+        start, body = messages
+        zerocopy_ok = (
+            start["status"] == 206
+            and body["type"] == "http.response.zerocopysend"
+            and hasattr(body["file"], "fileno")
+            and (body["offset"], body["count"]) == (100, 1000)
+            and body["data"] == content[100:1100]
+            and body["more_body"] is False
+        )
+        print(f"{'✅' if zerocopy_ok else '❌'} Zero-copy send gets the open file with the range's offset and count")
+
+        messages = asyncio.run(call({"http.response.pathsend": {}}, []))
+        pathsend_ok = (
+            messages[0]["status"] == 200
+            and messages[1] == {"type": "http.response.pathsend", "path": f.name}
+        )
+        print(f"{'✅' if pathsend_ok else '❌'} Path send gets the file's path for a whole-file response")
+
+        return {'success': zerocopy_ok and pathsend_ok, 'zerocopysend': zerocopy_ok, 'pathsend': pathsend_ok}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        os.remove(f.name)
+
+def test_multiple_workers():
+    """With uvicorn --workers 4, downloads, upload sessions and batch jobs work whichever worker a request hits"""
+    print("\n=== Testing multi-worker deployment ===")
+    import shutil
+
+    work_dir = tempfile.mkdtemp(prefix='speedy_workers_')
+    log_path = os.path.join(work_dir, 'server.log')
+    port = free_port()
+    api = f"http://127.0.0.1:{port}/api"
+    server = None
+    try:
+        server = start_private_server(port, {
+            'ARTIFACT_DIR': os.path.join(work_dir, 'artifacts'),
+            'UPLOAD_SESSION_DIR': os.path.join(work_dir, 'uploads'),
+            'BATCH_JOB_DIR': os.path.join(work_dir, 'jobs'),
+            'EXTRACTION_CACHE_DIR': os.path.join(work_dir, 'cache'),
+            'BATCH_JOB_WORKERS': '1'
+        }, log_path, workers=4)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            with open(log_path, encoding='utf-8') as f:
+                if f.read().count('Application startup complete') == 4:
+                    break
+            time.sleep(0.2)
+
+        # Requests without a shared session open a new connection, which any worker may accept
+        downloads_ok = 0
+        for i in range(30):
+            result = requests.post(f"{api}/report/create", data={
+                'report_content': f'report {i}', 'filename': f'report_{i}.txt'
+            }).json()
+            download = requests.get(f"http://127.0.0.1:{port}{result['download_url']}")
+            downloads_ok += download.status_code == 200 and download.text == f'report {i}'
+        downloads = downloads_ok == 30
+        print(f"{'✅' if downloads else '❌'} {downloads_ok}/30 downloads found by whichever worker served them")
+
+        sessions_ok = 0
+        for i in range(10):
+            extracted = requests.post(f"{api}/pdf/upload-extract", files=[
+                ('files', (f'session_{i}.pdf', create_test_pdf() + f'\n%{i}'.encode(), 'application/pdf'))
+            ]).json()
+            response = requests.post(f"{api}/outlook/draft-upload", data={
+                'upload_id': extracted[0]['upload_id'],
+                'recipient_email': f'customer{i}@example.com',
+                'subject': 'Statement',
+                'body': '<p>Attached.</p>'
+            })
+            sessions_ok += response.status_code == 200
+        sessions = sessions_ok == 10
+        print(f"{'✅' if sessions else '❌'} {sessions_ok}/10 drafts from upload sessions made on other requests")
+
+        file_count = 40
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf', create_test_pdf() + b"\n%" + b"0" * (256 * 1024), 'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Batch Job Statement',
+            'body': '<p>Attached.</p>'
+        }
+
+        def wait_for(job_id):
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                response = requests.get(f"{api}/outlook/batch-jobs/{job_id}")
+                if response.status_code != 200:
+                    return {'state': f'HTTP {response.status_code}'}
+                status = response.json()
+                if status['state'] not in ('queued', 'running'):
+                    return status
+                time.sleep(0.1)
+            return status
+
+        job_id = requests.post(f"{api}/outlook/batch-jobs", files=files, data=data).json()['job_id']
+        status = wait_for(job_id)
+        download = requests.get(f"http://127.0.0.1:{port}{status.get('download_url')}")
+        job = (
+            status['state'] == 'completed' and status['summary']['successful'] == file_count
+            and download.status_code == 200 and download.content[:2] == b'PK'
+        )
+        print(f"{'✅' if job else '❌'} Job polled across workers ended {status['state']} with a downloadable ZIP")
+
+        job_id = requests.post(f"{api}/outlook/batch-jobs", files=files, data=data).json()['job_id']
+        requests.post(f"{api}/outlook/batch-jobs/{job_id}/cancel")
+        status = wait_for(job_id)
+        cancelled = status['state'] == 'cancelled' and status['progress']['skipped'] > 0
+        print(f"{'✅' if cancelled else '❌'} Job cancelled through any worker ended {status['state']}")
+
+        return {'success': downloads and sessions and job and cancelled, 'downloads': downloads,
+                'sessions': sessions, 'job': job, 'cancelled': cancelled}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_json_storage_log_mode():
+    """Log mode appends changes to a JSONL log, compacts it into a snapshot and replays both on startup (runs locally)"""
+    print("\n=== Testing JSON storage log mode ===")
+    import sys
+    import shutil
+    import asyncio
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage, DatabaseWrapper, LOG_MODE
+
+    data_dir = tempfile.mkdtemp(prefix='speedy_log_storage_')
+    try:
+        # Existing snapshot-mode data is the starting point
+        with open(os.path.join(data_dir, 'templates.json'), 'w', encoding='utf-8') as f:
+            json.dump([{'id': 'legacy', 'name': 'Legacy'}], f)
+        db = DatabaseWrapper(JSONStorage(data_dir, mode=LOG_MODE, compact_entries=50))
+
+        async def make_changes():
+            for i in range(120):
+                await db.email_templates.insert_one({'id': f't{i}', 'name': f'Template {i}'})
+            for i in range(0, 120, 3):
+                await db.email_templates.delete_one({'id': f't{i}'})
+            await db.email_templates.update_one({'id': 't1'}, {'$set': {'name': 'Renamed'}})
+            return await db.email_templates.find({}, {"_id": 0}).to_list(1000)
+
+        expected = asyncio.run(make_changes())
+        log_path = os.path.join(data_dir, 'templates.log.jsonl')
+        deadline = time.time() + 10
+        while time.time() < deadline and db.storage._compacting:
+            time.sleep(0.05)
+        with open(log_path, encoding='utf-8') as f:
+            log_entries = sum(1 for _ in f)
+        compacted = os.path.exists(os.path.join(data_dir, 'templates.snapshot.json')) and log_entries < 161
+        print(f"{'✅' if compacted else '❌'} 161 changes compacted into a snapshot, {log_entries} left in the log")
+
+        # A crash in the middle of an append leaves half a line behind
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "insert", "document": {"id": "torn"')
+        replayed = JSONStorage(data_dir, mode=LOG_MODE)._find_sync('email_templates')
+        replay_ok = (
+            replayed == expected and len(expected) == 81
+            and expected[0]['id'] == 'legacy'
+            and next(t for t in expected if t['id'] == 't1')['name'] == 'Renamed'
+        )
+        print(f"{'✅' if replay_ok else '❌'} Restart replays snapshot plus log into the same {len(replayed)} templates")
+
+        with open(log_path, 'rb') as f:
+            repaired = f.read().endswith(b'\n')
+        print(f"{'✅' if repaired else '❌'} Incomplete last log entry was dropped")
+
+        return {'success': compacted and replay_ok and repaired, 'compacted': compacted,
+                'replayed': replay_ok, 'repaired': repaired}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def test_json_storage_concurrent_writes():
+    """1,000 concurrent inserts all survive the group-commit writer, in both storage modes (runs locally)"""
+    print("\n=== Testing JSON storage under concurrent writes ===")
+    import sys
+    import shutil
+    import asyncio
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage, DatabaseWrapper, SNAPSHOT_MODE, LOG_MODE
+
+    count = 1000
+    data_dir = tempfile.mkdtemp(prefix='speedy_concurrent_storage_')
+    try:
+        results = {}
+        for mode in (SNAPSHOT_MODE, LOG_MODE):
+            mode_dir = os.path.join(data_dir, mode)
+            db = DatabaseWrapper(JSONStorage(mode_dir, mode=mode))
+
+            async def insert_all():
+                await asyncio.gather(*(
+                    db.email_templates.insert_one({'id': f't{i}', 'name': f'Template {i}'})
+                    for i in range(count)
+                ))
+
+            started = time.perf_counter()
+            asyncio.run(insert_all())
+            elapsed = time.perf_counter() - started
+            reopened = JSONStorage(mode_dir, mode=mode)._find_sync('email_templates')
+            survived = len({t['id'] for t in reopened})
+            results[mode] = survived == count
+            print(f"{'✅' if survived == count else '❌'} {mode}: {survived}/{count} concurrent inserts "
+                  f"survived a reopen ({count / elapsed:.0f} inserts/s)")
+
+            # A change that can't be stored fails alone, not the writes grouped with it
+            async def insert_with_bad():
+                return await asyncio.gather(
+                    db.email_templates.insert_one({'id': 'good1'}),
+                    db.email_templates.insert_one({'id': 'bad', 'at': object()}),
+                    db.email_templates.update_one({'id': 'good1'}, {'$set': 5}),
+                    db.email_templates.insert_one({'id': 'good2'}),
+                    return_exceptions=True
+                )
+
+            outcomes = asyncio.run(insert_with_bad())
+            stored = {t['id'] for t in JSONStorage(mode_dir, mode=mode)._find_sync('email_templates')}
+            isolated = (
+                [isinstance(outcome, Exception) for outcome in outcomes] == [False, True, True, False]
+                and {'good1', 'good2'} <= stored and 'bad' not in stored
+            )
+            results[f'{mode}_isolated'] = isolated
+            print(f"{'✅' if isolated else '❌'} {mode}: a bad change fails alone, the rest of its group is stored")
+
+        # The previous write path: one read-modify-write and file rewrite per insert
+        legacy = JSONStorage(os.path.join(data_dir, 'legacy'))
+        legacy_path = legacy.collections['email_templates']
+        legacy_lock = threading.Lock()
+
+        def insert_alone(document):
+            with legacy_lock:
+                legacy._write_file(legacy_path, legacy._read_file(legacy_path) + [document])
+
+        async def insert_all_alone():
+            loop = asyncio.get_event_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(None, insert_alone, {'id': f't{i}', 'name': f'Template {i}'})
+                for i in range(count)
+            ))
+
+        started = time.perf_counter()
+        asyncio.run(insert_all_alone())
+        legacy_elapsed = time.perf_counter() - started
+        print(f"   One write per insert: {count / legacy_elapsed:.0f} inserts/s")
+
+        success = all(results.values())
+        return {'success': success, **results}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def test_json_storage_multiple_processes():
+    """Two processes writing to the same data directory lose no inserts, in both storage modes (runs locally)"""
+    print("\n=== Testing JSON storage shared by several processes ===")
+    import sys
+    import shutil
+    import subprocess
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage, SNAPSHOT_MODE, LOG_MODE
+
+    count = 200
+    writer = (
+        "import asyncio, sys\n"
+        f"sys.path.insert(0, {str(Path(__file__).parent / 'backend')!r})\n"
+        "from json_storage import JSONStorage, DatabaseWrapper\n"
+        "db = DatabaseWrapper(JSONStorage(sys.argv[1], mode=sys.argv[2], compact_entries=50))\n"
+        "async def main():\n"
+        f"    for i in range({count}):\n"
+        "        await db.email_templates.insert_one({'id': f'{sys.argv[3]}-{i}'})\n"
+        "asyncio.run(main())\n"
+    )
+    data_dir = tempfile.mkdtemp(prefix='speedy_shared_storage_')
+    try:
+        results = {}
+        for mode in (SNAPSHOT_MODE, LOG_MODE):
+            mode_dir = os.path.join(data_dir, mode)
+            processes = [
+                subprocess.Popen([sys.executable, '-c', writer, mode_dir, mode, name], stderr=subprocess.PIPE)
+                for name in ('a', 'b')
+            ]
+            errors = [process.communicate(timeout=120)[1].decode(errors='replace') for process in processes]
+            exited = all(process.returncode == 0 for process in processes)
+            stored = {t['id'] for t in JSONStorage(mode_dir, mode=mode)._find_sync('email_templates')}
+            results[mode] = exited and len(stored) == 2 * count
+            print(f"{'✅' if results[mode] else '❌'} {mode}: {len(stored)}/{2 * count} inserts from two processes stored")
+            if not exited:
+                print(f"   {errors}")
+
+        return {'success': all(results.values()), **results}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def test_json_storage_indexes():
+    """Queries on id and email use hash indexes that follow inserts, updates and deletes (runs locally)"""
+    print("\n=== Testing JSON storage indexes ===")
+    import sys
+    import shutil
+    import asyncio
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage, DatabaseWrapper, LOG_MODE, _matches
+
+    count = 20000
+    data_dir = tempfile.mkdtemp(prefix='speedy_indexed_storage_')
+    try:
+        accounts = [{'id': f'a{i}', 'email': f'user{i % (count // 2)}@example.com', 'name': f'Account {i}'}
+                    for i in range(count)]
+        with open(os.path.join(data_dir, 'accounts.json'), 'w', encoding='utf-8') as f:
+            json.dump(accounts, f)
+        storage = JSONStorage(data_dir)
+        db = DatabaseWrapper(storage)
+
+        async def change_accounts():
+            await db.email_accounts.insert_one({'id': 'new', 'email': 'user7@example.com', 'name': 'New'})
+            await db.email_accounts.update_one({'id': 'a7'}, {'$set': {'email': 'moved@example.com'}})
+            await db.email_accounts.delete_one({'email': 'user8@example.com'})
+            await db.email_accounts.update_one({'email': 'user9@example.com', 'name': f'Account {count // 2 + 9}'},
+                                               {'$set': {'name': 'Second'}})
+
+        asyncio.run(change_accounts())
+        expected = [dict(a) for a in accounts]
+        expected.append({'id': 'new', 'email': 'user7@example.com', 'name': 'New'})
+        expected[7]['email'] = 'moved@example.com'
+        expected[count // 2 + 9]['name'] = 'Second'
+        del expected[8]
+        queries = [{'id': 'a7'}, {'id': 'a8'}, {'id': 'new'}, {'email': 'user7@example.com'},
+                   {'email': 'moved@example.com'}, {'email': 'user8@example.com'},
+                   {'email': 'user9@example.com'}, {'email': 'user9@example.com', 'name': 'Second'},
+                   {'name': 'Account 3'}, {'id': ['unhashable']}]
+        consistent = all(
+            storage._find_sync('email_accounts', q) == [a for a in expected if _matches(a, q)] for q in queries
+        ) and storage._find_sync('email_accounts') == expected
+        reopened = JSONStorage(data_dir)._find_sync('email_accounts', {'email': 'user7@example.com'})
+        consistent = consistent and [a['id'] for a in reopened] == [f'a{count // 2 + 7}', 'new']
+        print(f"{'✅' if consistent else '❌'} Index lookups match a full scan after insert, update and delete")
+
+        # Writes change the cached collection and its index entries in place instead of copying them
+        accounts_path = storage.collections['email_accounts']
+        cached = storage._cache[accounts_path][1]
+        asyncio.run(db.email_accounts.update_one({'id': 'a3'}, {'$set': {'email': 'in-place@example.com'}}))
+        in_place = (
+            storage._cache[accounts_path][1] is cached
+            and [a['id'] for a in storage._find_sync('email_accounts', {'email': 'in-place@example.com'})] == ['a3']
+        )
+        print(f"{'✅' if in_place else '❌'} Writes update the cached collection in place")
+
+        # Log replay builds the same indexes
+        log_dir = os.path.join(data_dir, 'log')
+        log_db = DatabaseWrapper(JSONStorage(log_dir, mode=LOG_MODE))
+
+        async def log_changes():
+            for i in range(20):
+                await log_db.email_accounts.insert_one({'id': f'l{i}', 'email': f'l{i % 5}@example.com'})
+            await log_db.email_accounts.delete_one({'email': 'l1@example.com'})
+            await log_db.email_accounts.update_one({'id': 'l2'}, {'$set': {'email': 'l4@example.com'}})
+
+        asyncio.run(log_changes())
+        replayed = JSONStorage(log_dir, mode=LOG_MODE)._find_sync('email_accounts', {'email': 'l4@example.com'})
+        replay_ok = [a['id'] for a in replayed] == ['l2', 'l4', 'l9', 'l14', 'l19']
+        print(f"{'✅' if replay_ok else '❌'} Log replay rebuilds the indexes")
+
+        rounds = 200
+        started = time.perf_counter()
+        for i in range(rounds):
+            storage._find_sync('email_accounts', {'email': f'user{i * 37}@example.com'})
+        indexed_ms = (time.perf_counter() - started) * 1000 / rounds
+        data = storage._find_sync('email_accounts')
+        started = time.perf_counter()
+        for i in range(rounds // 10):
+            [a for a in data if _matches(a, {'email': f'user{i * 37}@example.com'})]
+        scan_ms = (time.perf_counter() - started) * 1000 / (rounds // 10)
+        fast = indexed_ms * 10 < scan_ms
+        print(f"{'✅' if fast else '❌'} find() by email on {count} accounts: index {indexed_ms:.3f} ms, "
+              f"scan {scan_ms:.2f} ms")
+
+        success = consistent and in_place and replay_ok and fast
+        return {'success': success, 'consistent': consistent, 'in_place': in_place, 'replayed': replay_ok,
+                'indexed_ms': indexed_ms, 'scan_ms': scan_ms}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def test_paginated_lists():
+    """Storage-level sort/skip/limit/projection, and cursor pages of GET /templates"""
+    print("\n=== Testing paginated template list ===")
+    import sys
+    import shutil
+    import asyncio
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage, DatabaseWrapper, DESCENDING
+
+    data_dir = tempfile.mkdtemp(prefix='speedy_find_storage_')
+    created = []
+    try:
+        db = DatabaseWrapper(JSONStorage(data_dir))
+
+        async def query():
+            for i in range(10):
+                await db.email_templates.insert_one({'id': f't{i}', 'name': f'n{i % 3}', 'body': 'x' * 100})
+            page = await db.email_templates.find({}, {'name': 1, '_id': 0}).sort(
+                [('name', DESCENDING), ('id', 1)]).skip(2).limit(3).to_list(1000)
+            without_body = await db.email_templates.find({'name': 'n1'}, {'body': 0}).to_list(2)
+            return page, without_body
+
+        page, without_body = asyncio.run(query())
+        storage_ok = (
+            page == [{'name': 'n2'}, {'name': 'n1'}, {'name': 'n1'}]
+            and without_body == [{'id': 't1', 'name': 'n1'}, {'id': 't4', 'name': 'n1'}]
+        )
+        print(f"{'✅' if storage_ok else '❌'} find() sorts, skips, limits and projects in the storage layer")
+
+        for i in range(5):
+            response = requests.post(f"{API_BASE}/templates",
+                                     json={'name': f'Paged {i}', 'subject': 'Subject', 'body': 'Body ' * 1000})
+            created.append(response.json()['id'])
+
+        seen, pages, cursor = [], 0, None
+        while True:
+            params = {'limit': 2, 'fields': 'name'}
+            if cursor:
+                params['cursor'] = cursor
+            response = requests.get(f"{API_BASE}/templates", params=params)
+            page = response.json()
+            seen.extend(page)
+            pages += 1
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor or pages > 1000:
+                break
+        ours = [t for t in seen if t['id'] in created]
+        pages_ok = (
+            [t['id'] for t in ours] == created
+            and all(sorted(t) == ['id', 'name'] for t in seen)
+            and len(seen) == len({t['id'] for t in seen})
+        )
+        print(f"{'✅' if pages_ok else '❌'} {pages} pages of 2 names each, every template once and without bodies")
+
+        full = requests.get(f"{API_BASE}/templates").json()
+        full_ok = len(full) == len(seen) and all('body' in t for t in full)
+        print(f"{'✅' if full_ok else '❌'} Without a limit every full template is returned")
+
+        invalid = requests.get(f"{API_BASE}/templates", params={'cursor': 'not-a-cursor'}).status_code == 400
+        print(f"{'✅' if invalid else '❌'} A bad cursor is rejected")
+
+        # Deleting documents between page requests, including the last one sent, skips nothing
+        seen, cursor, deleted = [], None, []
+        while True:
+            params = {'limit': 2, 'fields': 'name'}
+            if cursor:
+                params['cursor'] = cursor
+            response = requests.get(f"{API_BASE}/templates", params=params)
+            page = response.json()
+            seen.extend(t['id'] for t in page)
+            if not deleted and created[1] in seen:
+                deleted = [created[0], page[-1]['id']]
+                for template_id in deleted:
+                    requests.delete(f"{API_BASE}/templates/{template_id}")
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor or len(seen) > 10000:
+                break
+        remaining = [template_id for template_id in created if template_id not in deleted]
+        stable_ok = (
+            bool(deleted) and [t for t in seen if t in remaining] == remaining
+            and len(seen) == len(set(seen))
+        )
+        print(f"{'✅' if stable_ok else '❌'} Deleting an earlier item and the page's last item skipped nothing")
+
+        success = storage_ok and pages_ok and full_ok and invalid and stable_ok
+        return {'success': success, 'storage': storage_ok, 'pages': pages_ok, 'full': full_ok,
+                'invalid_cursor': invalid, 'stable_cursor': stable_ok}
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        for template_id in created:
+            requests.delete(f"{API_BASE}/templates/{template_id}")
+
+def test_batch_job_resume_after_kill():
+    """A batch job killed mid-way resumes on restart and produces the same ZIP as a clean run"""
+    print("\n=== Testing batch job resume after a crash ===")
+    import re
+    import shutil
+    import zipfile
+
+    # Runs its own server, so it can be killed without touching the one under test
+    job_dir = tempfile.mkdtemp(prefix='speedy_jobs_')
+    port = free_port()
+    api = f"http://127.0.0.1:{port}/api"
+    env = {'BATCH_JOB_DIR': job_dir, 'BATCH_JOB_WORKERS': '1'}
+
+    def start_server(log_path):
+        return start_private_server(port, env, log_path)
+
+    def wait_for(job_id, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = requests.get(f"{api}/outlook/batch-jobs/{job_id}").json()
+            if status['state'] not in ('queued', 'running'):
+                return status
+            time.sleep(0.2)
+        return status
+
+    def zip_contents(status):
+        content = requests.get(f"http://127.0.0.1:{port}{status['download_url']}").content
+        contents = {}
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            for name in zf.namelist():
+                text = zf.read(name).decode('utf-8')
+                # MIME boundaries are random and the report is timestamped
+                text = re.sub(r'={15}\d+==', 'BOUNDARY', text)
+                text = re.sub(r'Generated: .*\n', '', text)
+                contents[name] = text
+        return contents
+
+    server = None
+    try:
+        file_count = 120
+        files = [
+            ('pdf_files', (f'statement_{i}.pdf',
+                           create_test_pdf() + f"\n%{i}\n%".encode() + b"0" * (512 * 1024),
+                           'application/pdf'))
+            for i in range(file_count)
+        ]
+        data = {
+            'recipients': json.dumps([
+                {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+                for i in range(file_count)
+            ]),
+            'subject': 'Resumed Statement',
+            'body': '<p>Please find your statement attached.</p>'
+        }
+
+        server = start_server(os.path.join(job_dir, 'server1.log'))
+        job_id = requests.post(f"{api}/outlook/batch-jobs", files=files, data=data).json()['job_id']
+
+        # Kill the server without any chance to clean up once part of the batch is done
+        done_at_kill = 0
+        deadline = time.time() + 60
+        while time.time() < deadline and done_at_kill < 10:
+            done_at_kill = requests.get(f"{api}/outlook/batch-jobs/{job_id}").json()['progress']['done']
+            time.sleep(0.05)
+        server.kill()
+        server.wait()
+        killed_mid_batch = 0 < done_at_kill < file_count
+        print(f"{'✅' if killed_mid_batch else '❌'} Server killed with {done_at_kill}/{file_count} drafts done")
+
+        server_log = os.path.join(job_dir, 'server2.log')
+        server = start_server(server_log)
+        resumed_status = wait_for(job_id)
+        with open(server_log) as f:
+            match = re.search(rf"Resuming batch job {job_id}: (\d+) of (\d+) items left", f.read())
+        items_left = int(match.group(1)) if match else None
+        resumed = (
+            resumed_status['state'] == 'completed'
+            and resumed_status['summary']['successful'] == file_count
+            and items_left is not None and items_left <= file_count - done_at_kill
+        )
+        print(f"{'✅' if resumed else '❌'} Job resumed with {items_left} items left and ended as "
+              f"{resumed_status['state']} ({resumed_status['summary']})")
+
+        clean_status = wait_for(requests.post(f"{api}/outlook/batch-jobs", files=files, data=data).json()['job_id'])
+        resumed_zip = zip_contents(resumed_status)
+        clean_zip = zip_contents(clean_status)
+        matches_clean = resumed_zip == clean_zip and len(resumed_zip) == file_count + 1
+        print(f"{'✅' if matches_clean else '❌'} Resumed ZIP matches a clean run ({len(resumed_zip)} entries)")
+
+        return {
+            'success': killed_mid_batch and resumed and matches_clean,
+            'killed_mid_batch': killed_mid_batch,
+            'resumed': resumed,
+            'matches_clean_run': matches_clean
+        }
+
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def test_light_requests_during_heavy_batch():
+    """Light requests must stay fast while /api/outlook/batch-create is busy"""
+    print("\n=== Testing request latency during a heavy batch ===")
+    
+    # Pad the test PDF so MIME encoding and ZIP compression take real time
+    pdf_content = create_test_pdf() + b"\n%" + b"0" * (1024 * 1024)
+    file_count = 60
+    latency_limit = 0.5  # seconds
+    
+    files = [
+        ('pdf_files', (f'statement_{i}.pdf', pdf_content, 'application/pdf'))
+        for i in range(file_count)
+    ]
+    data = {
+        'recipients': json.dumps([
+            {'filename': f'statement_{i}.pdf', 'email': f'customer{i}@example.com'}
+            for i in range(file_count)
+        ]),
+        'subject': 'Latency Test Statement',
+        'body': '<p>Please find your statement attached.</p>'
+    }
+    
+    batch_result = {}
+    
+    def run_batch():
+        start = time.perf_counter()
+        response = requests.post(f"{API_BASE}/outlook/batch-create", files=files, data=data)
+        batch_result['status_code'] = response.status_code
+        batch_result['elapsed'] = time.perf_counter() - start
+    
+    try:
+        batch_thread = threading.Thread(target=run_batch)
+        batch_thread.start()
+        
+        # Sample light request latency for as long as the batch is running
+        latencies = []
+        while batch_thread.is_alive():
+            start = time.perf_counter()
+            response = requests.get(f"{API_BASE}/templates")
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                print(f"❌ FAIL: GET /api/templates returned {response.status_code}")
+                batch_thread.join()
+                return {'success': False, 'error': f'GET /api/templates returned {response.status_code}'}
+            time.sleep(0.05)
+        batch_thread.join()
+        
+        max_latency = max(latencies) if latencies else 0.0
+        avg_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        
+        print(f"Batch status: {batch_result.get('status_code')} in {batch_result.get('elapsed', 0):.2f}s")
+        print(f"Light requests sampled: {len(latencies)}")
+        print(f"Average latency: {avg_latency * 1000:.1f} ms")
+        print(f"Max latency: {max_latency * 1000:.1f} ms (limit {latency_limit * 1000:.0f} ms)")
+        
+        success = (
+            batch_result.get('status_code') == 200 and
+            len(latencies) > 0 and
+            max_latency < latency_limit
+        )
+        print(f"{'✅' if success else '❌'} Light requests stayed responsive during the batch")
+        
+        return {
+            'success': success,
+            'max_latency': max_latency,
+            'avg_latency': avg_latency,
+            'samples': len(latencies)
+        }
+        
+    except Exception as e:
+        print(f"❌ ERROR: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+def benchmark_email_scanner():
+    """Compare the '@'-anchored email scanner with the old findall regex (runs locally, no server)"""
+    print("\n=== Benchmarking email extraction ===")
+    
+    import re
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from pdf_extraction import extract_emails_from_text
+    
+    legacy_pattern = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+    
+    def legacy_extract(text):
+        return list(set(legacy_pattern.findall(text)))
+    
+    inputs = {
+        'statement text': ''.join(
+            f"Invoice {i:06d}  Service charge  1,234.56  Due 2025-01-31  customer{i % 500}@example.com\n"
+            for i in range(20000)
+        ),
+        'dotted table': ''.join(f"{i:08d}........................1,234.56\n" for i in range(25000)),
+        'dot run': 'a.' * 10000,
+        'hyphen run': 'a-' * 10000 + '@',
+        '@ runs': 'x@' * 40000
+    }
+    
+    results = {}
+    for name, text in inputs.items():
+        start = time.perf_counter()
+        legacy_count = len(legacy_extract(text))
+        legacy_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        scanner_count = len(extract_emails_from_text(text))
+        scanner_time = time.perf_counter() - start
+        
+        match = legacy_count == scanner_count
+        print(f"{'✅' if match else '❌'} {name} ({len(text) / 1024:.0f} KB): "
+              f"regex {legacy_time * 1000:.1f} ms, scanner {scanner_time * 1000:.1f} ms, "
+              f"{scanner_count} emails")
+        results[name] = {
+            'legacy_seconds': legacy_time,
+            'scanner_seconds': scanner_time,
+            'emails': scanner_count,
+            'match': match
+        }
+    
+    return results
+
+def benchmark_draft_builder():
+    """Drafts per second: one MIMEMultipart per draft vs the pre-rendered DraftTemplate (runs locally, no server)"""
+    print("\n=== Benchmarking batch draft generation ===")
+    
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from draft_builder import DraftTemplate
+    
+    subject = 'Your Monthly Statement'
+    body = '<p>Dear Customer,</p>' + '<p>Please find your statement attached.</p>' * 50
+    sender_email = 'accounts@company.com'
+    sender_name = 'Accounts Team'
+    
+    def legacy_render(recipient_email, pdf_content, pdf_filename):
+        msg = MIMEMultipart()
+        msg['To'] = recipient_email
+        msg['Subject'] = subject
+        msg['From'] = f'"{sender_name}" <{sender_email}>'
+        msg['X-Unsent'] = '1'
+        msg['X-UnsentDraft'] = '1'
+        msg.attach(MIMEText(body, 'html'))
+        part = MIMEBase('application', 'pdf')
+        part.set_payload(pdf_content)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename={pdf_filename}')
+        msg.attach(part)
+        return msg.as_string()
+    
+    results = {}
+    for label, pdf_content in (('small PDF', create_test_pdf()), ('200 KB PDF', create_test_pdf() + b"%" * 200 * 1024)):
+        draft_count = 500 if len(pdf_content) < 10000 else 100
+        recipients = [(f'customer{i}@example.com', f'statement_{i}.pdf') for i in range(draft_count)]
+        
+        start = time.perf_counter()
+        for recipient_email, pdf_filename in recipients:
+            legacy_render(recipient_email, pdf_content, pdf_filename)
+        legacy_rate = draft_count / (time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        draft_template = DraftTemplate(subject, body, sender_email, sender_name)
+        for recipient_email, pdf_filename in recipients:
+            draft_template.render(recipient_email, pdf_content, pdf_filename)
+        template_rate = draft_count / (time.perf_counter() - start)
+        
+        print(f"{'✅' if template_rate > legacy_rate else '❌'} {label}: "
+              f"MIMEMultipart {legacy_rate:.0f} drafts/s, DraftTemplate {template_rate:.0f} drafts/s "
+              f"({template_rate / legacy_rate:.1f}x)")
+        results[label] = {'legacy_per_second': legacy_rate, 'template_per_second': template_rate}
+    
+    return results
+
+def benchmark_json_storage():
+    """find() on 10k templates: re-reading templates.json every call vs the in-memory collection cache (runs locally)"""
+    print("\n=== Benchmarking JSON storage reads ===")
+
+    import sys
+    import shutil
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from json_storage import JSONStorage
+
+    data_dir = tempfile.mkdtemp(prefix='speedy_storage_')
+    try:
+        storage = JSONStorage(data_dir)
+        templates_path = storage.collections['email_templates']
+        templates = [
+            {
+                'id': f'template-{i}',
+                'name': f'Template {i}',
+                'subject': f'Statement {i}',
+                'body': '<p>Dear Customer,</p><p>Please find your statement attached.</p>',
+                'created_at': '2024-01-01T00:00:00+00:00'
+            }
+            for i in range(10000)
+        ]
+        with open(templates_path, 'w', encoding='utf-8') as f:
+            json.dump(templates, f, indent=2)
+
+        rounds = 50
+        start = time.perf_counter()
+        for _ in range(rounds):
+            uncached = [dict(item) for item in storage._read_file(templates_path)]
+        reread_ms = (time.perf_counter() - start) * 1000 / rounds
+
+        storage._find_sync('email_templates')  # first load
+        start = time.perf_counter()
+        for _ in range(rounds):
+            cached = storage._find_sync('email_templates')
+        cached_ms = (time.perf_counter() - start) * 1000 / rounds
+
+        # A change made by another process is picked up on the next read
+        time.sleep(0.01)
+        with open(templates_path, 'w', encoding='utf-8') as f:
+            json.dump(templates[:10], f)
+        reloaded = len(storage._find_sync('email_templates')) == 10
+
+        faster = cached == uncached and cached_ms < reread_ms
+        print(f"{'✅' if faster else '❌'} find() on 10k templates: re-read {reread_ms:.1f} ms, "
+              f"cached {cached_ms:.1f} ms ({reread_ms / cached_ms:.1f}x)")
+        print(f"{'✅' if reloaded else '❌'} External change to templates.json invalidates the cache")
+        return {'reread_ms': reread_ms, 'cached_ms': cached_ms, 'reloaded': reloaded}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def benchmark_streaming_draft_memory():
+    """Peak memory of writing one draft: in-memory MIMEMultipart vs the streaming DraftTemplate.write (no server)"""
+    print("\n=== Benchmarking draft memory use ===")
+    
+    import sys
+    import tracemalloc
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from draft_builder import DraftTemplate
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        eml_path = os.path.join(temp_dir, 'draft.eml')
+        for size_mb in (5, 40):
+            pdf_path = os.path.join(temp_dir, f'statement_{size_mb}mb.pdf')
+            with open(pdf_path, 'wb') as f:
+                f.write(create_test_pdf() + b"%" * (size_mb * 1024 * 1024))
+            
+            # Old path: read the whole PDF, encode it, serialise the message
+            tracemalloc.start()
+            with open(pdf_path, 'rb') as f:
+                pdf_content = f.read()
+            msg = MIMEMultipart()
+            msg['To'] = 'customer@example.com'
+            msg['Subject'] = 'Statement'
+            msg.attach(MIMEText('<p>Statement attached.</p>', 'html'))
+            part = MIMEBase('application', 'pdf')
+            part.set_payload(pdf_content)
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', 'attachment; filename=statement.pdf')
+            msg.attach(part)
+            with open(eml_path, 'w', encoding='utf-8') as eml_file:
+                eml_file.write(msg.as_string())
+            legacy_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del pdf_content, msg, part
+            
+            # Streaming path
+            tracemalloc.start()
+            DraftTemplate('Statement', '<p>Statement attached.</p>').write_path(
+                eml_path, 'customer@example.com', pdf_path, 'statement.pdf'
+            )
+            streaming_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            
+            bounded = streaming_peak < 8 * 1024 * 1024
+            print(f"{'✅' if bounded else '❌'} {size_mb} MB PDF: in-memory peak {legacy_peak / 1024 / 1024:.1f} MB, "
+                  f"streaming peak {streaming_peak / 1024 / 1024:.1f} MB")
+            results[f'{size_mb}mb'] = {'legacy_peak': legacy_peak, 'streaming_peak': streaming_peak}
+    
+    return results
+
 def main():
     """Run all backend tests"""
     print("🚀 Starting Backend API Tests for Outlook Draft Generation")
@@ -350,6 +2276,29 @@ def main():
     # Test both endpoints
     draft_result = test_outlook_draft_endpoint()
     upload_result = test_outlook_draft_upload_endpoint()
+    session_result = test_draft_from_upload_session()
+    session_expiry_result = test_upload_session_expiry()
+    early_exit_result = test_early_exit_extraction()
+    extract_stream_result = test_streamed_extraction()
+    folder_index_result = test_incremental_folder_scan()
+    pool_result = test_supervised_pool()
+    cache_result = test_extraction_cache()
+    stream_result = test_streamed_batch_zip()
+    job_result = test_batch_job_lifecycle()
+    paths_result = test_batch_job_from_paths()
+    resume_result = test_batch_job_resume_after_kill()
+    directory_result = test_directory_output()
+    mbox_result = test_mbox_export()
+    artifact_result = test_artifact_store()
+    range_result = test_resumable_download()
+    send_extensions_result = test_range_response_send_extensions()
+    workers_result = test_multiple_workers()
+    log_storage_result = test_json_storage_log_mode()
+    concurrent_storage_result = test_json_storage_concurrent_writes()
+    shared_storage_result = test_json_storage_multiple_processes()
+    index_storage_result = test_json_storage_indexes()
+    pagination_result = test_paginated_lists()
+    latency_result = test_light_requests_during_heavy_batch()
     
     # Overall summary
     print("\n" + "=" * 60)
@@ -370,6 +2319,30 @@ def main():
         print(f"  - PDF Attachment: {'✅' if upload_result.get('pdf_attachment') else '❌'}")
         print(f"  - Body Content: {'✅' if upload_result.get('body_content') else '❌'}")
     
+    print(f"Drafts from upload sessions: {'✅ PASS' if session_result.get('success') else '❌ FAIL'}")
+    print(f"Upload session expiry: {'✅ PASS' if session_expiry_result.get('success') else '❌ FAIL'}")
+    print(f"Early-exit extraction: {'✅ PASS' if early_exit_result.get('success') else '❌ FAIL'}")
+    print(f"Streamed extraction: {'✅ PASS' if extract_stream_result.get('success') else '❌ FAIL'}")
+    print(f"Incremental folder scans: {'✅ PASS' if folder_index_result.get('success') else '❌ FAIL'}")
+    print(f"Supervised extraction workers: {'✅ PASS' if pool_result.get('success') else '❌ FAIL'}")
+    print(f"Extraction cache: {'✅ PASS' if cache_result.get('success') else '❌ FAIL'}")
+    print(f"Streamed batch ZIP: {'✅ PASS' if stream_result.get('success') else '❌ FAIL'}")
+    print(f"Background batch jobs: {'✅ PASS' if job_result.get('success') else '❌ FAIL'}")
+    print(f"Batch jobs from folder paths: {'✅ PASS' if paths_result.get('success') else '❌ FAIL'}")
+    print(f"Batch job resume after crash: {'✅ PASS' if resume_result.get('success') else '❌ FAIL'}")
+    print(f"Direct-to-directory output: {'✅ PASS' if directory_result.get('success') else '❌ FAIL'}")
+    print(f"Mbox export: {'✅ PASS' if mbox_result.get('success') else '❌ FAIL'}")
+    print(f"Bounded artifact store: {'✅ PASS' if artifact_result.get('success') else '❌ FAIL'}")
+    print(f"Resumable downloads: {'✅ PASS' if range_result.get('success') else '❌ FAIL'}")
+    print(f"File send extensions: {'✅ PASS' if send_extensions_result.get('success') else '❌ FAIL'}")
+    print(f"Multi-worker deployment: {'✅ PASS' if workers_result.get('success') else '❌ FAIL'}")
+    print(f"JSON storage log mode: {'✅ PASS' if log_storage_result.get('success') else '❌ FAIL'}")
+    print(f"JSON storage concurrent writes: {'✅ PASS' if concurrent_storage_result.get('success') else '❌ FAIL'}")
+    print(f"JSON storage multiple processes: {'✅ PASS' if shared_storage_result.get('success') else '❌ FAIL'}")
+    print(f"JSON storage indexes: {'✅ PASS' if index_storage_result.get('success') else '❌ FAIL'}")
+    print(f"Paginated template list: {'✅ PASS' if pagination_result.get('success') else '❌ FAIL'}")
+    print(f"Latency during heavy batch: {'✅ PASS' if latency_result.get('success') else '❌ FAIL'}")
+    
     # Determine overall success
     overall_success = (
         draft_result.get('success', False) and 
@@ -393,8 +2366,38 @@ def main():
     return {
         'overall_success': overall_success,
         'draft_endpoint': draft_result,
-        'upload_endpoint': upload_result
+        'upload_endpoint': upload_result,
+        'upload_sessions': session_result,
+        'upload_session_expiry': session_expiry_result,
+        'early_exit_extraction': early_exit_result,
+        'streamed_extraction': extract_stream_result,
+        'incremental_folder_scan': folder_index_result,
+        'supervised_pool': pool_result,
+        'extraction_cache': cache_result,
+        'streamed_batch': stream_result,
+        'batch_jobs': job_result,
+        'batch_jobs_from_paths': paths_result,
+        'batch_job_resume': resume_result,
+        'directory_output': directory_result,
+        'mbox_export': mbox_result,
+        'artifact_store': artifact_result,
+        'resumable_download': range_result,
+        'send_extensions': send_extensions_result,
+        'multiple_workers': workers_result,
+        'json_storage_log_mode': log_storage_result,
+        'json_storage_concurrent_writes': concurrent_storage_result,
+        'json_storage_multiple_processes': shared_storage_result,
+        'json_storage_indexes': index_storage_result,
+        'paginated_lists': pagination_result,
+        'latency_during_batch': latency_result
     }
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    if '--bench' in sys.argv:
+        benchmark_email_scanner()
+        benchmark_draft_builder()
+        benchmark_streaming_draft_memory()
+        benchmark_json_storage()
+    else:
+        main()
\ No newline at end of file
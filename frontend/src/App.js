@@ -288,6 +288,13 @@ function App() {
 
     toast.info(`Processing ${selectedPdfs.length} statement(s)...`, { duration: 3000 });
 
+    // Folder path method: the server reads the PDFs itself, so send the whole batch as one job
+    if (uploadedFiles.length === 0) {
+      await generateDraftsFromPaths(senderEmail, senderName, finalEmailBody);
+      setLoading(false);
+      return;
+    }
+
     for (const pdfFilename of selectedPdfs) {
       const pdf = pdfs.find(p => p.filename === pdfFilename);
       if (!pdf || pdf.emails.length === 0) {
@@ -301,34 +308,24 @@ function App() {
       try {
         let response;
         
-        // Check if using uploaded files or folder path
-        if (uploadedFiles.length > 0) {
-          const file = uploadedFiles.find(f => f.name === pdfFilename);
-          if (file) {
-            const formData = new FormData();
+        // Uploaded files: one draft per request
+        const file = uploadedFiles.find(f => f.name === pdfFilename);
+        if (file) {
+          const formData = new FormData();
+          // The server kept the PDF from the extract step, so only send it again if it has no upload ID
+          if (pdf.upload_id) {
+            formData.append('upload_id', pdf.upload_id);
+          } else {
             formData.append('pdf_file', file);
-            formData.append('recipient_email', recipientEmail);
-            formData.append('subject', emailSubject);
-            formData.append('body', finalEmailBody);
-            if (senderEmail) formData.append('sender_email', senderEmail);
-            if (senderName) formData.append('sender_name', senderName);
-
-            response = await axios.post(`${API}/outlook/draft-upload`, formData, {
-              headers: { 'Content-Type': 'multipart/form-data' },
-              responseType: 'blob'
-            });
           }
-        } else {
-          // Use folder path method
-          response = await axios.post(`${API}/outlook/draft`, {
-            pdf_filename: pdf.filename,
-            pdf_path: pdf.file_path,
-            recipient_email: recipientEmail,
-            sender_email: senderEmail,
-            sender_name: senderName,
-            subject: emailSubject,
-            body: finalEmailBody
-          }, {
+          formData.append('recipient_email', recipientEmail);
+          formData.append('subject', emailSubject);
+          formData.append('body', finalEmailBody);
+          if (senderEmail) formData.append('sender_email', senderEmail);
+          if (senderName) formData.append('sender_name', senderName);
+
+          response = await axios.post(`${API}/outlook/draft-upload`, formData, {
+            headers: { 'Content-Type': 'multipart/form-data' },
             responseType: 'blob'
           });
         }
@@ -391,6 +388,68 @@ function App() {
     }
   };
 
+  // Folder path method: one server-side batch job for all selected PDFs, downloaded as a single ZIP
+  const generateDraftsFromPaths = async (senderEmail, senderName, finalEmailBody) => {
+    const items = [];
+    let skippedCount = 0;
+    for (const pdfFilename of selectedPdfs) {
+      const pdf = pdfs.find(p => p.filename === pdfFilename);
+      if (!pdf || pdf.emails.length === 0) {
+        toast.warning(`No email found in ${pdfFilename}`);
+        skippedCount++;
+        continue;
+      }
+      items.push({
+        pdf_filename: pdf.filename,
+        pdf_path: pdf.file_path,
+        recipient_email: pdf.emails[0]
+      });
+    }
+
+    if (items.length === 0) {
+      toast.error("Failed to generate any draft emails.");
+      return;
+    }
+
+    try {
+      const submitted = await axios.post(`${API}/outlook/batch-jobs/paths`, {
+        items,
+        subject: emailSubject,
+        body: finalEmailBody,
+        sender_email: senderEmail,
+        sender_name: senderName
+      });
+
+      // Poll until the job has finished
+      let job;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        job = (await axios.get(`${BACKEND_URL}${submitted.data.status_url}`)).data;
+      } while (job.state === 'queued' || job.state === 'running');
+
+      if (job.state !== 'completed') {
+        toast.error(`Batch ${job.state}${job.error ? `: ${job.error}` : ''}`);
+        return;
+      }
+
+      // Open the download URL directly
+      window.open(`${BACKEND_URL}${job.download_url}`, '_blank');
+
+      const failedCount = job.summary.failed + skippedCount;
+      if (job.summary.successful > 0) {
+        toast.success(`Generated ${job.summary.successful} draft email(s)!`, {
+          duration: 8000,
+          description: `Check your Downloads folder for the ZIP of .eml files and the report.${failedCount > 0 ? ` (${failedCount} failed)` : ''}`
+        });
+      } else {
+        toast.error("Failed to generate any draft emails.");
+      }
+    } catch (error) {
+      console.error('Error generating drafts from folder:', error);
+      toast.error("Failed to generate draft emails");
+    }
+  };
+
   // Helper function kept for standalone app compatibility
   const downloadFile = async (blob, filename) => {
     try {
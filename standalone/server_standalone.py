@@ -21,6 +21,8 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import sqlite3
 import json
 
@@ -149,6 +151,39 @@ def extract_text_from_pdf_file(pdf_file: bytes) -> str:
         return ""
 
 
+# Parallel PDF extraction (embedded)
+def extract_emails_from_pdf(pdf_path: str) -> List[str]:
+    """Extract emails from a PDF on disk (runs inside a worker process)"""
+    return extract_emails_from_text(extract_text_from_pdf(pdf_path))
+
+
+def extract_worker_count() -> int:
+    """Worker processes to use: PDF_EXTRACT_WORKERS, or the number of CPUs"""
+    configured = os.environ.get('PDF_EXTRACT_WORKERS', '')
+    if configured.isdigit() and int(configured) > 0:
+        return int(configured)
+    return os.cpu_count() or 1
+
+
+extraction_pool = None
+
+
+def extract_emails_from_pdfs_parallel(pdf_paths: List[str]) -> List[List[str]]:
+    """Extract emails from many PDFs in a process pool, keeping input order"""
+    global extraction_pool
+    workers = extract_worker_count()
+    if workers == 1 or len(pdf_paths) <= 1:
+        return [extract_emails_from_pdf(path) for path in pdf_paths]
+    
+    if extraction_pool is None:
+        extraction_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    chunksize = max(1, len(pdf_paths) // (workers * 4))
+    return list(extraction_pool.map(extract_emails_from_pdf, pdf_paths, chunksize=chunksize))
+
+
 # Email Account Routes
 @api_router.get("/email-accounts", response_model=List[EmailAccount])
 async def get_email_accounts():
@@ -268,11 +303,10 @@ async def extract_emails_from_pdfs(request: ExtractRequest):
     if not pdf_files:
         raise HTTPException(status_code=404, detail="No PDF files found in the specified folder")
     
-    for pdf_file in pdf_files:
-        file_path = os.path.join(folder_path, pdf_file)
-        text = extract_text_from_pdf(file_path)
-        emails = extract_emails_from_text(text)
-        
+    file_paths = [os.path.join(folder_path, pdf_file) for pdf_file in pdf_files]
+    all_emails = extract_emails_from_pdfs_parallel(file_paths)
+    
+    for pdf_file, file_path, emails in zip(pdf_files, file_paths, all_emails):
         results.append(PDFExtraction(
             filename=pdf_file,
             emails=emails,
@@ -289,6 +323,7 @@ async def upload_and_extract_emails(files: List[UploadFile] = File(...)):
         raise HTTPException(status_code=400, detail="No files uploaded")
     
     results = []
+    saved_files = []
     temp_dir = DATA_DIR / 'temp'
     temp_dir.mkdir(exist_ok=True)
     
@@ -297,17 +332,20 @@ async def upload_and_extract_emails(files: List[UploadFile] = File(...)):
             continue
         
         content = await file.read()
-        text = extract_text_from_pdf_file(content)
-        emails = extract_emails_from_text(text)
         
         temp_path = temp_dir / f"{uuid.uuid4().hex}_{file.filename}"
         with open(temp_path, 'wb') as f:
             f.write(content)
         
+        saved_files.append((file.filename, str(temp_path)))
+    
+    all_emails = extract_emails_from_pdfs_parallel([temp_path for _, temp_path in saved_files])
+    
+    for (filename, temp_path), emails in zip(saved_files, all_emails):
         results.append(PDFExtraction(
-            filename=file.filename,
+            filename=filename,
             emails=emails,
-            file_path=str(temp_path)
+            file_path=temp_path
         ))
     
     if not results:
@@ -443,6 +481,9 @@ logger = logging.getLogger(__name__)
 
 
 if __name__ == "__main__":
+    # Required so worker processes start correctly in the frozen executable
+    multiprocessing.freeze_support()
+    
     import uvicorn
     import sys
     